@@ -0,0 +1,97 @@
+"""
+Hive db statement batches
+This module runs several statements in one hive invocation.  A
+marker is echoed after every statement, so the combined stdout can be
+split back into one result set per statement.  Sections are read in
+order from the shared stream; reading a later section skips whatever
+is left of the earlier ones.
+
+Used by cursor.execute_batch().
+"""
+
+from query import marker_statements, marker_line
+from errors import ProgrammingError
+
+def _token(token, index):
+    return '%s-%d' % (token, index)
+
+def script(statements, token):
+    """One hive script running statements, each followed by its
+    marker."""
+    parts = []
+    for index, statement in enumerate(statements):
+        parts.append('%s;\n%s' % (statement.strip().rstrip(';'),
+                                  marker_statements(_token(token, index))))
+    return '\n'.join(parts)
+
+
+class ResultDemux(object):
+
+    """Splits the output of a script() run into count sections.
+
+    failure() returns the FAILED line of the statements run so far,
+    if any.  It is checked at the end of every section, for streams
+    (pooled sessions) that go on after a statement failed; a failed
+    section raises ProgrammingError and later sections are empty.
+    """
+
+    def __init__(self, stream, token, count, failure=None):
+        self.stream = stream
+        self.markers = [marker_line(_token(token, i)) for i in range(count)]
+        self.current = 0
+        self.failure = failure
+
+    def readline(self, index):
+        while self.current < index:
+            while self.readline(self.current):
+                pass
+        if self.current > index:
+            return ''
+        line = self.stream.readline()
+        if not line:
+            # hive stopped early, e.g. a statement failed
+            self.current = len(self.markers)
+            return ''
+        if line.rstrip('\n') == self.markers[index]:
+            self._check()
+            self.current += 1
+            if self.current == len(self.markers):
+                # read to the end, so hive's exit status is checked
+                # and a pooled session is released
+                while self.stream.readline():
+                    pass
+            return ''
+        return line
+
+    def _check(self):
+        failed = self.failure is not None and self.failure()
+        if failed:
+            self.close()
+            raise ProgrammingError(failed)
+
+    def section(self, index):
+        return SectionReader(self, index)
+
+    def close(self):
+        self.current = len(self.markers)
+        if hasattr(self.stream, 'close'):
+            self.stream.close()
+
+
+class SectionReader(object):
+
+    """File-like view of one statement's output in a batch.  Closing
+    any section closes the whole stream."""
+
+    def __init__(self, demux, index):
+        self.demux = demux
+        self.index = index
+
+    def readline(self):
+        return self.demux.readline(self.index)
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        self.demux.close()
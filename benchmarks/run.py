@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""
+hivedb client benchmarks
+
+Runs the cursors against benchmarks/bin/hive, a stand-in for the
+HIVE CLI that produces synthetic results, so client-side performance
+can be measured without a cluster.  Each scenario runs in its own
+process so peak RSS belongs to that scenario alone.
+
+    python benchmarks/run.py [--rows N] [--repeat N] [scenario ...]
+
+Results are written to benchmarks/results/<version>-<time>.json and
+compared with the newest earlier result file (or --compare FILE).
+For the small_queries scenarios "rows" counts queries.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import glob
+import resource
+import optparse
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+RESULTS = os.path.join(HERE, 'results')
+
+def _connection(**kwargs):
+    import connections
+    return connections.Connection(verbose=False, **kwargs)
+
+def _drain_sets(cursor):
+    rows = len(cursor.fetchall())
+    while cursor.nextset():
+        rows += len(cursor.fetchall())
+    return rows
+
+def cursor_fetchall(options):
+    cursor = _connection().cursor()
+    cursor.execute('select * from bench')
+    return len(cursor.fetchall())
+
+def cursor_fetchmany(options):
+    cursor = _connection().cursor()
+    cursor.arraysize = 1000
+    cursor.execute('select * from bench')
+    rows = 0
+    while True:
+        batch = [row for row in cursor.fetchmany() if row is not None]
+        if not batch:
+            return rows
+        rows += len(batch)
+
+def cursor_fetchone(options):
+    cursor = _connection().cursor()
+    cursor.execute('select * from bench')
+    rows = 0
+    for row in cursor:
+        rows += 1
+    return rows
+
+def cursor_fetchall_parallel(options):
+    cursor = _connection().cursor()
+    cursor.decode_workers = 4
+    cursor.execute('select * from bench')
+    try:
+        return len(cursor.fetchall())
+    finally:
+        cursor.close()
+
+def dictcursor_fetchall(options):
+    import cursors
+    cursor = _connection().cursor(cursors.DictCursor)
+    cursor.execute('select * from bench')
+    return len(cursor.fetchall())
+
+def storecursor_twice(options):
+    import cursors
+    cursor = _connection().cursor(cursors.StoreCursor)
+    cursor.execute('select * from bench')
+    rows = len(cursor.fetchall())
+    cursor.scroll(0, 'absolute')
+    return rows + len(cursor.fetchall())
+
+def triggeredcursor(options):
+    import cursors
+    cursor = _connection().cursor(cursors.TriggeredCursor)
+    cursor.settriggers(('t.c0',))
+    cursor.execute('select * from bench')
+    return _drain_sets(cursor)
+
+def cursor_groups(options):
+    cursor = _connection().cursor()
+    cursor.execute('select * from bench')
+    rows = 0
+    for key, group in cursor.groups('t.c0'):
+        for row in group:
+            rows += 1
+    return rows
+
+def columnar(options):
+    cursor = _connection().cursor()
+    cursor.execute('select * from bench')
+    return len(cursor.fetchall_columnar()[0].values)
+
+def executemany(options):
+    cursor = _connection().cursor()
+    cursor.executemany('select * from bench where part = %s',
+                       range(options.sets))
+    return _drain_sets(cursor)
+
+def copy_to_tsv(options):
+    cursor = _connection().cursor()
+    cursor.execute('select * from bench')
+    return cursor.copy_to(os.devnull)
+
+def copy_to_csv(options):
+    cursor = _connection().cursor()
+    cursor.execute('select * from bench')
+    return cursor.copy_to(os.devnull, format='csv')
+
+def small_queries(options):
+    cursor = _connection().cursor()
+    for i in range(options.sets):
+        cursor.execute('select * from bench limit 10')
+        cursor.fetchall()
+    return options.sets
+
+def small_queries_pooled(options):
+    connection = _connection(pool_size=2)
+    cursor = connection.cursor()
+    try:
+        for i in range(options.sets):
+            cursor.execute('select * from bench limit 10')
+            cursor.fetchall()
+    finally:
+        cursor.close()
+        connection.close()
+    return options.sets
+
+NUMERIC = 'int,float,int,float,int'
+
+# name -> (function, environment for the fake hive)
+SCENARIOS = [
+    ('cursor_fetchall', cursor_fetchall, {}),
+    ('cursor_fetchmany', cursor_fetchmany, {}),
+    ('cursor_fetchone', cursor_fetchone, {}),
+    ('cursor_fetchall_parallel', cursor_fetchall_parallel,
+     {'FAKEHIVE_COLUMNS': 'json,json,json,str'}),
+    ('dictcursor_fetchall', dictcursor_fetchall, {}),
+    ('storecursor_twice', storecursor_twice, {}),
+    ('triggeredcursor', triggeredcursor, {'FAKEHIVE_GROUP': '100'}),
+    ('cursor_groups', cursor_groups, {'FAKEHIVE_GROUP': '100'}),
+    # the same numeric columns fetched as rows and as columns
+    ('columnar_rows', cursor_fetchall, {'FAKEHIVE_COLUMNS': NUMERIC}),
+    ('columnar', columnar, {'FAKEHIVE_COLUMNS': NUMERIC}),
+    ('copy_to_tsv', copy_to_tsv, {}),
+    ('copy_to_csv', copy_to_csv, {}),
+    ('executemany', executemany, {'ROWS_DIVISOR': 'sets'}),
+    ('small_queries', small_queries,
+     {'FAKEHIVE_ROWS': '10', 'FAKEHIVE_STARTUP': 'startup'}),
+    ('small_queries_pooled', small_queries_pooled,
+     {'FAKEHIVE_ROWS': '10', 'FAKEHIVE_STARTUP': 'startup'}),
+]
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[int(round(p / 100.0 * (len(ordered) - 1)))]
+
+def child(name, options):
+    """Run one scenario options.repeat times in this process and
+    print its measurements as JSON."""
+    sys.path.insert(0, ROOT)
+    function = dict([(s[0], s[1]) for s in SCENARIOS])[name]
+    timings = []
+    rows = 0
+    for i in range(options.repeat):
+        started = time.time()
+        rows = function(options)
+        timings.append(time.time() - started)
+    median = percentile(timings, 50)
+    print json.dumps({
+        'rows': rows,
+        'rows_per_sec': median and rows / median,
+        'latency': dict([('p%d' % p, percentile(timings, p))
+                         for p in (50, 90, 99)]),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    })
+
+def environment(overrides, options):
+    env = dict(os.environ)
+    env['PATH'] = os.path.join(HERE, 'bin') + os.pathsep + env['PATH']
+    env['FAKEHIVE_ROWS'] = str(options.rows)
+    env['FAKEHIVE_NULLS'] = str(options.nulls)
+    env['FAKEHIVE_COLUMNS'] = options.columns
+    env['FAKEHIVE_STARTUP'] = '0'
+    for key, value in overrides.items():
+        if value == 'startup':
+            value = str(options.startup)
+        if key == 'ROWS_DIVISOR':
+            env['FAKEHIVE_ROWS'] = str(max(1, options.rows / options.sets))
+            continue
+        env[key] = value
+    return env
+
+def version():
+    source = open(os.path.join(ROOT, '__init__.py')).read()
+    return re.search(r"__version__ = '([^']+)'", source).group(1)
+
+def compare(current, previous_path):
+    previous = json.load(open(previous_path))['scenarios']
+    print '\ncompared with %s' % os.path.basename(previous_path)
+    for name, result in sorted(current.items()):
+        before = previous.get(name)
+        if not before or not before.get('rows_per_sec'):
+            continue
+        ratio = result['rows_per_sec'] / before['rows_per_sec']
+        print '  %-22s rows/sec x%.2f  p50 %.3fs -> %.3fs' % (
+            name, ratio, before['latency']['p50'], result['latency']['p50'])
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [scenario ...]')
+    parser.add_option('--rows', type='int', default=200000)
+    parser.add_option('--repeat', type='int', default=5)
+    parser.add_option('--sets', type='int', default=20,
+                      help='parameter sets / small queries per run')
+    parser.add_option('--nulls', type='float', default=0.05)
+    parser.add_option('--columns', default='float,str,json')
+    parser.add_option('--startup', type='float', default=0.5,
+                      help='simulated JVM startup for small queries')
+    parser.add_option('--compare', help='result file to compare with')
+    parser.add_option('--no-save', action='store_true')
+    parser.add_option('--child', help=optparse.SUPPRESS_HELP)
+    options, names = parser.parse_args()
+    if options.child:
+        return child(options.child, options)
+
+    names = names or [s[0] for s in SCENARIOS]
+    results = {}
+    for name, function, overrides in SCENARIOS:
+        if name not in names:
+            continue
+        args = [sys.executable, os.path.abspath(__file__), '--child', name,
+                '--rows', str(options.rows), '--repeat', str(options.repeat),
+                '--sets', str(options.sets)]
+        output = subprocess.check_output(args,
+                                         env=environment(overrides, options))
+        results[name] = json.loads(output.strip().splitlines()[-1])
+        result = results[name]
+        print '%-22s %10.0f rows/s  p50 %.3fs  p90 %.3fs  p99 %.3fs  ' \
+            'rss %6d KB' % (name, result['rows_per_sec'],
+                            result['latency']['p50'],
+                            result['latency']['p90'],
+                            result['latency']['p99'], result['peak_rss_kb'])
+
+    previous = sorted(glob.glob(os.path.join(RESULTS, '*.json')),
+                      key=os.path.getmtime)
+    if not options.no_save:
+        if not os.path.isdir(RESULTS):
+            os.makedirs(RESULTS)
+        path = os.path.join(RESULTS, '%s-%s.json' % (
+            version(), time.strftime('%Y%m%d-%H%M%S')))
+        json.dump({'version': version(), 'python': sys.version.split()[0],
+                   'options': vars(options), 'scenarios': results},
+                  open(path, 'w'), indent=2, sort_keys=True)
+        print '\nsaved %s' % os.path.relpath(path)
+    if options.compare or previous:
+        compare(results, options.compare or previous[-1])
+
+if __name__ == '__main__':
+    main()
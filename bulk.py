@@ -0,0 +1,144 @@
+"""
+Hive db bulk loading
+This module turns many rows into one hive job.  Rows are written to
+local staging files in hive's delimited text format, loaded into a
+staging table with LOAD DATA LOCAL INPATH and copied into the target
+table with one INSERT ... SELECT, all in a single hive invocation.
+
+Used by cursor.load_rows(), and by executemany() for INSERT ...
+VALUES templates.
+"""
+
+import os
+import re
+import uuid
+import shutil
+import tempfile
+import simplejson as json
+from errors import ProgrammingError
+
+NULL = '\\N'
+
+INSERT_RE = re.compile(r'^\s*insert\s+(into|overwrite)\s+table\s+([\w.]+)\s*'
+                       r'(?:partition\s*\((.*?)\)\s*)?'
+                       r'values\s*\((.*)\)\s*;?\s*$', re.I | re.S)
+PLACEHOLDER_RE = re.compile(r"^'?%(?:\((\w+)\))?s'?$")
+
+_escapes = [('\\', '\\\\'), ('\t', '\\\t'), ('\n', '\\n'), ('\r', '\\r')]
+
+def format_value(value):
+    """One cell of a staging file."""
+    if value is None:
+        return NULL
+    if isinstance(value, bool):
+        return value and 'true' or 'false'
+    if isinstance(value, (int, long)):
+        return str(value)
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, (dict, list, tuple)):
+        value = json.dumps(value)
+    elif isinstance(value, unicode):
+        value = value.encode('utf-8')
+    else:
+        value = str(value)
+    for char, escaped in _escapes:
+        if char in value:
+            value = value.replace(char, escaped)
+    return value
+
+def format_row(row):
+    return '\t'.join([format_value(value) for value in row]) + '\n'
+
+def parse_insert(query):
+    """(overwrite, table, partition, names) for an INSERT INTO|OVERWRITE
+    TABLE ... VALUES template whose values are all placeholders, else
+    None.  names is None for %s placeholders, the keys for %(key)s."""
+    match = INSERT_RE.match(query)
+    if match is None:
+        return None
+    mode, table, partition, values = match.groups()
+    keys = []
+    for value in values.split(','):
+        placeholder = PLACEHOLDER_RE.match(value.strip())
+        if placeholder is None:
+            return None
+        keys.append(placeholder.group(1))
+    if None in keys:
+        if [key for key in keys if key is not None]:
+            return None
+        keys = None
+    return mode.lower() == 'overwrite', table, partition, keys
+
+def partition_spec(partition):
+    """PARTITION clause contents from a {column: value} mapping or a
+    ready made string."""
+    if partition is None or isinstance(partition, basestring):
+        return partition
+    return ', '.join(["%s='%s'" % (column, str(value).replace("'", "\\'"))
+                      for column, value in sorted(partition.items())])
+
+
+class StagingFiles(object):
+
+    """Writes rows to a local directory of staging files, starting a
+    new file every chunk_rows rows.  The directory is readable by
+    other users, since hive may run as another one (write_access)."""
+
+    def __init__(self, chunk_rows=1000000, directory=None):
+        self.chunk_rows = chunk_rows
+        self.path = tempfile.mkdtemp(prefix='hivedb-load-', dir=directory)
+        os.chmod(self.path, 0755)
+        self.rows = 0
+        self.columns = None
+        self.files = 0
+        self._file = None
+
+    def _next_file(self):
+        if self._file is not None:
+            self._file.close()
+        path = os.path.join(self.path, 'part-%05d' % self.files)
+        self._file = open(path, 'wb')
+        os.chmod(path, 0644)
+        self.files += 1
+
+    def write(self, rows):
+        for row in rows:
+            if self.columns is None:
+                self.columns = len(row)
+            elif len(row) != self.columns:
+                raise ProgrammingError('row %d has %d values, expected %d'
+                                       % (self.rows, len(row), self.columns))
+            if self.rows % self.chunk_rows == 0:
+                self._next_file()
+            self._file.write(format_row(row))
+            self.rows += 1
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def cleanup(self):
+        if self._file is not None:
+            self._file.close()
+        shutil.rmtree(self.path, True)
+
+def staging_table():
+    return 'hivedb_stage_%s' % uuid.uuid4().hex
+
+def load_statements(staging, stage, table, columns, partition=None,
+                    overwrite=False):
+    """The statements that move the files of staging directory
+    staging through staging table stage into table."""
+    names = ['c%d' % i for i in range(columns)]
+    spec = partition_spec(partition)
+    return [
+        "CREATE TABLE %s (%s) ROW FORMAT DELIMITED FIELDS TERMINATED BY "
+        "'\\t' ESCAPED BY '\\\\' STORED AS TEXTFILE "
+        "TBLPROPERTIES ('serialization.escape.crlf'='true')"
+        % (stage, ', '.join(['%s string' % name for name in names])),
+        "LOAD DATA LOCAL INPATH '%s' INTO TABLE %s" % (staging, stage),
+        "INSERT %s TABLE %s%s SELECT %s FROM %s"
+        % (overwrite and 'OVERWRITE' or 'INTO', table,
+           spec and ' PARTITION (%s)' % spec or '', ', '.join(names), stage),
+        "DROP TABLE %s" % stage,
+    ]
@@ -0,0 +1,259 @@
+"""
+Hive db result cache
+This module keeps results of repeated queries on local disk so the
+same SELECT does not run a MapReduce job every time.  Entries are
+the raw hive output (header included), gzip compressed, keyed by the
+normalized statement and the connection settings that change what
+hive returns.  The cache is size capped with LRU eviction, and every
+entry has a TTL.
+
+Pass a ResultCache to Connection(result_cache=...) to enable it.
+"""
+
+import os
+import re
+import time
+import gzip
+import uuid
+import hashlib
+import logging
+from threading import Lock
+from query import Query
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CACHEABLE_RE = re.compile(r'^\s*(?:select|with)\b', re.I)
+
+def normalize(query):
+    """Collapse whitespace and drop trailing semicolons."""
+    return ' '.join(query.split()).rstrip(';').rstrip()
+
+def cacheable(query):
+    return bool(CACHEABLE_RE.match(query))
+
+
+class ResultCache(object):
+
+    """A directory of compressed query results.
+
+    directory
+        string, where results are kept.  created if missing.
+
+    max_bytes
+        integer, default 1GB.  total compressed size kept; least
+        recently used results are evicted beyond it.
+
+    ttl
+        integer, default 3600.  seconds a result is served for,
+        unless a cursor asks for another ttl.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, ttl=3600,
+                 compresslevel=1):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.compresslevel = compresslevel
+        self.hits = self.misses = self.evictions = 0
+        self._lock = Lock()
+        # key -> [path, size, expires, last used]
+        self._entries = {}
+        self._bytes = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._load()
+
+    def _load(self):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.tmp-'):
+                os.remove(path)
+                continue
+            parts = name.split('.')
+            if len(parts) != 3 or parts[2] != 'gz':
+                continue
+            stat = os.stat(path)
+            self._entries[parts[0]] = [path, stat.st_size, float(parts[1]),
+                                       stat.st_atime]
+            self._bytes += stat.st_size
+        self._evict()
+
+    def key(self, query, connection):
+        """Cache key for query (with args already applied) run on
+        connection."""
+        digest = hashlib.sha1(normalize(query))
+        digest.update('\0%s\0%s' % (connection.user,
+                                    bool(connection.write_access)))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return a readable stream over a cached result, or None."""
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] < time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry[3] = time.time()
+            try:
+                return gzip.open(entry[0], 'rb')
+            except IOError:
+                self._remove(key)
+                return None
+        finally:
+            self._lock.release()
+
+    def writer(self, key, ttl=None):
+        return CacheWriter(self, key, ttl or self.ttl)
+
+    def _commit(self, key, tmp, expires):
+        path = os.path.join(self.directory, '%s.%d.gz' % (key, expires))
+        size = os.path.getsize(tmp)
+        self._lock.acquire()
+        try:
+            self._remove(key)
+            os.rename(tmp, path)
+            self._entries[key] = [path, size, expires, time.time()]
+            self._bytes += size
+            self._evict()
+        finally:
+            self._lock.release()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry[1]
+        try:
+            os.remove(entry[0])
+        except OSError:
+            pass
+
+    def _evict(self):
+        if self._bytes <= self.max_bytes:
+            return
+        lru = sorted(self._entries.items(), key=lambda item: item[1][3])
+        for key, entry in lru:
+            if self._bytes <= self.max_bytes:
+                break
+            self._remove(key)
+            self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Drop one cached result, or all of them if key is None."""
+        self._lock.acquire()
+        try:
+            for k in (key is None and self._entries.keys() or [key]):
+                self._remove(k)
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries), 'bytes': self._bytes}
+
+
+class CacheWriter(object):
+
+    """Collects one result while it is being read.  Nothing becomes
+    visible in the cache unless commit() is reached."""
+
+    def __init__(self, cache, key, ttl):
+        self.cache = cache
+        self.key = key
+        self.expires = int(time.time() + ttl)
+        self.tmp = os.path.join(cache.directory,
+                                '.tmp-%s-%s' % (key, uuid.uuid4().hex))
+        self.file = gzip.open(self.tmp, 'wb', cache.compresslevel)
+
+    def write(self, data):
+        self.file.write(data)
+
+    def commit(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        self.cache._commit(self.key, self.tmp, self.expires)
+
+    def abort(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        os.remove(self.tmp)
+
+
+class TeeReader(object):
+
+    """Wraps a result stream and copies everything read from it into
+    a CacheWriter.  The entry is committed at end of stream if the
+    stream reports that it is complete, i.e. ended where hive's
+    output ends and not because hive was killed or died.  It is
+    dropped otherwise, if reading fails and if the stream is closed
+    before its end."""
+
+    def __init__(self, stream, writer):
+        self.stream = stream
+        self.writer = writer
+
+    def _end(self):
+        if getattr(self.stream, 'complete', False):
+            self.writer.commit()
+        else:
+            self.writer.abort()
+
+    def readline(self):
+        try:
+            line = self.stream.readline()
+        except:
+            self.writer.abort()
+            raise
+        if line:
+            self.writer.write(line)
+        else:
+            self._end()
+        return line
+
+    def read(self, size=-1):
+        try:
+            data = self.stream.read(size)
+        except:
+            self.writer.abort()
+            raise
+        if data:
+            self.writer.write(data)
+        if not data or size < 0:
+            self._end()
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        self.writer.abort()
+        if hasattr(self.stream, 'close'):
+            self.stream.close()
+
+
+class CachedQuery(Query):
+
+    """Stands in for a Query whose result came from the cache."""
+
+    def __init__(self, id, stream, output=None):
+        Query.__init__(self, id, None, output=output)
+        self.stream = stream
+
+    def execute(self):
+        logger.info('Cached query id=%s', self.id)
+        if self.stats is not None:
+            self.stats.source = 'cache'
+            self.stats.mark('first_row')
+        self.result = self.stream
+        self.output_cb(self.id, self.result)
@@ -0,0 +1,177 @@
+"""
+Hive db columnar results
+This module turns blocks of raw hive output into columns instead
+of rows.  Numeric columns become array.array (or NumPy arrays when
+NumPy is installed) converted a column at a time.  Values match what
+the row API returns, NULLs included; each column also carries a
+mask telling which cells were NULL.
+"""
+
+from array import array
+from collections import namedtuple
+import simplejson as json
+# the standard library's scanner parses a list of numbers in C
+from json import loads as _parse_numbers
+from decoders import NULL, convert, is_builtin
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+Column = namedtuple('Column', 'name type values nulls')
+
+def _int(value):
+    return int(float(value))
+
+def _parse(type, text, count, use_numpy):
+    """Parse count numbers joined by commas in text with a C parser;
+    None if they are not all numbers it reads as int() or float()
+    would."""
+    if use_numpy:
+        # a cell holding a comma would shift every later value
+        if text.count(',') != count - 1:
+            return None
+        # NumPy stops quietly at the first cell it cannot read
+        values = numpy.fromstring(text, type == 'int' and numpy.int64
+                                  or numpy.float64, sep=',')
+        if len(values) == count:
+            return values
+        return None
+    if type == 'int':
+        # 'e' is in true, false and exponents, none of which int()
+        # takes
+        if 'e' in text:
+            return None
+    elif 'u' in text or 'l' in text:
+        # in true, false and null, none of which float() takes; NaN,
+        # Infinity and exponents parse as they do with float()
+        return None
+    try:
+        values = _parse_numbers('[%s]' % text)
+        if len(values) == count:
+            return array(type == 'int' and 'l' or 'd', values)
+    except (ValueError, TypeError):
+        # not all JSON numbers, e.g. '1.0' in an int column, '007' or
+        # '.5'
+        pass
+
+def _convert(type, cells, use_numpy):
+    """Convert cells one by one, when _parse() cannot."""
+    if type == 'int':
+        if use_numpy:
+            data = numpy.array(cells)
+            try:
+                return data.astype(numpy.int64)
+            except ValueError:
+                return data.astype(numpy.float64).astype(numpy.int64)
+        try:
+            return array('l', map(int, cells))
+        except ValueError:
+            return array('l', map(_int, cells))
+    if use_numpy:
+        return numpy.array(cells).astype(numpy.float64)
+    return array('d', map(float, cells))
+
+def _numeric(type, cells, use_numpy, positions=()):
+    """Numbers of an int or float column, 0 for the NULL cells at
+    positions."""
+    text = ','.join(cells)
+    if positions:
+        # no number contains NULL, so only the NULL cells change
+        text = text.replace(NULL, '0')
+    values = _parse(type, text, len(cells), use_numpy)
+    if values is not None:
+        return values
+    if positions:
+        cells = _replace(cells, positions, '0')
+    return _convert(type, cells, use_numpy)
+
+def _null_positions(cells):
+    """Indexes of the NULL cells.  list.index() does the scanning, so
+    Python code only runs once per NULL, not once per cell."""
+    positions = []
+    find = cells.index
+    position = -1
+    try:
+        while True:
+            position = find(NULL, position + 1)
+            positions.append(position)
+    except ValueError:
+        return positions
+
+def _mask(count, positions, use_numpy):
+    if use_numpy:
+        nulls = numpy.zeros(count, dtype=bool)
+        nulls[positions] = True
+        return nulls
+    nulls = array('b', '\0' * count)
+    for position in positions:
+        nulls[position] = 1
+    return nulls
+
+def _replace(cells, positions, value):
+    cells = list(cells)
+    for position in positions:
+        cells[position] = value
+    return cells
+
+def to_column(name, type, cells, use_numpy=False, may_have_nulls=True):
+    """Convert one column of raw cells to a Column.  may_have_nulls
+    false skips looking for NULL cells."""
+    positions = may_have_nulls and _null_positions(cells) or []
+    nulls = _mask(len(cells), positions, use_numpy)
+    if not is_builtin(type):
+        values = [convert(type, cell) for cell in cells]
+    elif type in ('int', 'float'):
+        values = _numeric(type, cells, use_numpy, positions)
+    elif type == 'json':
+        values = [None if cell == NULL else json.loads(cell)
+                  for cell in cells]
+    elif positions:
+        values = _replace(cells, positions, '')
+    else:
+        values = list(cells)
+    return Column(name, type, values, nulls)
+
+def to_columns(lines, description, use_numpy=None):
+    """Parse raw TSV lines into a list of Columns, one per entry in
+    description.  use_numpy defaults to whether NumPy is installed."""
+    width = len(description)
+    if lines and lines[0].endswith('\n'):
+        block = ''.join(lines)
+    else:
+        # stored lines (see store.py) have no line ends
+        block = '\n'.join(lines)
+    if block.endswith('\n'):
+        block = block[:-1]
+    cells = block.replace('\n', '\t').split('\t')
+    if not lines or len(cells) != len(lines) * width:
+        # ragged rows; split them one by one
+        rows = [line.rstrip('\n').split('\t') for line in lines]
+        return rows_to_columns(rows, description, use_numpy)
+    use_numpy = _use_numpy(use_numpy)
+    # one search of the whole block instead of one per cell
+    may_have_nulls = NULL in block
+    # every width-th cell, starting at the column's position, belongs
+    # to that column
+    return [to_column(column[0], column[1], cells[index::width], use_numpy,
+                      may_have_nulls)
+            for index, column in enumerate(description)]
+
+def _use_numpy(use_numpy):
+    if use_numpy is None:
+        return numpy is not None
+    if use_numpy and numpy is None:
+        raise ImportError('NumPy is not installed')
+    return use_numpy
+
+def rows_to_columns(rows, description, use_numpy=None):
+    """Like to_columns(), for rows already split into cells."""
+    use_numpy = _use_numpy(use_numpy)
+    if rows:
+        cells = zip(*rows)
+    else:
+        cells = [()] * len(description)
+    return [to_column(column[0], column[1], column_cells, use_numpy)
+            for column, column_cells in zip(description, cells)]
@@ -5,6 +5,12 @@ with a non-standard Cursor class.
 """
 
 import cursors
+from pool import SessionPool
+from transports import CLITransport
+from query import KILL_COMMAND
+from scheduler import priority_value
+from weakref import WeakSet
+from schema import SchemaCache, SchemaResolver
 from errors import Warning, Error, InterfaceError, DataError, \
     DatabaseError, OperationalError, IntegrityError, InternalError, \
     NotSupportedError, ProgrammingError
@@ -56,6 +62,75 @@ class Connection(object):
         write_access
             bool, issues hive queries as sudo
 
+        pool_size
+            integer, default 0.  number of long-lived hive sessions
+            to keep open.  queries are sent to a warm session instead
+            of starting `hive -e` each time.  0 disables pooling.
+
+        pool_recycle
+            integer, default 500.  statements run on a session before
+            it is restarted.
+
+        pool_ping
+            integer, default 300.  seconds a session may sit idle
+            before it is health checked on checkout.
+
+        resolve_types
+            bool, default false.  look up column types of the tables
+            a query reads from with DESCRIBE instead of guessing them
+            from the first row.  schemas are cached per connection.
+
+        schema_ttl
+            integer, default 300.  seconds a cached schema is used
+            before it is described again.  see schema_cache.invalidate()
+
+        result_cache
+            cache.ResultCache, default None.  serve repeated SELECTs
+            from a local cache of earlier results.
+
+        instrument
+            sink for per-query timings, default None (off).  an
+            object with record(stats) such as instrument.LoggingSink
+            or instrument.StatsAggregator, or a callable taking an
+            instrument.QueryStats.
+
+        max_concurrency
+            integer, default 4.  hive processes executemany() may run
+            at the same time.
+
+        timeout
+            seconds, default None (no limit).  queries running longer
+            are cancelled: hive is killed along with the hadoop jobs
+            it started.  cursor.execute(timeout=...) overrides it.
+
+        kill_command
+            list, default ['hadoop', 'job', '-kill'].  run with a job
+            id appended to kill a cancelled query's hadoop jobs (as
+            hdfs with write_access).  None leaves the jobs running.
+
+        progress
+            callable, default None.  called with a
+            progress.ProgressEvent for every job, stage, map/reduce
+            percentage and counter hive reports, on the thread
+            reading hive's stderr.
+
+        trace_directory
+            string, default None.  write each query's timeline there
+            as a Chrome trace file (see progress.py) once hive is
+            done.
+
+        priority
+            'interactive' (default) or 'batch'.  when
+            scheduler.admission limits the hive processes of this
+            Python process, interactive queries get free slots first.
+            cursor.priority overrides it.
+
+        transport
+            transports.Transport, default transports.CLITransport().
+            how statements reach hive; transports.HiveServer2Transport
+            keeps connections to a HiveServer2 server open instead of
+            starting the CLI.  pool_size only applies to the CLI.
+
         cursorclass
             class object, used to create cursors (keyword only)
         """
@@ -65,8 +140,59 @@ class Connection(object):
         self.port = kwargs.pop('port', None)
         self.write_access = kwargs.pop('write_access', False)
         self.verbose = kwargs.pop('verbose', True)
+        self.max_concurrency = kwargs.pop('max_concurrency', 4)
+        self.result_cache = kwargs.pop('result_cache', None)
+        self.instrument = kwargs.pop('instrument', None)
+        self.timeout = kwargs.pop('timeout', None)
+        self.kill_command = kwargs.pop('kill_command', KILL_COMMAND)
+        self.progress = kwargs.pop('progress', None)
+        self.trace_directory = kwargs.pop('trace_directory', None)
+        self.priority = kwargs.pop('priority', 'interactive')
+        priority_value(self.priority)
+        self.schema_cache = SchemaCache(kwargs.pop('schema_ttl', 300))
+        self.resolver = None
+        if kwargs.pop('resolve_types', False):
+            self.resolver = SchemaResolver(self, self.schema_cache)
         self.closed = False
         self.messages = []
+        self._cursors = WeakSet()
+        self.pool = None
+        pool_size = kwargs.pop('pool_size', 0)
+        pool_recycle = kwargs.pop('pool_recycle', 500)
+        pool_ping = kwargs.pop('pool_ping', 300)
+        self.transport = kwargs.pop('transport', None) or CLITransport()
+        if pool_size and not isinstance(self.transport, CLITransport):
+            raise NotSupportedError('pool_size is only supported by the '
+                                    'CLI transport')
+        if pool_size:
+            self.pool = SessionPool(self._hive_command(), size=pool_size,
+                                    recycle=pool_recycle,
+                                    ping_after=pool_ping)
+            self.pool.warm()
+        self.transport.open(self)
+
+    def _hive_statement(self, q):
+        """q with the settings every statement of this connection
+        runs with."""
+        q = "set hive.cli.print.header=true; %s" % q
+        if self.user:
+            q = 'SET mapred.fairscheduler.pool=%s; %s' % (self.user, q)
+        return q.replace('"', '\"')
+
+    def _hive_command(self):
+        """The argv used to start hive for this connection."""
+        if self.write_access:
+            return ['sudo', '-uhdfs', 'hive']
+        return ['hive']
+
+    def _kill_command(self):
+        """The argv (without job id) that kills this connection's
+        hadoop jobs, or None."""
+        if not self.kill_command:
+            return None
+        if self.write_access:
+            return ['sudo', '-uhdfs'] + list(self.kill_command)
+        return list(self.kill_command)
 
     def cursor(self, cursorclass=None):
         """
@@ -77,13 +203,28 @@ class Connection(object):
         """
         if self.closed:
             raise Error("Connection is closed.")
-        return (cursorclass or self.cursorclass)(self)
+        cursor = (cursorclass or self.cursorclass)(self)
+        self._cursors.add(cursor)
+        return cursor
+
+    def submit(self, query, args=None, cursorclass=None):
+        """
+        Run query on a new cursor in the background.  Returns a
+        QueryFuture whose result() is the cursor once hive is done,
+        so many queries can be in flight at once.
+        """
+        return self.cursor(cursorclass).execute_async(query, args)
 
     def __enter__(self):
         return self.cursor()
     
     def close(self):
+        """Close the connection's cursors, cancelling whatever they
+        still run, and its transport (the session pool of the CLI)."""
         self.closed = True
+        for cursor in list(self._cursors):
+            cursor.close()
+        self.transport.close()
 
     def show_warnings(self):
         """
@@ -5,7 +5,27 @@ By default, hivedb uses Cursor class.
 """
 
 import sys
-from query import Query
+import uuid
+from threading import Thread
+from query import QueryFuture
+from scheduler import QueryScheduler
+from store import ResultStore
+from columnar import to_columns, rows_to_columns
+from decoders import compile_decoder, convert
+from itertools import groupby, islice
+from operator import itemgetter
+from cache import CachedQuery, TeeReader, cacheable
+from instrument import QueryStats, clock
+from parallel import ParallelDecoder
+from records import record_class
+from prefetch import Prefetcher
+from progress import ProgressParser
+import export
+import bulk
+import batch
+import partitioned
+import materialize
+from StringIO import StringIO
 from errors import Warning, Error, InterfaceError, DataError, \
     DatabaseError, OperationalError, IntegrityError, InternalError, \
     NotSupportedError, ProgrammingError
@@ -56,7 +76,36 @@ class BaseCursor(object):
 
     arraysize
         default number of rows fetchmany() will fetch
+
+    cache_ttl
+        seconds results of this cursor's queries are kept in the
+        connection's result_cache; None uses the cache default and
+        0 bypasses the cache
+
+    decode_workers
+        number of worker processes streaming fetches decode rows
+        in; 0 (the default) decodes in this process
+
+    prefetch
+        batches of rows streaming fetches read and decode ahead on a
+        background thread; 0 (the default) reads on demand.  rows
+        read ahead are skipped by copy_to(), groups() and
+        fetch_columns()
+
+    priority
+        'interactive' or 'batch', the order this cursor's queries get
+        hive processes in when scheduler.admission limits them; None
+        uses connection.priority
     """
+
+    cache_ttl = None
+    decode_workers = 0
+    decode_chunk_bytes = 256 * 1024
+    prefetch = 0
+    priority = None
+    # rows of typed results (transports.HiveServer2Result) are taken
+    # as they are instead of being parsed from text
+    _typed_rows = True
     
     def __init__(self, connection):
         self.connection = connection
@@ -73,6 +122,18 @@ class BaseCursor(object):
         self._info = None
         self.rownumber = None
         self._buffer = {}
+        self._pending = {}
+        self._statements = {}
+        self._query_stats = {}
+        self._decoder = None
+        self._decoder_for = None
+        self._decode_pool = None
+        self._rows = None
+        self._rows_for = None
+        self._prefetcher = None
+        self._queries = {}
+        self._timeout = None
+        self.errors = []
 
     def __del__(self):
         self.close()
@@ -82,8 +143,25 @@ class BaseCursor(object):
     def close(self):
         if not self.connection:
             return
+        self._close_results()
+        if self._decode_pool is not None:
+            self._decode_pool.close()
+            self._decode_pool = None
         self.connection = None
 
+    def _close_results(self):
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+        # hive still running for results nobody will read is stopped,
+        # or drained where that keeps a pooled session (Query.discard)
+        for query in (self._queries or {}).values():
+            query.discard()
+        for result in (self._result or {}).values():
+            if hasattr(result, 'close'):
+                result.close()
+        self._end_prefetch()
+        self._emit_stats()
+
     def _check_executed(self):
         if not self._executed:
             self.errorhandler(self, ProgrammingError, "execute() first")
@@ -92,6 +170,7 @@ class BaseCursor(object):
         """Advance to the next result set
         Returns None if there are no more result sets."""
         self._check_executed()
+        self._end_prefetch()
         if self._executed:
             try:
                 while self._read_buffer():
@@ -100,10 +179,14 @@ class BaseCursor(object):
                 pass
         del self.messages[:]
         self._result_index += 1
-        self.description = self._descriptions[self._result_index]
-        if not self._result.has_key(self._result_index) \
-            and self._buffer[self._result_index] is not None:
+        if self._pending.has_key(self._result_index):
+            # batched statement; its output starts here
+            self._command_output_handler(
+                self._result_index, self._pending.pop(self._result_index))
+        if not self._descriptions.has_key(self._result_index):
+            self.description = None
             return None
+        self.description = self._descriptions[self._result_index]
         return True
 
     def setinputsizes(self, *args):
@@ -117,12 +200,14 @@ class BaseCursor(object):
             self.errorhandler(self, ProgrammingError, "cursor closed")
         return self.connection
 
-    def execute(self, query, args=None):
+    def execute(self, query, args=None, timeout=None):
 
         """Execute a query.
 
         query -- string, query to execute on server
         args -- optional sequence or mapping, parameters to use with query.
+        timeout -- optional seconds after which the query is cancelled,
+        default connection.timeout
 
         Note:  If args is a sequence, then %s must be used as the
         parameter placeholder in the query.  If a mapping is used,
@@ -134,6 +219,7 @@ class BaseCursor(object):
         self._pre_execute()
         if args is not None:
             query = query % args
+        self._timeout = timeout
         try:
             r = self._query(query)
         except TypeError, m:
@@ -151,7 +237,134 @@ class BaseCursor(object):
             self.errorhandler(self, exc, value)
         self._post_execute()
 
-    def executemany(self, query, sequence_of_args):
+    def execute_batch(self, statements):
+        """Execute a sequence of statements in one hive invocation.
+
+        Hive starts once for the whole batch.  Result set i belongs
+        to the i-th statement (each with its own description); use
+        nextset() to move through them.  Statements run in order,
+        and hive stops at the first one that fails.  Its error is
+        raised once reading reaches that statement's result set, and
+        later result sets are empty (a pooled session still runs
+        the later statements, but their output is discarded).
+        """
+        self._pre_execute()
+        statements = list(statements)
+        if not statements:
+            self.errorhandler(self, ProgrammingError, "empty batch")
+            return
+        try:
+            self._query_batch(statements)
+        except:
+            exc, value, tb = sys.exc_info()
+            del tb
+            self.messages.append((exc, value))
+            self.errorhandler(self, exc, value)
+        self._post_execute()
+
+    def execute_partitioned(self, query, partition_column, values,
+                            parallelism=None, order_by=None, args=None,
+                            timeout=None):
+        """Execute a query as one query per partition, run in parallel.
+
+        query -- string, query over a table partitioned on
+        partition_column
+        values -- the partitions to read: values of partition_column,
+        or (low, high) tuples for low <= partition_column < high
+        parallelism -- queries run at once, default
+        connection.max_concurrency
+        order_by -- optional column name, comma separated names or
+        sequence of names.  Partitions are sorted on them and merged
+        in ascending order; otherwise rows come in the order the
+        partitions produce them.
+        args, timeout -- as for execute(); timeout applies to each
+        partition's query
+
+        The partition condition is added to the query's WHERE clause,
+        so GROUP BY and LIMIT apply per partition.  All rows form one
+        result set.  Unordered rows can be fetched as soon as a
+        partition produces them, merged ones once every partition is
+        done.  The first partition that fails stops the rest.
+        """
+        self._pre_execute()
+        if args is not None:
+            query = query % args
+        self._timeout = timeout
+        try:
+            self._query_partitioned(query, partition_column, list(values),
+                                    parallelism, order_by)
+        except:
+            exc, value, tb = sys.exc_info()
+            del tb
+            self.messages.append((exc, value))
+            self.errorhandler(self, exc, value)
+        self._post_execute()
+
+    def _query_partitioned(self, query, column, values, parallelism,
+                           order_by):
+        db = self._get_db()
+        if not values:
+            raise ProgrammingError('no partitions to query')
+        keys = partitioned.sort_keys(order_by)
+        statements = [partitioned.restrict(query,
+                                           partitioned.predicate(column,
+                                                                 value),
+                                           keys)
+                      for value in values]
+        self._executed = query
+        if db.verbose:
+            logging.info("Query(0)=%s, %d partitions" % (query,
+                                                         len(statements)))
+        if db.resolver is not None:
+            db.resolver.prepare(query)
+        self._statements[0] = query
+        stream = partitioned.PartitionedResult(
+            len(statements), keys,
+            types=lambda columns: self._resolve_types(0, columns))
+        queries = []
+        for index, statement in enumerate(statements):
+            q = self._new_query(statement, stream.feed, index)
+            q.add_done_callback(stream.finish)
+            self._queries[index] = q
+            queries.append(q)
+        self._result[0] = stream
+        scheduler = QueryScheduler(parallelism or db.max_concurrency)
+        runner = Thread(target=scheduler.run, args=(queries,))
+        runner.daemon = True
+        runner.start()
+        self._command_output_handler(0, stream)
+
+    def execute_async(self, query, args=None, timeout=None):
+        """Start a query without waiting for it.
+
+        Takes the same arguments as execute().  Returns a QueryFuture
+        whose result() blocks until hive is done and returns this
+        cursor, ready to fetch from.  Errors are raised from result()
+        through the cursor's errorhandler.
+        """
+        self._pre_execute()
+        if args is not None:
+            query = query % args
+        self._timeout = timeout
+        try:
+            q = self._query(query, False)
+        except:
+            exc, value, tb = sys.exc_info()
+            del tb
+            self._async_error(exc, value)
+        q.add_done_callback(self._async_done)
+        return QueryFuture(q, self, self._async_error)
+
+    def _async_done(self, query):
+        if not query.exc_info:
+            self._post_execute()
+
+    def _async_error(self, exc, value):
+        self.messages.append((exc, value))
+        self.errorhandler(self, exc, value)
+
+    def executemany(self, query, sequence_of_args, concurrency=None,
+                    fail_fast=True):
         """ Execute a multi-row query.
 
         query -- string, query to execute on server
@@ -161,21 +374,58 @@ class BaseCursor(object):
             Sequence of sequences or mappings, parameters to use with
             query.
 
+        concurrency
+
+            maximum number of hive processes run at once, default
+            connection.max_concurrency.  The rest wait their turn.
+            Each query's output is read into a local store (spilled
+            to disk when large) before the next query starts, so
+            hive exits before its slot is given to another query.
+
+        fail_fast
+
+            bool, default true.  Raise the first error and skip
+            queries that have not started yet.  If false every query
+            runs; failures are collected in cursor.errors as
+            (index, errorclass, errorvalue) and their result sets
+            are empty.
+
         Returns long integer rows affected, if any.
          
         This method improves performance on multiple, 
-        non-dependent queries.
+        non-dependent queries.  Result set i belongs to the i-th
+        parameter set; use nextset() to move through them.
 
-        Currently not supported.
+        INSERT INTO|OVERWRITE TABLE ... VALUES templates whose values
+        are all placeholders are run as one load_rows() job instead.
         """
+        insert = bulk.parse_insert(query)
+        if insert is not None:
+            overwrite, table, partition, keys = insert
+            rows = sequence_of_args
+            if keys is not None:
+                rows = (tuple([args[key] for key in keys])
+                        for args in sequence_of_args)
+            return self.load_rows(table, rows, partition, overwrite)
         self._pre_execute()
+        if concurrency is None:
+            concurrency = self._get_db().max_concurrency
+        scheduler = QueryScheduler(concurrency, fail_fast, spool=True)
         try:
             queries = []
             for args in sequence_of_args:
-                q = self._query(query % args, False)
+                q = self._query(query % args, False, False)
                 queries.append(q)
-            for query in queries:
-                query.wait()
+            scheduler.run(queries)
+            for q in queries:
+                if not q.exc_info:
+                    continue
+                if fail_fast:
+                    q.raise_error()
+                exc, value = q.exc_info[:2]
+                self.errors.append((q.id, exc, value))
+                self.messages.append((exc, value))
+                self._command_output_handler(q.id, StringIO())
         except:
             exc, value, tb = sys.exc_info()
             del tb
@@ -183,22 +433,97 @@ class BaseCursor(object):
             self.errorhandler(self, exc, value)
         self._post_execute()
     
+    def load_rows(self, table, rows, partition=None, overwrite=False,
+                  chunk_rows=1000000):
+        """Insert rows into table with a single hive job.
+
+        rows -- iterable of sequences, one value per column of table
+        in table order.  None is NULL; dicts and lists are stored as
+        JSON.
+
+        partition -- optional {column: value} mapping or PARTITION
+        clause contents, for a static partition.
+
+        overwrite -- replace the table (or partition) contents.
+
+        Rows are streamed to local staging files of at most
+        chunk_rows rows each, then loaded through a temporary staging
+        table.  Returns the number of rows loaded.
+        """
+        self._pre_execute()
+        staging = bulk.StagingFiles(chunk_rows)
+        stage = None
+        try:
+            staging.write(rows)
+            self.rowcount = staging.rows
+            if staging.rows:
+                stage = bulk.staging_table()
+                self._query('; '.join(bulk.load_statements(
+                    staging.path, stage, table, staging.columns,
+                    partition, overwrite)))
+                stage = None
+        except:
+            exc, value, tb = sys.exc_info()
+            del tb
+            staging.cleanup()
+            if stage is not None:
+                self._drop_staging(stage)
+            self.messages.append((exc, value))
+            self.errorhandler(self, exc, value)
+        staging.cleanup()
+        self._post_execute()
+        return self.rowcount
+
+    def _drop_staging(self, stage):
+        try:
+            self._query('DROP TABLE IF EXISTS %s' % stage)
+        except Error:
+            logging.warning('Could not drop staging table %s', stage)
+
     def _command_output_handler(self, id, output):
+        if getattr(output, 'description', None) is not None:
+            # typed result (HiveServer2): no header or types to parse
+            output.readline()
+            self._descriptions[id] = output.description
+            self._result[id] = output
+            self._buffer[id] = None
+            return
         description = []
-        columns = output.readline().replace('\n', '').split('\t')
+        header = output.readline()
+        if not header:
+            # statement without a result set (DDL, SET, ...)
+            self._descriptions[id] = None
+            self._result[id] = output
+            self._buffer[id] = None
+            return
+        columns = header.replace('\n', '').split('\t')
         _buffer = output.readline()
         buffer = _buffer.replace('\n', '').split('\t')
+        types = self._resolve_types(id, columns)
         index = 0
         for column in columns:
-            description.append((column, infer_type(buffer[index])))
+            type = types[index]
+            if type is None and index < len(buffer):
+                type = infer_type(buffer[index])
+            description.append((column, type or 'str'))
             index += 1
         self._descriptions[id] = tuple(description)
         self._result[id] = output
         self._buffer[id] = _buffer
 
+    def _resolve_types(self, id, columns):
+        """Hive types for the columns of result set id where the
+        connection's schema resolver knows them, else None."""
+        db = self.connection
+        if db is None or db.resolver is None \
+                or not self._statements.has_key(id):
+            return [None] * len(columns)
+        return db.resolver.resolve(self._statements[id], columns)
+
     def _command_error_handler(self, id, error):
-        self.messages.append((ProgrammingError, error))
-        self.errorhandler(self, ProgrammingError, error)
+        # runs in the query thread; the waiting thread re-raises this
+        # through errorhandler
+        raise ProgrammingError(error)
  
     def _command_info_handler(self, id, info):
         db = self._get_db()
@@ -211,40 +536,131 @@ class BaseCursor(object):
 
     def _pre_execute(self):
         del self.messages[:]
+        self._close_results()
         self._result_index = 0
         self._result = {}
+        self._descriptions = {}
+        self._buffer = {}
+        self._pending = {}
+        self._statements = {}
+        self._queries = {}
+        self._timeout = None
+        self._rows = None
+        del self.errors[:]
         self.description = None
 
     def _post_execute(self):
         self._result_index = 0
-        self.description = self._descriptions[0]
+        self.description = self._descriptions.get(0)
 
-    def _do_query(self, q, wait=True):
+    def _do_query(self, q, wait=True, start=True):
         db = self._get_db()
         self._executed = q
         if db.verbose:
             logging.info("Query(%s)=%s" % (self._result_index, q))
-        command = []
-        q = "set hive.cli.print.header=true; %s" % q
-        if db.user:
-            q = 'SET mapred.fairscheduler.pool=%s; %s' % (db.user, q) 
-        q = q.replace('"', '\"')
-        if db.write_access:
-            command = ['sudo', '-uhdfs', 'hive', '-e', '"%s"' % q]
-        else:
-            command = ['hive', '-e', '"%s"' % q]
-        query = Query(self._result_index, command, 
-                      output=self._command_output_handler,
-                      error=self._command_error_handler,
-                      info=self._command_info_handler)
+        if db.resolver is not None:
+            db.resolver.prepare(q)
+        self._statements[self._result_index] = q
+        if db.instrument is not None:
+            self._query_stats[self._result_index] = \
+                QueryStats(self._result_index, q, db.instrument)
+        output = self._command_output_handler
+        cache = db.result_cache
+        if cache is not None and self.cache_ttl != 0 and cacheable(q):
+            key = cache.key(q, db)
+            stream = cache.get(key)
+            if stream is not None:
+                query = CachedQuery(self._result_index, stream, output=output)
+                self._result_index += 1
+                return self._start_query(query, wait, start)
+            writer = lambda: cache.writer(key, self.cache_ttl)
+            output = lambda id, out: \
+                self._command_output_handler(id, TeeReader(out, writer()))
+        query = self._new_query(q, output)
         self._result_index += 1
+        return self._start_query(query, wait, start)
+
+    def _new_query(self, q, output, id=None):
+        """A Query from the connection's transport running q as the
+        current result set (or id), handing its output to
+        output(id, stream)."""
+        db = self._get_db()
+        if id is None:
+            id = self._result_index
+        query = db.transport.query(id, q, output=output,
+                                   error=self._command_error_handler,
+                                   info=self._command_info_handler)
+        query.timeout = self._timeout or db.timeout
+        query.kill_command = db._kill_command()
+        query.user = db.user
+        query.priority = self.priority or db.priority
+        if db.progress is not None or db.trace_directory is not None:
+            query.progress = ProgressParser(id, q, db.progress,
+                                            db.trace_directory)
+        return query
+
+    def cancel(self):
+        """Stop this cursor's running queries: hive is killed along
+        with the hadoop jobs it started.  May be called from another
+        thread; an execute() waiting there raises OperationalError."""
+        for query in (self._queries or {}).values():
+            query.cancel()
+
+    def _query_batch(self, statements):
+        db = self._get_db()
+        if not db.transport.scripts:
+            # no shared output to split: one query per statement
+            for statement in statements:
+                self._do_query(statement)
+            return
+        self._executed = statements
+        token = uuid.uuid4().hex
+        for index, statement in enumerate(statements):
+            if db.verbose:
+                logging.info("Query(%s)=%s" % (index, statement))
+            if db.resolver is not None:
+                db.resolver.prepare(statement)
+            self._statements[index] = statement
+        q = batch.script(statements, token)
+        if db.instrument is not None:
+            self._query_stats[0] = QueryStats(0, q, db.instrument)
+        def output(id, stream):
+            demux = batch.ResultDemux(stream, token, len(statements),
+                                      getattr(stream, 'failure', None))
+            for index in range(1, len(statements)):
+                self._pending[index] = demux.section(index)
+            self._command_output_handler(0, demux.section(0))
+        self._result_index = 0
+        return self._start_query(self._new_query(q, output))
+
+    def _start_query(self, query, wait=True, start=True):
+        self._queries[query.id] = query
+        query.stats = self._query_stats.get(query.id)
+        if query.stats is not None:
+            query.add_done_callback(self._query_failed)
+        if not start:
+            return query
         query.start()
         if wait:
             query.wait()
+            query.raise_error()
         return query
 
-    def _query(self, q, wait=True):
-        return self._do_query(q, wait)
+    def _query_failed(self, query):
+        if query.exc_info:
+            query.stats.emit(error=str(query.exc_info[1]))
+
+    def _emit_stats(self, index=None):
+        if index is None:
+            stats, self._query_stats = self._query_stats.values(), {}
+        else:
+            stats = [self._query_stats.pop(index, None)]
+        for s in stats:
+            if s is not None:
+                s.emit()
+
+    def _query(self, q, wait=True, start=True):
+        return self._do_query(q, wait, start)
 
     def _read_buffer(self):
         return self._result[self._result_index].readline()
@@ -252,9 +668,9 @@ class BaseCursor(object):
     def _decorate_row(self, row):
         return row
 
-    def _fetch_row(self, size=1):
+    def _next_raw(self):
         raw = None
-        if self._buffer[self._result_index]:
+        if self._buffer.get(self._result_index):
             raw = self._buffer[self._result_index]
             self._buffer[self._result_index] = None
         else:
@@ -262,16 +678,288 @@ class BaseCursor(object):
                 raw = self._read_buffer()
             except KeyError:
                 return None
+        if not raw and self._query_stats:
+            self._emit_stats(self._result_index)
+        return raw
+
+    def _fetch_raw(self, size):
+        lines = []
+        while len(lines) < size:
+            raw = self._next_raw()
+            if not raw:
+                break
+            lines.append(raw)
+        return lines
+
+    def _fetch_row(self, size=1):
+        if self.decode_workers:
+            return self._fetch_decoded()
+        if self._typed_rows and not self._buffer.get(self._result_index):
+            result = self._result.get(self._result_index)
+            if hasattr(result, 'next_row'):
+                return self._fetch_typed(result)
+        raw = self._next_raw()
         if not raw:
             return None
-        row = raw.replace('\n', '').split('\t')
-        index = 0
-        for r in row:
-            type = self.description[index][1]
-            row[index] = force_type(type, row[index])
-            index += 1
+        return self._convert_row(raw)
+
+    def _fetch_typed(self, result):
+        row = result.next_row()
+        if row is None:
+            if self._query_stats:
+                self._emit_stats(self._result_index)
+            return None
+        stats = self._query_stats.get(self._result_index)
+        if stats is not None:
+            stats.rows += 1
         return self._decorate_row(row)
 
+    def _prefetched(self, size):
+        # rows read ahead by a Prefetcher, see prefetch.py
+        prefetcher = self._prefetcher
+        if prefetcher is None or prefetcher.index != self._result_index:
+            self._end_prefetch()
+            prefetcher = self._prefetcher = \
+                Prefetcher(self._fetch_row,
+                           max(self.arraysize, Prefetcher.min_batch),
+                           self.prefetch, self._result_index)
+        return prefetcher.take(size)
+
+    def _end_prefetch(self):
+        """Stop reading ahead; rows read but not fetched are dropped."""
+        prefetcher, self._prefetcher = self._prefetcher, None
+        if prefetcher is not None:
+            prefetcher.stop()
+            prefetcher.join()
+
+    def _fetch_decoded(self):
+        # rows decoded by the worker pool, see parallel.py
+        if self._rows is None or self._rows_for != self._result_index:
+            pool = self._decode_pool
+            if pool is None or pool.workers != self.decode_workers:
+                if pool is not None:
+                    pool.close()
+                pool = self._decode_pool = \
+                    ParallelDecoder(self.decode_workers,
+                                    self.decode_chunk_bytes)
+            types = [column[1] for column in self.description or ()]
+            self._rows = pool.decode(self._raw_blocks(pool.chunk_bytes),
+                                     types)
+            self._rows_for = self._result_index
+        try:
+            row = self._rows.next()
+        except StopIteration:
+            self._emit_stats(self._result_index)
+            return None
+        stats = self._query_stats.get(self._result_index)
+        if stats is not None:
+            stats.rows += 1
+        return self._decorate_row(row)
+
+    def _convert_row(self, raw):
+        if self._decoder_for is not self.description:
+            self._decoder = compile_decoder(self.description)
+            self._decoder_for = self.description
+        if not self._query_stats:
+            return self._decorate_row(self._decoder(raw.rstrip('\n').split('\t')))
+        started = clock()
+        row = self._decorate_row(self._decoder(raw.rstrip('\n').split('\t')))
+        stats = self._query_stats.get(self._result_index)
+        if stats is not None:
+            stats.decode_cpu += clock() - started
+            stats.rows += 1
+        return row
+
+    def fetch_columns(self, batch_rows=10000, use_numpy=None):
+        """Generate the rest of the result set as batches of up to
+        batch_rows rows, each a list of columnar.Column tuples
+        (name, type, values, nulls) in description order.  Numeric
+        values are array.array, or NumPy arrays if NumPy is installed
+        and use_numpy is not False."""
+        self._check_executed()
+        self._end_prefetch()
+        while True:
+            lines = self._fetch_raw(batch_rows)
+            if not lines:
+                return
+            yield to_columns(lines, self.description, use_numpy)
+
+    def fetchall_columnar(self, use_numpy=None):
+        """Fetch the rest of the result set as one list of
+        columnar.Column tuples; see fetch_columns()."""
+        self._check_executed()
+        self._end_prefetch()
+        lines = self._fetch_raw(sys.maxint)
+        return to_columns(lines, self.description, use_numpy)
+
+    def copy_to(self, target, format='tsv', compression=None, header=False,
+                null='', progress=None, blocksize=1024 * 1024):
+        """Write the rest of the result set to target, a path or a
+        file object, without building rows.  format is 'tsv' (hive's
+        output, copied in blocks), 'csv' or 'jsonl'.  compression is
+        None, 'gzip', 'bz2' or 'zstd', taken from the suffix of a path
+        when not given.  header writes column names first (tsv and
+        csv); null replaces NULL cells in csv.  progress(rows, bytes)
+        is called after every block.  Returns the number of rows."""
+        self._check_executed()
+        self._end_prefetch()
+        fileobj, close = export.open_target(target, compression)
+        try:
+            if self._decoder_for is not self.description:
+                self._decoder = compile_decoder(self.description)
+                self._decoder_for = self.description
+            rows = export.copy(self._raw_blocks(blocksize), fileobj, format,
+                               self.description, self._decoder, header,
+                               null, progress)
+        finally:
+            close()
+        stats = self._query_stats.get(self._result_index)
+        if stats is not None:
+            stats.rows += rows
+        self._emit_stats(self._result_index)
+        return rows
+
+    def materialize(self, target, table, indexes=(), replace=False,
+                    batch_rows=50000):
+        """Load the rest of the result set into SQLite table table and
+        return the sqlite3 connection, ready for local queries.
+
+        target -- database path, ':memory:' or an open sqlite3
+        connection (to put several results side by side for joins)
+        indexes -- column names, or tuples of them for composite
+        indexes, built after the rows are in
+        replace -- drop table first if it exists
+        batch_rows -- rows inserted per transaction
+
+        Columns are named as in description (without the table prefix
+        when unambiguous) and typed INTEGER, REAL or TEXT from it;
+        json columns are kept as JSON text, NULL is NULL.
+        """
+        self._check_executed()
+        self._end_prefetch()
+        description = self.description
+        if not description:
+            self.errorhandler(self, ProgrammingError,
+                              "no result set to materialize")
+            return
+        connection = materialize.connect(target)
+        names = materialize.create_table(connection, table, description,
+                                         replace)
+        convert_line = materialize.row_converter(description)
+        def batches():
+            while True:
+                lines = self._fetch_raw(batch_rows)
+                if not lines:
+                    return
+                yield [convert_line(line) for line in lines]
+        rows = materialize.insert(connection, table, len(description),
+                                  batches())
+        materialize.create_indexes(connection, table, indexes, names)
+        stats = self._query_stats.get(self._result_index)
+        if stats is not None:
+            stats.rows += rows
+        self._emit_stats(self._result_index)
+        return connection
+
+    def _raw_blocks(self, blocksize):
+        """Generate the rest of the raw result set in blocks of about
+        blocksize bytes, read straight from hive where possible."""
+        index = self._result_index
+        if self._buffer.get(index):
+            raw, self._buffer[index] = self._buffer[index], None
+            yield raw
+        result = self._result.get(index)
+        if not hasattr(result, 'read'):
+            for block in self._line_blocks():
+                yield block
+            return
+        while True:
+            block = result.read(blocksize)
+            if not block:
+                return
+            yield block
+
+    def _line_blocks(self, lines=1000):
+        while True:
+            block = ''.join(self._fetch_raw(lines))
+            if not block:
+                return
+            yield block
+
+    def groups(self, columns, batch=False, batch_rows=10000,
+               use_numpy=None):
+        """Generate (key, rows) for each run of consecutive rows with
+        the same values in columns, like itertools.groupby over the
+        rest of the result set.  Hive output should be sorted (or
+        clustered) by columns.
+
+        columns -- a column name or position, or a sequence of them.
+        key is the decoded value of a single column, else a tuple.
+
+        rows is an iterator over the rows of the group.  With batch
+        true it is instead an iterator over blocks of at most
+        batch_rows rows, each a list of columnar.Column tuples.
+
+        Only the current group is held in memory (one block of it in
+        batch mode); moving on to the next key skips whatever is
+        left of a group.
+        """
+        self._check_executed()
+        self._end_prefetch()
+        description = self.description or ()
+        single = isinstance(columns, (basestring, int, long))
+        if single:
+            columns = [columns]
+        names = [column[0] for column in description]
+        positions = []
+        for column in columns:
+            if isinstance(column, (int, long)) and \
+                    0 <= column < len(names):
+                positions.append(column)
+            elif column in names:
+                positions.append(names.index(column))
+            else:
+                self.errorhandler(self, ProgrammingError,
+                                  "unknown column %r" % (column,))
+                return
+        types = [description[position][1] for position in positions]
+        cells = (line.rstrip('\n').split('\t')
+                 for line in self._raw_lines())
+        for raw_key, group in groupby(cells, itemgetter(*positions)):
+            if single:
+                key = convert(types[0], raw_key)
+            else:
+                key = tuple([convert(type, value)
+                             for type, value in zip(types, raw_key)])
+            if batch:
+                rows = self._group_blocks(group, batch_rows, use_numpy)
+            else:
+                rows = self._group_rows(group)
+            yield key, rows
+
+    def _raw_lines(self, size=1000):
+        while True:
+            lines = self._fetch_raw(size)
+            if not lines:
+                return
+            for line in lines:
+                yield line
+
+    def _group_rows(self, group):
+        if self._decoder_for is not self.description:
+            self._decoder = compile_decoder(self.description)
+            self._decoder_for = self.description
+        decode, decorate = self._decoder, self._decorate_row
+        for cells in group:
+            yield decorate(decode(cells))
+
+    def _group_blocks(self, group, batch_rows, use_numpy):
+        while True:
+            rows = list(islice(group, batch_rows))
+            if not rows:
+                return
+            yield rows_to_columns(rows, self.description, use_numpy)
+
     def __iter__(self):
         return iter(self.fetchone, None)
 
@@ -301,6 +989,11 @@ class CursorStreamResultMixIn(object):
         """Fetch a single row from the cursor.
         None indicates that no more rows are available. """
         self._check_executed()
+        if self.prefetch:
+            rows = self._prefetched(1)
+            if not rows:
+                return None
+            return rows[0]
         row = self._fetch_row(1)
         return row
 
@@ -309,19 +1002,29 @@ class CursorStreamResultMixIn(object):
         smaller than size.  If size is not defined, cursor.arraysize
         is used."""
         self._check_executed()
-        result = []
-        i = 0
         if not size:
             size = self.arraysize
-        while i < size:
-            i += 1
+        if self.prefetch:
+            return self._prefetched(size)
+        result = []
+        while len(result) < size:
             row = self._fetch_row(1)
+            if row is None:
+                break
             result.append(row)
         return result
 
     def fetchall(self): 
         """Fetches everything.  This is probably a really bad idea
         for large datasets."""
+        if self.prefetch:
+            result = []
+            while True:
+                rows = self._prefetched(Prefetcher.max_batch)
+                if not rows:
+                    break
+                result.extend(rows)
+            return result
         result = []
         while True:
             row = self._fetch_row(1)
@@ -344,14 +1047,17 @@ class CursorStreamResultMixIn(object):
         if mode == 'relative':
             if value < 0:
                 self.messages.append((NotSupportedError, 'backward scrolling not supported'))
-                self.errorhandler(NotSupportedError, 'backward scrolling not supported')
+                self.errorhandler(self, NotSupportedError, 'backward scrolling not supported')
                 return
         elif mode == 'absolute':
             self.messages.append((NotSupportedError, "absolute scrolling not supported")) 
-            self.errorhandler(NotSupportedError, 'absolute scrolling not supported')
+            self.errorhandler(self, NotSupportedError, 'absolute scrolling not supported')
+            return
+        if self.prefetch:
+            self._prefetched(value)
             return
         i = 0
-        while i < size:
+        while i < value:
             i += 1
             self._fetch_row(1)
 
@@ -359,23 +1065,123 @@ class CursorStreamResultMixIn(object):
 class CursorStoreResultMixIn(object):
 
     """This is a MixIn class that copies hive output and stores
-    it locally until the cursor is closed.  Allows improved
-    traversal of dataset, but not recommended for large datasets.
-
-    NOT YET IMPLEMENTED.
+    it locally until the cursor is closed.  Allows random access
+    and repeated passes over the dataset.  Rows are kept in memory
+    up to store_max_bytes, then spilled to a temporary file that is
+    read back through mmap, so large results do not live in the
+    Python heap.
     """
 
+    store_max_bytes = 64 * 1024 * 1024
+    store_directory = None
+    _stores = None
+
+    def _get_store(self):
+        index = self._result_index
+        if self._stores.has_key(index):
+            return self._stores[index]
+        store = ResultStore(self.store_max_bytes, self.store_directory)
+        if self._buffer.get(index):
+            store.append(self._buffer[index])
+            self._buffer[index] = None
+        result = self._result.get(index)
+        if result is not None:
+            store.extend(iter(result.readline, ''))
+        store.finish()
+        self._stores[index] = store
+        self.rownumber = 0
+        self.rowcount = len(store)
+        return store
+
+    def _close_stores(self):
+        for store in (self._stores or {}).values():
+            store.close()
+        self._stores = None
+
+    def _pre_execute(self):
+        self._close_stores()
+        self._stores = {}
+        super(CursorStoreResultMixIn, self)._pre_execute()
+
+    def _post_execute(self):
+        super(CursorStoreResultMixIn, self)._post_execute()
+        self._get_store()
+
+    def nextset(self):
+        if super(CursorStoreResultMixIn, self).nextset() is None:
+            return None
+        self._get_store()
+        return True
+
+    def close(self):
+        super(CursorStoreResultMixIn, self).close()
+        self._close_stores()
+
+    def _raw_blocks(self, blocksize):
+        # stored lines have no line ends
+        while True:
+            lines = self._fetch_raw(1000)
+            if not lines:
+                return
+            yield '\n'.join(lines) + '\n'
+
+    def _fetch_raw(self, size):
+        store = self._get_store()
+        lines = store.slice(self.rownumber, self.rownumber + size)
+        self.rownumber += len(lines)
+        return lines
+
     def fetchone(self):
-        pass
+        """Fetches a single row from the cursor. None indicates that
+        no more rows are available."""
+        self._check_executed()
+        store = self._get_store()
+        if self.rownumber >= len(store):
+            return None
+        raw = store[self.rownumber]
+        self.rownumber += 1
+        return self._convert_row(raw)
 
     def fetchmany(self, size=None):
-        pass
+        """Fetch up to size rows from the cursor. Result set may be
+        smaller than size.  If size is not defined, cursor.arraysize
+        is used."""
+        self._check_executed()
+        store = self._get_store()
+        end = self.rownumber + (size or self.arraysize)
+        rows = store.slice(self.rownumber, end)
+        self.rownumber += len(rows)
+        return [self._convert_row(raw) for raw in rows]
 
     def fetchall(self):
-        pass
+        """Fetches all available rows from the cursor."""
+        self._check_executed()
+        store = self._get_store()
+        rows = store.slice(self.rownumber, len(store))
+        self.rownumber = len(store)
+        return [self._convert_row(raw) for raw in rows]
 
     def scroll(self, value, mode='relative'):
-        pass
+        """Scroll the cursor in the result set to a new position
+        according to mode.
+
+        If mode is 'relative' (default), value is taken as offset
+        to the current position in the result set, if set to
+        'absolute', value states an absolute target position."""
+        self._check_executed()
+        store = self._get_store()
+        if mode == 'relative':
+            target = self.rownumber + value
+        elif mode == 'absolute':
+            target = value
+        else:
+            self.errorhandler(self, ProgrammingError,
+                              "unknown scroll mode %s" % repr(mode))
+            return
+        if target < 0 or target > len(store):
+            self.errorhandler(self, IndexError, "out of range")
+            return
+        self.rownumber = target
 
 """
 CursorMixIn options to display rows
@@ -391,16 +1197,19 @@ class CursorTupleRowsMixIn(object):
 
 class CursorDictRowsMixIn(object):
     """This is a MixIn class that causes all rows to be returned
-    as dictionaries.  T his is a non-standard feature."""
+    as dictionaries.  T his is a non-standard feature.
+
+    Rows are records.Record tuples, read-only mappings from column
+    name to value; dict(row) makes a real dictionary."""
+
+    _record_for = None
 
     def _decorate_row(self, row):
-        dictrow = {}
-        index = 0
-        for r in row:
-            key = self.description[index][0]
-            dictrow[key] = r
-            index += 1
-        return dictrow
+        if self._record_for is not self.description:
+            self._record = record_class([column[0]
+                                         for column in self.description])
+            self._record_for = self.description
+        return self._record(row)
 
 """
 More Cursor options
@@ -412,32 +1221,31 @@ class CursorTriggeredSetMixIn(object):
     trigger column(s) change value."""
 
     _trigger_init = False
+    _trigger_names = ()
     _trigger_columns = ()
-    _trigger_column_values = {}
+    # trigger values are compared on the text of each row
+    _typed_rows = False
 
     def _command_output_handler(self, id, output):
-        description = []
-        columns = output.readline().replace('\n', '').split('\t')
-        _buffer = output.readline()
-        buffer = _buffer.replace('\n', '').split('\t')
-        index = 0
-        for column in columns:
-            description.append((column, infer_type(buffer[index])))
-            index += 1
-        self._descriptions[id] = tuple(description)
-        self._result[id] = output
-        self._buffer[id] = _buffer
+        super(CursorTriggeredSetMixIn, self)._command_output_handler(id, output)
+        description = self._descriptions[id]
+        if description is None:
+            return
+        if self._buffer[id] is None:
+            self._buffer[id] = output.readline()
+        buffer = self._buffer[id].replace('\n', '').split('\t')
         # new stuff: initialzie the _trigger_columns and _trigger_column_values
         # make sure _trigger_columns are indices
         columns = []
         index = 0
         for column in description:
-            if column[0] in self._trigger_columns and type(column[0]) == str:
+            if column[0] in self._trigger_names:
                 columns.append(index)
             index += 1               
         self._trigger_init = True
         self._trigger_columns = tuple(columns) 
-        # initialzie _trigger_column_values
+        # initialzie _trigger_column_values, per cursor
+        self._trigger_column_values = {}
         index = 0
         for column in self._trigger_columns:
             self._trigger_column_values[index] = buffer[column]
@@ -445,7 +1253,7 @@ class CursorTriggeredSetMixIn(object):
 
     def _read_buffer(self):
         _buffer = self._result[self._result_index].readline()
-        if self._trigger_columns == ():
+        if self._trigger_columns == () or not _buffer:
             return _buffer
         buffer = _buffer.replace('\n', '').split('\t')
         # detect changes in trigger columns
@@ -471,8 +1279,13 @@ class CursorTriggeredSetMixIn(object):
         del self._buffer[self._result_index]
         return None
 
+    def _raw_blocks(self, blocksize):
+        # result sets end where trigger values change, so the output
+        # is read a line at a time
+        return self._line_blocks()
+
     def settriggers(self, columns):
-        self._trigger_columns = columns
+        self._trigger_names = tuple(columns)
 
         
 """
@@ -485,6 +1298,19 @@ class Cursor(CursorTupleRowsMixIn, CursorStreamResultMixIn,
     """This is the standard Cursor class that returns rows as tuples
     and streams the result set in the client."""
 
+class StoreCursor(CursorTupleRowsMixIn, CursorStoreResultMixIn,
+                  BaseCursor):
+
+    """This is a Cursor class that returns rows as tuples and stores
+    the result set in the client, allowing scroll() in any
+    direction."""
+
+class StoreDictCursor(CursorDictRowsMixIn, CursorStoreResultMixIn,
+                      BaseCursor):
+
+    """This is a Cursor class that returns rows as dictionaries and
+    stores the result set in the client."""
+
 class TriggeredCursor(CursorTriggeredSetMixIn, CursorTupleRowsMixIn,
                       CursorStreamResultMixIn, BaseCursor):
 
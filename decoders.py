@@ -0,0 +1,112 @@
+"""
+Hive db row decoders
+This module compiles one decoding function per result set from its
+description, instead of dispatching on the type name of every cell.
+
+Converters are registered per type name.  The built in ones are
+int, float, str and json; register_converter() adds others (for
+example 'timestamp' or 'boolean', which the schema resolver passes
+through when a converter exists for them) or replaces these.
+"""
+
+import simplejson as json
+from threading import Lock
+
+NULL = 'NULL'
+
+def _int(value):
+    return int(float(value))
+
+# type name -> (converter or None for no conversion, NULL value)
+_converters = {
+    'int': (int, 0),
+    'float': (float, 0.0),
+    'str': (None, ''),
+    'json': (json.loads, None),
+}
+_builtin = dict(_converters)
+# converters used when the fast one raises, e.g. '1.0' in an int column
+_fallbacks = {'int': _int}
+_compiled = {}
+_lock = Lock()
+
+def register_converter(type, converter, null=None):
+    """Decode cells of columns typed type with converter(value).
+    NULL cells become null instead."""
+    _lock.acquire()
+    try:
+        _converters[type] = (converter, null)
+        _fallbacks.pop(type, None)
+        _compiled.clear()
+    finally:
+        _lock.release()
+
+def has_converter(type):
+    return _converters.has_key(type)
+
+def is_builtin(type):
+    """True if type is decoded by an unreplaced built in converter."""
+    return _builtin.get(type, False) == _converters.get(type)
+
+def null_value(type):
+    """What NULL cells of columns typed type decode to."""
+    return _converters.get(type, (None, None))[1]
+
+def convert(type, value):
+    """Decode a single cell.  Unknown types are left as strings."""
+    converter, null = _converters.get(type, (None, value))
+    if value == NULL:
+        return null
+    if converter is None:
+        return value
+    try:
+        return converter(value)
+    except ValueError:
+        if not _fallbacks.has_key(type):
+            raise
+        return _fallbacks[type](value)
+
+def _slow_decoder(types):
+    def decode(row):
+        decoded = [convert(type, value) for type, value in zip(types, row)]
+        return tuple(decoded + row[len(types):])
+    return decode
+
+def _compile(types):
+    namespace = {'_slow': _slow_decoder(types)}
+    names = ['f%d' % i for i in range(len(types))]
+    cells = []
+    for i, type in enumerate(types):
+        converter, null = _converters.get(type, (None, None))
+        namespace['n%d' % i] = null
+        if type not in _converters:
+            cells.append('f%d' % i)
+        elif converter is None:
+            cells.append('(f%d if f%d != %r else n%d)' % (i, i, NULL, i))
+        else:
+            namespace['c%d' % i] = converter
+            cells.append('(c%d(f%d) if f%d != %r else n%d)'
+                         % (i, i, i, NULL, i))
+    source = ['def decode(row):',
+              '    try:',
+              '        %s, = row' % ', '.join(names),
+              '        return (%s,)' % ', '.join(cells),
+              '    except ValueError:',
+              '        return _slow(row)']
+    exec '\n'.join(source) in namespace
+    return namespace['decode']
+
+def compile_decoder(description):
+    """Return decode(fields) -> tuple for rows of a result set with
+    this description.  fields is the list of raw cells of one row."""
+    types = tuple([column[1] for column in description or ()])
+    if not types:
+        return tuple
+    decoder = _compiled.get(types)
+    if decoder is None:
+        _lock.acquire()
+        try:
+            decoder = _compiled[types] = _compile(types)
+        finally:
+            _lock.release()
+    return decoder
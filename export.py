@@ -0,0 +1,162 @@
+"""
+Hive db bulk export
+This module writes raw hive output to files without building rows.
+TSV is hive's own format, so it is copied a block at a time; CSV and
+JSON lines are converted a block of lines at a time.  Output can be
+gzip, bz2 or (with the zstandard package installed) zstd compressed.
+
+Used by cursor.copy_to().
+"""
+
+import csv
+import gzip
+import bz2
+import simplejson as json
+from decoders import NULL
+from errors import NotSupportedError, ProgrammingError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMATS = ('tsv', 'csv', 'jsonl')
+SUFFIXES = {'.gz': 'gzip', '.bz2': 'bz2', '.zst': 'zstd'}
+
+def _compression_for(path):
+    for suffix, compression in SUFFIXES.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+def open_target(target, compression=None):
+    """Return (file, close) for a path or an open file object.
+    compression is None, 'gzip', 'bz2' or 'zstd'; for paths it is
+    taken from the suffix when not given.  close() finishes the
+    compressed stream, and closes the file if it was opened here."""
+    owned = isinstance(target, basestring)
+    if owned and compression is None:
+        compression = _compression_for(target)
+    if compression is None:
+        if owned:
+            target = open(target, 'wb')
+            return target, target.close
+        return target, lambda: None
+    if compression == 'gzip':
+        if owned:
+            stream = gzip.open(target, 'wb', 6)
+        else:
+            stream = gzip.GzipFile(fileobj=target, mode='wb',
+                                   compresslevel=6)
+        return stream, stream.close
+    if compression == 'bz2':
+        if owned:
+            stream = bz2.BZ2File(target, 'wb')
+            return stream, stream.close
+        stream = _Compressed(target, bz2.BZ2Compressor(), False)
+        return stream, stream.close
+    if compression == 'zstd':
+        if zstandard is None:
+            raise NotSupportedError('zstd compression needs the '
+                                    'zstandard package')
+        if owned:
+            target = open(target, 'wb')
+        stream = _Compressed(target,
+                             zstandard.ZstdCompressor().compressobj(), owned)
+        return stream, stream.close
+    raise ProgrammingError('unknown compression %r' % compression)
+
+
+class _Compressed(object):
+
+    """File-like writer over a compressor object with compress() and
+    flush(), used where the standard library has no stream wrapper."""
+
+    def __init__(self, fileobj, compressor, owned):
+        self.fileobj = fileobj
+        self.compressor = compressor
+        self.owned = owned
+
+    def write(self, data):
+        data = self.compressor.compress(data)
+        if data:
+            self.fileobj.write(data)
+
+    def close(self):
+        self.fileobj.write(self.compressor.flush())
+        if self.owned:
+            self.fileobj.close()
+
+def _lines(blocks):
+    """Regroup blocks of output into lists of complete lines."""
+    rest = ''
+    for block in blocks:
+        lines = (rest + block).split('\n')
+        rest = lines.pop()
+        if lines:
+            yield lines
+    if rest:
+        yield [rest]
+
+def _copy_tsv(blocks, write, progress):
+    rows = written = 0
+    for block in blocks:
+        write(block)
+        rows += block.count('\n')
+        written += len(block)
+        if progress is not None:
+            progress(rows, written)
+    if written and block[-1:] != '\n':
+        rows += 1
+    return rows
+
+def _copy_csv(blocks, write, progress, null):
+    class Sink(object):
+        written = 0
+        def write(self, data):
+            self.written += len(data)
+            write(data)
+    sink = Sink()
+    writer = csv.writer(sink, lineterminator='\n')
+    rows = 0
+    for lines in _lines(blocks):
+        cells = [line.split('\t') for line in lines]
+        if null != NULL:
+            cells = [[null if cell == NULL else cell for cell in row]
+                     for row in cells]
+        writer.writerows(cells)
+        rows += len(lines)
+        if progress is not None:
+            progress(rows, sink.written)
+    return rows
+
+def _copy_jsonl(blocks, write, progress, names, decoder):
+    rows = written = 0
+    dumps = json.dumps
+    for lines in _lines(blocks):
+        data = '\n'.join([dumps(dict(zip(names, decoder(line.split('\t')))))
+                          for line in lines]) + '\n'
+        write(data)
+        rows += len(lines)
+        written += len(data)
+        if progress is not None:
+            progress(rows, written)
+    return rows
+
+def copy(blocks, fileobj, format, description, decoder, header=False,
+         null='', progress=None):
+    """Write blocks of raw hive output (tab separated lines) to
+    fileobj as format.  Returns the number of rows written."""
+    if format not in FORMATS:
+        raise ProgrammingError('unknown export format %r' % format)
+    names = [column[0] for column in description or ()]
+    write = fileobj.write
+    if header and names and format == 'tsv':
+        write('\t'.join(names) + '\n')
+    elif header and names and format == 'csv':
+        csv.writer(fileobj, lineterminator='\n').writerow(names)
+    if format == 'tsv':
+        return _copy_tsv(blocks, write, progress)
+    if format == 'csv':
+        return _copy_csv(blocks, write, progress, null)
+    return _copy_jsonl(blocks, write, progress, names, decoder)
@@ -0,0 +1,154 @@
+"""
+Hive db instrumentation
+This module records where the time of each query goes: starting
+hive, running the job, moving the result and decoding it on the
+client.  Pass a sink to Connection(instrument=...); without one
+nothing is recorded.
+
+A sink is anything with a record(stats) method, or a plain callable
+taking a QueryStats.
+"""
+
+import time
+import logging
+from bisect import insort, bisect_left
+from collections import deque
+from threading import Lock
+
+clock = time.clock
+
+class QueryStats(object):
+
+    """Timings and counters for one result set.  Times are seconds
+    since started unless noted; None means it did not happen.
+
+    spawn            starting hive (or checking out a pooled session)
+    first_stderr     first line hive wrote to stderr
+    job              hive reported the job done (OK) or failed
+    first_row        first block of output arrived
+    finished         result read to the end or discarded
+    bytes_read       bytes of output read from hive
+    rows             rows decoded by the cursor
+    decode_cpu       CPU seconds spent decoding rows
+    """
+
+    __slots__ = ('id', 'statement', 'started', 'spawn', 'first_stderr',
+                 'job', 'first_row', 'finished', 'bytes_read', 'rows',
+                 'decode_cpu', 'source', 'error', '_sink')
+
+    def __init__(self, id, statement, sink):
+        self.id = id
+        self.statement = statement
+        self.started = time.time()
+        self.spawn = self.first_stderr = self.job = None
+        self.first_row = self.finished = self.error = None
+        self.bytes_read = self.rows = 0
+        self.decode_cpu = 0.0
+        self.source = 'cli'
+        self._sink = sink
+
+    def mark(self, name):
+        """Record the time of an event unless it was already seen."""
+        if getattr(self, name) is None:
+            setattr(self, name, time.time() - self.started)
+
+    def emit(self, error=None):
+        """Hand the stats to the sink, once."""
+        sink, self._sink = self._sink, None
+        if sink is None:
+            return
+        self.mark('finished')
+        if error is not None:
+            self.error = error
+        if hasattr(sink, 'record'):
+            sink.record(self)
+        else:
+            sink(self)
+
+    @property
+    def rows_per_sec(self):
+        if self.rows and self.finished and self.first_row is not None:
+            elapsed = self.finished - self.first_row
+            return elapsed and self.rows / elapsed or None
+
+    def as_dict(self):
+        values = dict([(name, getattr(self, name))
+                       for name in self.__slots__ if name[0] != '_'])
+        values['rows_per_sec'] = self.rows_per_sec
+        return values
+
+
+class LoggingSink(object):
+
+    """Logs one line per query."""
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('hivedb.stats')
+        self.level = level
+
+    def record(self, stats):
+        self.logger.log(self.level,
+                        'Query(%s) source=%s spawn=%s first_stderr=%s '
+                        'job=%s first_row=%s finished=%s bytes=%s rows=%s '
+                        'decode_cpu=%.3f error=%s', stats.id, stats.source,
+                        _fmt(stats.spawn), _fmt(stats.first_stderr),
+                        _fmt(stats.job), _fmt(stats.first_row),
+                        _fmt(stats.finished), stats.bytes_read, stats.rows,
+                        stats.decode_cpu, stats.error)
+
+def _fmt(value):
+    return value is None and '-' or '%.3f' % value
+
+
+class StatsAggregator(object):
+
+    """Keeps the last window values of every timing and reports
+    percentiles over them.  Safe to share between connections."""
+
+    metrics = ('spawn', 'first_stderr', 'job', 'first_row', 'finished',
+               'bytes_read', 'rows', 'decode_cpu', 'rows_per_sec')
+
+    def __init__(self, window=10000):
+        self.window = window
+        self.count = self.errors = 0
+        self._recent = dict([(m, deque()) for m in self.metrics])
+        self._sorted = dict([(m, []) for m in self.metrics])
+        self._lock = Lock()
+
+    def record(self, stats):
+        self._lock.acquire()
+        try:
+            self.count += 1
+            if stats.error is not None:
+                self.errors += 1
+            for metric in self.metrics:
+                value = getattr(stats, metric)
+                if value is None:
+                    continue
+                recent, ordered = self._recent[metric], self._sorted[metric]
+                if len(recent) >= self.window:
+                    del ordered[bisect_left(ordered, recent.popleft())]
+                recent.append(value)
+                insort(ordered, value)
+        finally:
+            self._lock.release()
+
+    def percentile(self, metric, p):
+        """Nearest-rank p-th percentile of metric, None if unseen."""
+        self._lock.acquire()
+        try:
+            ordered = self._sorted[metric]
+            if not ordered:
+                return None
+            rank = int(round(p / 100.0 * (len(ordered) - 1)))
+            return ordered[rank]
+        finally:
+            self._lock.release()
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """{metric: {p: value}} plus query and error counts."""
+        summary = {'count': self.count, 'errors': self.errors}
+        for metric in self.metrics:
+            summary[metric] = dict([(p, self.percentile(metric, p))
+                                    for p in percentiles])
+        return summary
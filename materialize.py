@@ -0,0 +1,129 @@
+"""
+Hive db local materialization
+This module loads a result set into a SQLite table, so it can be
+filtered, sorted and joined again locally without going back to hive.
+Rows are inserted in large batches, one transaction per batch, and
+indexes are built once the rows are in.
+
+Used by cursor.materialize().
+"""
+
+import sqlite3
+from decoders import NULL, convert, is_builtin
+
+# cursors type name -> SQLite column type; others are TEXT
+SQLITE_TYPES = {
+    'int': 'INTEGER',
+    'float': 'REAL',
+    'str': 'TEXT',
+    'json': 'TEXT',
+}
+
+def _int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return int(float(value))
+
+def _converter(type):
+    """Function making the SQLite value of a cell, None for the text
+    as it is.  json stays text, SQLite's json functions read it."""
+    if type in ('int', 'float') and is_builtin(type):
+        return type == 'int' and _int or float
+    if type in SQLITE_TYPES:
+        return None
+    def adapt(value):
+        value = convert(type, value)
+        if value is None or isinstance(value, (int, long, float, str,
+                                               unicode, buffer)):
+            return value
+        return str(value)
+    return adapt
+
+def quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+def column_names(description):
+    """Column names for SQLite: without the table prefix where that
+    is unambiguous, else with '.' replaced by '_'."""
+    names = [column[0] for column in description]
+    short = [name.rsplit('.', 1)[-1] for name in names]
+    result = []
+    for name, base in zip(names, short):
+        if short.count(base) == 1:
+            result.append(base)
+        else:
+            result.append(name.replace('.', '_'))
+    return result
+
+def connect(target):
+    """An sqlite3 connection for target: a path, ':memory:' or an
+    sqlite3.Connection already open (returned as it is)."""
+    if isinstance(target, sqlite3.Connection):
+        return target
+    connection = sqlite3.connect(target, check_same_thread=False)
+    # hive rows are byte strings, keep them that way
+    connection.text_factory = str
+    return connection
+
+def create_table(connection, table, description, replace=False):
+    """Create table with a column per description column; returns
+    the column names used."""
+    names = column_names(description)
+    if replace:
+        connection.execute('DROP TABLE IF EXISTS %s' % quote(table))
+    connection.execute('CREATE TABLE %s (%s)' % (quote(table), ', '.join(
+        ['%s %s' % (quote(name), SQLITE_TYPES.get(column[1], 'TEXT'))
+         for name, column in zip(names, description)])))
+    connection.commit()
+    return names
+
+def row_converter(description):
+    """Return convert(line) -> tuple of SQLite values for a raw line
+    of hive output.  NULL cells become None in every column."""
+    converters = list(enumerate([_converter(column[1])
+                                 for column in description]))
+    width = len(converters)
+    def convert_line(line):
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < width:
+            fields.extend([NULL] * (width - len(fields)))
+        values = []
+        for index, converter in converters:
+            value = fields[index]
+            if value == NULL:
+                values.append(None)
+            elif converter is None:
+                values.append(value)
+            else:
+                values.append(converter(value))
+        return tuple(values)
+    return convert_line
+
+def insert(connection, table, width, batches):
+    """Insert batches of row tuples, a transaction per batch; returns
+    the number of rows."""
+    statement = 'INSERT INTO %s VALUES (%s)' % (quote(table),
+                                                ', '.join(['?'] * width))
+    count = 0
+    for rows in batches:
+        connection.executemany(statement, rows)
+        connection.commit()
+        count += len(rows)
+    return count
+
+def create_indexes(connection, table, indexes, names):
+    """indexes is a sequence of column names or tuples of them (one
+    composite index each).  Names may carry the hive table prefix."""
+    for index in indexes:
+        if isinstance(index, basestring):
+            index = (index,)
+        columns = []
+        for column in index:
+            if column not in names:
+                column = column.rsplit('.', 1)[-1]
+            columns.append(column)
+        connection.execute('CREATE INDEX %s ON %s (%s)' % (
+            quote('%s_%s_idx' % (table, '_'.join(columns))), quote(table),
+            ', '.join([quote(column) for column in columns])))
+    connection.commit()
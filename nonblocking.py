@@ -0,0 +1,496 @@
+"""
+Hive db non-blocking connections
+This module runs hive processes from a single-threaded event loop
+instead of one Query thread per statement.  The loop polls the
+stdout and stderr pipes of every running query, so thousands of
+queries can be pending at once in one thread.
+
+AsyncCursor methods return AsyncFutures.  Callbacks run from the
+loop; result() on a future that is not done yet runs the loop until
+it is.  Cancelling a future kills its hive process.
+
+    connection = AsyncConnection()
+    cursor = connection.cursor()
+    cursor.execute('select ...').result()
+    rows = cursor.fetchmany(1000).result()
+"""
+
+import os
+import time
+import select
+import logging
+from subprocess import PIPE, Popen
+from collections import deque
+from connections import Connection
+from query import KILL_COMMAND, terminate, kill_jobs, note_job
+from cursors import infer_type, CursorDictRowsMixIn
+from decoders import compile_decoder
+from errors import Warning, Error, InterfaceError, DataError, \
+    DatabaseError, OperationalError, IntegrityError, InternalError, \
+    NotSupportedError, ProgrammingError
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+class AsyncFuture(object):
+
+    """Result of an AsyncCursor operation, completed by the loop."""
+
+    def __init__(self, loop, canceller=None):
+        self.loop = loop
+        self._canceller = canceller
+        self._done = False
+        self._cancelled = False
+        self._value = None
+        self._error = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        """Cancel the operation and kill the hive process behind it."""
+        if self._done:
+            return False
+        self._cancelled = True
+        if self._canceller is not None:
+            self._canceller()
+        if not self._done:
+            self.set_exception(OperationalError('cancelled'))
+        return True
+
+    def add_done_callback(self, fn):
+        if self._done:
+            fn(self)
+        else:
+            self._callbacks.append(fn)
+
+    def _complete(self):
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except:
+                logger.exception('Future callback failed')
+
+    def set_result(self, value):
+        if not self._done:
+            self._value = value
+            self._complete()
+
+    def set_exception(self, error):
+        if not self._done:
+            self._error = error
+            self._complete()
+
+    def exception(self, timeout=None):
+        if not self._done:
+            self.loop.run_until_complete(self, timeout)
+        return self._error
+
+    def result(self, timeout=None):
+        error = self.exception(timeout)
+        if error is not None:
+            raise error
+        return self._value
+
+
+class EventLoop(object):
+
+    """Minimal reactor over poll() (select() where poll() is not
+    available) for the pipes of running queries."""
+
+    def __init__(self):
+        self._readers = {}
+        if hasattr(select, 'poll'):
+            self._poll = select.poll()
+        else:
+            self._poll = None
+
+    def add_reader(self, fd, callback):
+        self._readers[fd] = callback
+        if self._poll is not None:
+            self._poll.register(fd, select.POLLIN | select.POLLPRI)
+
+    def remove_reader(self, fd):
+        if self._readers.pop(fd, None) is not None \
+                and self._poll is not None:
+            self._poll.unregister(fd)
+
+    def pending(self):
+        return len(self._readers)
+
+    def run_once(self, timeout=None):
+        """Dispatch whatever pipes are readable, waiting up to timeout
+        seconds for one to become so."""
+        if not self._readers:
+            return
+        if self._poll is not None:
+            ms = timeout is not None and int(timeout * 1000) or None
+            ready = [fd for fd, event in self._poll.poll(ms)]
+        else:
+            ready = select.select(self._readers.keys(), [], [], timeout)[0]
+        for fd in ready:
+            callback = self._readers.get(fd)
+            if callback is not None:
+                callback(fd)
+
+    def run_until_complete(self, future, timeout=None):
+        deadline = timeout is not None and time.time() + timeout
+        while not future.done():
+            if not self._readers:
+                raise InterfaceError('future can never complete: '
+                                     'nothing is running')
+            left = None
+            if deadline:
+                left = deadline - time.time()
+                if left <= 0:
+                    raise OperationalError('not done after %ss' % timeout)
+            self.run_once(left)
+        return future
+
+    def run_forever(self):
+        """Run until no query is left."""
+        while self._readers:
+            self.run_once()
+
+_default_loop = None
+
+def get_event_loop():
+    global _default_loop
+    if _default_loop is None:
+        _default_loop = EventLoop()
+    return _default_loop
+
+
+class AsyncQuery(object):
+
+    """A hive process whose pipes are read by the loop.  Output lines
+    are kept in a buffer of at most readahead lines; beyond that the
+    loop stops reading stdout until the cursor has caught up.
+
+    kill() stops hive's process group and runs kill_command for the
+    hadoop jobs hive started, as Query.cancel() does."""
+
+    readahead = 10000
+    blocksize = 64 * 1024
+    # seconds before kill() escalates to SIGKILL
+    grace = 5
+
+    def __init__(self, cursor, command, kill_command=KILL_COMMAND):
+        self.cursor = cursor
+        self.loop = cursor.loop
+        self.kill_command = kill_command
+        self.jobs = []
+        self.lines = deque()
+        self.header = None
+        self.failed = None
+        self.error = None
+        self.eof = False
+        self._out = self._err = ''
+        self._paused = False
+        self._stderr_open = True
+        # own process group, so kill() reaches hive's children too
+        self.process = Popen(command, stdout=PIPE, stderr=PIPE,
+                             close_fds=True, preexec_fn=os.setsid)
+        self._out_fd = self.process.stdout.fileno()
+        self._err_fd = self.process.stderr.fileno()
+        self.loop.add_reader(self._out_fd, self._read_stdout)
+        self.loop.add_reader(self._err_fd, self._read_stderr)
+
+    def _read_stderr(self, fd):
+        data = os.read(fd, self.blocksize)
+        if not data:
+            self._stderr_open = False
+            self.loop.remove_reader(fd)
+            self.process.stderr.close()
+            self._maybe_exit()
+            return
+        lines = (self._err + data).split('\n')
+        self._err = lines.pop()
+        for line in lines:
+            if 'Job = job_' in line:
+                note_job(self.jobs, line)
+            if line:
+                self.cursor._command_info_handler(line)
+            if line.startswith('FAILED'):
+                self.failed = line
+
+    def _read_stdout(self, fd):
+        data = os.read(fd, self.blocksize)
+        if not data:
+            self.loop.remove_reader(fd)
+            self.process.stdout.close()
+            if self._out:
+                self.lines.append(self._out)
+                self._out = ''
+            self.eof = True
+            self._maybe_exit()
+            return
+        lines = (self._out + data).split('\n')
+        self._out = lines.pop()
+        if self.header is None and lines:
+            self.header = lines.pop(0)
+        self.lines.extend(lines)
+        if len(self.lines) >= self.readahead:
+            self._paused = True
+            self.loop.remove_reader(fd)
+        self.cursor._data_ready(self)
+
+    def _maybe_exit(self):
+        if not self.eof or self._stderr_open:
+            return
+        status = self.process.wait()
+        if status != 0 or (self.failed and self.header is None):
+            self.error = ProgrammingError(self.failed or
+                                          'hive exited with status %s'
+                                          % status)
+        self.cursor._data_ready(self)
+
+    def done(self):
+        return self.eof and not self._stderr_open
+
+    def resume(self):
+        """Called when the cursor has consumed buffered lines."""
+        if self._paused and len(self.lines) < self.readahead / 2:
+            self._paused = False
+            self.loop.add_reader(self._out_fd, self._read_stdout)
+
+    def kill(self):
+        for fd in (self._out_fd, self._err_fd):
+            self.loop.remove_reader(fd)
+        terminate(self.process, self.grace)
+        self.process.wait()
+        for stream in (self.process.stdout, self.process.stderr):
+            stream.close()
+        self.eof = True
+        self._stderr_open = False
+        jobs, self.jobs = self.jobs, []
+        if jobs and self.kill_command:
+            kill_jobs(self.kill_command, jobs)
+
+
+class AsyncCursor(object):
+
+    """Non-blocking counterpart of cursors.Cursor.  execute(),
+    fetchone(), fetchmany() and fetchall() return AsyncFutures; rows
+    are tuples.  One statement at a time per cursor."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.loop = connection.loop
+        self.description = None
+        self.rowcount = -1
+        self.arraysize = 1
+        self.messages = []
+        self._query = None
+        self._execute_future = None
+        self._waiting = deque()
+        self._decoder = None
+
+    def execute(self, query, args=None):
+        """Start query.  The returned future completes with this
+        cursor once the description is known (the first row is in,
+        or hive finished without output)."""
+        if self.connection is None:
+            raise ProgrammingError('cursor closed')
+        self.cancel()
+        del self.messages[:]
+        if args is not None:
+            query = query % args
+        self.description = None
+        db = self.connection
+        command = db._hive_command() + ['-e', '"%s"' % db._hive_statement(query)]
+        future = AsyncFuture(self.loop, self.cancel)
+        self._execute_future = future
+        self._query = AsyncQuery(self, command, db._kill_command())
+        return future
+
+    def _command_info_handler(self, info):
+        if self.connection is not None and self.connection.verbose:
+            logger.info('Query: %s', info)
+
+    def _describe(self, query):
+        columns = query.header.split('\t')
+        first = query.lines and query.lines[0].split('\t') or []
+        description = []
+        for index, column in enumerate(columns):
+            type = 'str'
+            if index < len(first):
+                type = infer_type(first[index])
+            description.append((column, type))
+        self.description = tuple(description)
+        self._decoder = compile_decoder(self.description)
+
+    def _data_ready(self, query):
+        if query is not self._query:
+            return
+        future = self._execute_future
+        if future is not None and not future.done():
+            if query.error is not None:
+                self.messages.append((type(query.error), query.error))
+                future.set_exception(query.error)
+                return
+            if query.header is not None and (query.lines or query.eof):
+                self._describe(query)
+            elif not query.done():
+                return
+            future.set_result(self)
+        self._serve()
+
+    def _serve(self):
+        """Move buffered lines into waiting fetches, oldest first, and
+        complete those that are answered.  Lines are taken as they
+        arrive, so a large fetch does not hold up the reader."""
+        query = self._query
+        execute = self._execute_future
+        if execute is not None and not execute.done():
+            # no description to decode with yet
+            return
+        while self._waiting and query is not None:
+            future, size, rows = self._waiting[0]
+            if future.done():
+                self._waiting.popleft()
+                continue
+            if query.error is not None and not query.lines:
+                self._waiting.popleft()
+                future.set_exception(query.error)
+                continue
+            self._take(size, rows)
+            if len(rows) < size and not query.done():
+                break
+            self._waiting.popleft()
+            future.set_result(rows)
+        if query is not None:
+            query.resume()
+
+    def _take(self, size, rows):
+        lines = self._query.lines
+        while lines and len(rows) < size:
+            rows.append(self._decorate_row(self._decoder(
+                lines.popleft().split('\t'))))
+
+    def _decorate_row(self, row):
+        return row
+
+    def _fetch(self, size):
+        future = AsyncFuture(self.loop, self.cancel)
+        if self._query is None:
+            future.set_exception(ProgrammingError('execute() first'))
+            return future
+        self._waiting.append((future, size, []))
+        self._serve()
+        return future
+
+    def fetchmany(self, size=None):
+        """Future of up to size rows (cursor.arraysize by default);
+        fewer only at the end of the result."""
+        return self._fetch(size or self.arraysize)
+
+    def fetchone(self):
+        """Future of the next row, None at the end of the result."""
+        future = AsyncFuture(self.loop)
+        def done(rows):
+            if rows.exception() is not None:
+                future.set_exception(rows.exception())
+            else:
+                future.set_result(rows.result() and rows.result()[0] or None)
+        self._fetch(1).add_done_callback(done)
+        return future
+
+    def fetchall(self):
+        """Future of every remaining row."""
+        return self._fetch(float('inf'))
+
+    def __iter__(self):
+        """Blocking iteration that runs the loop while rows arrive."""
+        while True:
+            rows = self.fetchmany(max(self.arraysize, 1000)).result()
+            if not rows:
+                return
+            for row in rows:
+                yield row
+
+    def cancel(self):
+        """Kill the running hive process and fail pending fetches."""
+        query, self._query = self._query, None
+        if query is None:
+            return
+        query.kill()
+        error = OperationalError('cancelled')
+        for future in (self._execute_future,):
+            if future is not None and not future.done():
+                future.set_exception(error)
+        while self._waiting:
+            self._waiting.popleft()[0].set_exception(error)
+
+    def close(self):
+        self.cancel()
+        self.connection = None
+
+    def setinputsizes(self, *args):
+        """ Does nothing, required by DB API. """
+
+    def setoutputsizes(self, *args):
+        """ Does nothing, required by DB API. """
+
+    Warning = Warning
+    Error = Error
+    InterfaceError = InterfaceError
+    DatabaseError = DatabaseError
+    DataError = DataError
+    OperationalError = OperationalError
+    IntegrityError = IntegrityError
+    InternalError = InternalError
+    ProgrammingError = ProgrammingError
+    NotSupportedError = NotSupportedError
+
+
+class AsyncDictCursor(CursorDictRowsMixIn, AsyncCursor):
+
+    """Non-blocking cursor that returns rows as dictionaries."""
+
+
+class AsyncConnection(Connection):
+
+    """Connection whose cursors run on an EventLoop.
+
+    loop
+        EventLoop, default get_event_loop()
+
+    Session pooling, other transports than the CLI, timeouts, the
+    result cache, instrumentation, schema resolution, priorities and
+    progress reporting are not available for non-blocking
+    connections; asking for them raises NotSupportedError.
+
+    The loop starts hive at once, without waiting for a slot, so
+    these hive processes do not count against
+    scheduler.admission's limits.
+    """
+
+    default_cursor = AsyncCursor
+    # Connection options the loop does not implement
+    unsupported = ('pool_size', 'transport', 'timeout', 'result_cache',
+                   'instrument', 'resolve_types', 'priority', 'progress',
+                   'trace_directory')
+
+    def __init__(self, *args, **kwargs):
+        self.loop = kwargs.pop('loop', None) or get_event_loop()
+        for option in self.unsupported:
+            if kwargs.get(option):
+                raise NotSupportedError('%s is not supported by '
+                                        'AsyncConnection' % option)
+        Connection.__init__(self, *args, **kwargs)
+
+    def execute(self, query, args=None):
+        """Run query on a new cursor; future of the cursor."""
+        return self.cursor().execute(query, args)
+
+    def submit(self, query, args=None, cursorclass=None):
+        """Run query on a new cursor; future of the cursor, as
+        execute()."""
+        return self.cursor(cursorclass).execute(query, args)
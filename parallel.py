@@ -0,0 +1,85 @@
+"""
+Hive db parallel decoding
+This module decodes rows in a pool of worker processes, for results
+whose decoding (json columns especially) keeps one CPU busy.  Raw
+output is cut into line-aligned chunks, each chunk is decoded by a
+worker and rows come back in their original order.  Only a bounded
+number of chunks is in flight, so a fast hive does not fill memory.
+
+Workers are forked when the pool starts; converters registered after
+that are not seen by them.
+
+Used by cursors with decode_workers set.
+"""
+
+from collections import deque
+from multiprocessing import Pool
+from decoders import compile_decoder
+
+def decode_chunk(types, chunk):
+    """Decode a chunk of raw lines (no trailing newline) into a list
+    of row tuples.  Runs in a worker."""
+    decode = compile_decoder([(None, type) for type in types])
+    return [decode(line.split('\t')) for line in chunk.split('\n')]
+
+def chunks(blocks, size):
+    """Regroup blocks of output into chunks of about size bytes that
+    end on a line boundary.  Chunks have no trailing newline."""
+    pending = []
+    pending_bytes = 0
+    for block in blocks:
+        pending.append(block)
+        pending_bytes += len(block)
+        if pending_bytes < size:
+            continue
+        data = ''.join(pending)
+        end = data.rfind('\n')
+        if end < 0:
+            pending = [data]
+            continue
+        yield data[:end]
+        rest = data[end + 1:]
+        pending, pending_bytes = [rest], len(rest)
+    data = ''.join(pending).rstrip('\n')
+    if data:
+        yield data
+
+
+class ParallelDecoder(object):
+
+    """A pool of workers decoding chunks of raw output.
+
+    workers
+        integer, number of worker processes.
+
+    chunk_bytes
+        integer, default 256KB.  size of the chunks handed to workers.
+
+    inflight
+        integer, default 2 * workers.  chunks submitted but not yet
+        consumed.
+    """
+
+    def __init__(self, workers, chunk_bytes=256 * 1024, inflight=None):
+        self.workers = workers
+        self.chunk_bytes = chunk_bytes
+        self.inflight = inflight or 2 * workers
+        self.pool = Pool(workers)
+
+    def decode(self, blocks, types):
+        """Generate the rows of blocks of raw output, in order."""
+        types = tuple(types)
+        pending = deque()
+        for chunk in chunks(blocks, self.chunk_bytes):
+            pending.append(self.pool.apply_async(decode_chunk,
+                                                 (types, chunk)))
+            if len(pending) >= self.inflight:
+                for row in pending.popleft().get():
+                    yield row
+        while pending:
+            for row in pending.popleft().get():
+                yield row
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
@@ -0,0 +1,298 @@
+"""
+Hive db partitioned queries
+This module splits a query over a partitioned table into one query
+per partition (or range of partitions), so they can run at the same
+time, and merges their output back into a single result stream.
+Rows come in the order partitions produce them, or sorted on the
+ORDER BY columns with a k-way merge.  The merge compares keys the way
+hive sorted them: numbers by value and everything else as text.
+
+Used by cursor.execute_partitioned().
+"""
+
+import re
+import heapq
+from Queue import Queue, Full
+from threading import Lock
+from store import ResultStore
+from decoders import NULL
+from errors import ProgrammingError, NotSupportedError
+
+CLAUSE_RE = re.compile(r'\b(where|group\s+by|having|cluster\s+by|'
+                       r'distribute\s+by|sort\s+by|order\s+by|limit|union)\b',
+                       re.I)
+
+def _clauses(query):
+    """[(keyword, start, end)] of the clauses of query outside
+    parentheses and quotes."""
+    outside = []
+    depth = 0
+    quote = None
+    escaped = False
+    for char in query:
+        outside.append(depth == 0 and quote is None)
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif quote:
+            if char == quote:
+                quote = None
+        elif char in '\'"`':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+    return [(' '.join(match.group(1).lower().split()), match.start(),
+             match.end())
+            for match in CLAUSE_RE.finditer(query) if outside[match.start()]]
+
+def literal(value):
+    if isinstance(value, (int, long)) and not isinstance(value, bool):
+        return str(value)
+    if isinstance(value, float):
+        return repr(value)
+    return "'%s'" % str(value).replace('\\', '\\\\').replace("'", "\\'")
+
+def predicate(column, value):
+    """Condition selecting partition value, or low <= column < high
+    for a (low, high) tuple."""
+    if isinstance(value, tuple):
+        low, high = value
+        return '%s >= %s AND %s < %s' % (column, literal(low), column,
+                                         literal(high))
+    return '%s = %s' % (column, literal(value))
+
+def sort_keys(order_by):
+    """Column names of an order_by argument: a name, a comma
+    separated list of names or a sequence of them."""
+    if not order_by:
+        return []
+    if isinstance(order_by, basestring):
+        order_by = order_by.split(',')
+    keys = []
+    for key in order_by:
+        words = key.split()
+        if len(words) > 1 and words[1].lower() == 'desc':
+            raise NotSupportedError('descending merge on %s' % words[0])
+        keys.append(words[0])
+    return keys
+
+def restrict(query, condition, keys=None):
+    """query with condition added to its WHERE clause and, if it has
+    no ORDER BY, sorted on keys."""
+    query = query.strip().rstrip(';').strip()
+    clauses = _clauses(query)
+    if [clause for clause in clauses if clause[0] == 'union']:
+        raise ProgrammingError('UNION queries can not be partitioned')
+    if keys and not [clause for clause in clauses
+                     if clause[0] in ('order by', 'sort by')]:
+        limit = [clause[1] for clause in clauses if clause[0] == 'limit']
+        stop = limit and limit[0] or len(query)
+        query = '%s ORDER BY %s %s' % (query[:stop].rstrip(),
+                                       ', '.join(keys), query[stop:])
+        clauses = _clauses(query)
+    where = [clause for clause in clauses if clause[0] == 'where']
+    if where:
+        end = where[0][2]
+        rest = [clause[1] for clause in clauses if clause[1] > end]
+        stop = rest and rest[0] or len(query)
+        query = '%s (%s) AND (%s) %s' % (query[:end], query[end:stop].strip(),
+                                         condition, query[stop:])
+    else:
+        stop = clauses and clauses[0][1] or len(query)
+        query = '%s WHERE %s %s' % (query[:stop].rstrip(), condition,
+                                    query[stop:])
+    return query.strip()
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+def _sort_value(value, numeric):
+    # NULL sorts first, as in hive's ascending order
+    if value == NULL:
+        return None
+    if numeric:
+        return _number(value)
+    return value
+
+def _sort_key(line, columns, numeric):
+    fields = line.split('\t')
+    return tuple([_sort_value(fields[column], number)
+                  for column, number in zip(columns, numeric)])
+
+def _is_sorted(store, columns, numeric):
+    previous = None
+    for i in xrange(len(store)):
+        try:
+            key = _sort_key(store[i], columns, numeric)
+        except ValueError:
+            return False
+        if previous is not None and key < previous:
+            return False
+        previous = key
+    return True
+
+
+class PartitionedResult(object):
+
+    """File-like output of count partition queries: the header once,
+    then their rows.  Each query thread hands its output to feed()
+    and calls finish() when done (add_done_callback).
+
+    Without keys rows are passed on as they arrive, through a queue
+    of at most maxsize lines, so feeders wait for a slow reader.  With
+    keys every partition is kept in a ResultStore and the stores are
+    merged on the keys columns once all partitions are done.
+
+    types(columns), if given, returns the type name (as in
+    cursor.description) of each named column, None where unknown.
+    int and float keys are compared as numbers, other known types as
+    text.  A key of unknown type is compared as numbers only if every
+    partition is sorted that way.
+    """
+
+    def __init__(self, count, keys=None, maxsize=10000,
+                 store_max_bytes=64 * 1024 * 1024, store_directory=None,
+                 types=None):
+        self.count = count
+        self.keys = keys
+        self.types = types
+        self.store_max_bytes = store_max_bytes
+        self.store_directory = store_directory
+        self.closed = False
+        self._queue = Queue(maxsize)
+        self._header = None
+        self._description = None
+        self._done = 0
+        self._stores = {}
+        self._merged = None
+        self._lock = Lock()
+
+    def _put(self, item):
+        while not self.closed:
+            try:
+                self._queue.put(item, True, 0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def feed(self, index, stream):
+        """Read partition index's output to the end."""
+        header = stream.readline()
+        if not header:
+            return
+        self._lock.acquire()
+        try:
+            # under the lock, so no rows are queued before it
+            if self._header is None:
+                self._header = header
+                # typed results (HiveServer2) know their column types
+                self._description = getattr(stream, 'description', None)
+                self._put(header)
+        finally:
+            self._lock.release()
+        if self.keys:
+            store = ResultStore(self.store_max_bytes, self.store_directory)
+            self._stores[index] = store
+            store.extend(iter(stream.readline, ''))
+            store.finish()
+            return
+        for line in iter(stream.readline, ''):
+            if not self._put(line):
+                break
+
+    def finish(self, query):
+        error = query.exc_info and query.exc_info[1] or None
+        self._put((query.id, error))
+
+    def _wait(self):
+        """Next queued line, '' once every partition is done."""
+        while self._done < self.count:
+            item = self._queue.get()
+            if self.closed:
+                return ''
+            if not isinstance(item, tuple):
+                return item
+            self._done += 1
+            if item[1] is not None:
+                self.close()
+                raise item[1]
+        return ''
+
+    def _rows(self, index, columns, numeric):
+        store = self._stores[index]
+        for i in xrange(len(store)):
+            line = store[i]
+            yield _sort_key(line, columns, numeric), index, line
+
+    def _key_types(self, names, columns):
+        if self._description is not None:
+            return [self._description[column][1] for column in columns]
+        if self.types is None:
+            return [None] * len(columns)
+        return self.types([names[column] for column in columns])
+
+    def _numeric(self, names, columns):
+        """Whether each key column is compared as numbers."""
+        numeric = []
+        for position, type in enumerate(self._key_types(names, columns)):
+            if type is None:
+                # decided by the order hive produced
+                keys = columns[:position + 1]
+                number = all(_is_sorted(store, keys, numeric + [True])
+                             for store in self._stores.values())
+            else:
+                number = type in ('int', 'float')
+            numeric.append(number)
+        return numeric
+
+    def _merge(self):
+        names = self._header.rstrip('\n').split('\t')
+        columns = []
+        for key in self.keys:
+            matches = [i for i, name in enumerate(names)
+                       if name == key or name.endswith('.' + key)]
+            if not matches:
+                raise ProgrammingError('order_by column %s not in result'
+                                       % key)
+            columns.append(matches[0])
+        numeric = self._numeric(names, columns)
+        return heapq.merge(*[self._rows(index, columns, numeric)
+                             for index in sorted(self._stores)])
+
+    def readline(self):
+        if self.closed:
+            return ''
+        if not self.keys:
+            return self._wait()
+        if self._merged is None:
+            header = self._wait()
+            while self._wait():
+                pass
+            if not header:
+                return ''
+            self._merged = self._merge()
+            return header
+        for key, index, line in self._merged:
+            return line + '\n'
+        return ''
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        self.closed = True
+        try:
+            # wake a reader waiting for lines
+            self._queue.put_nowait((None, None))
+        except Full:
+            pass
+        for store in self._stores.values():
+            store.close()
+        self._stores = {}
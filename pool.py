@@ -0,0 +1,496 @@
+"""
+Hive session pool
+This module keeps long-lived HIVE CLI processes around so queries
+do not pay JVM and metastore startup every time.  Statements are
+written to a session's stdin, and the end of each result is marked
+by a line hive echoes back on stdout.
+
+Connection creates a SessionPool when pool_size is given; cursors
+then run their queries through SessionQuery instead of Query.
+"""
+
+import os
+import time
+import uuid
+import select
+import logging
+from threading import Condition
+from subprocess import PIPE, Popen
+from query import Query, marker_statements, marker_line, terminate, \
+    kill_jobs
+from errors import OperationalError, ProgrammingError
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+SESSION_SETUP = ('set hive.cli.print.header=true;',
+                 'set hive.cli.errors.ignore=true;')
+
+class Session(object):
+
+    """A single long-lived hive process reading statements on stdin.
+
+    stdout and stderr are multiplexed with select() so a chatty
+    stderr can never block a large result (or the other way round).
+    """
+
+    def __init__(self, command, setup=SESSION_SETUP):
+        self.command = command
+        self.process = Popen(command, stdin=PIPE, stdout=PIPE,
+                             stderr=PIPE, close_fds=True,
+                             preexec_fn=os.setsid)
+        self._out_fd = self.process.stdout.fileno()
+        self._err_fd = self.process.stderr.fileno()
+        self._out = ''
+        self._err = ''
+        self._err_closed = False
+        self.info_cb = None
+        self.failed = None
+        self.uses = 0
+        self.last_used = time.time()
+        self.dead = False
+        self._send('\n'.join(setup) + '\n')
+
+    def alive(self):
+        return not self.dead and self.process.poll() is None
+
+    def _send(self, data):
+        try:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except (IOError, OSError), e:
+            self.dead = True
+            raise OperationalError('hive session died: %s' % e)
+
+    def _stderr_line(self, line):
+        if line.startswith('FAILED'):
+            self.failed = line
+        if line and self.info_cb:
+            self.info_cb(line)
+
+    def _read_stderr(self):
+        chunk = os.read(self._err_fd, 65536)
+        if not chunk:
+            self._err_closed = True
+        self._err += chunk
+        while '\n' in self._err:
+            line, self._err = self._err.split('\n', 1)
+            self._stderr_line(line)
+
+    def sync_stderr(self):
+        """Read whatever hive has written to stderr so far."""
+        while not self._err_closed and \
+                select.select([self._err_fd], [], [], 0)[0]:
+            self._read_stderr()
+
+    def _pump(self, timeout=None):
+        """Read whatever is available on stdout and stderr.  Returns
+        False if nothing arrived before timeout."""
+        fds = [self._out_fd]
+        if not self._err_closed:
+            fds.append(self._err_fd)
+        ready = select.select(fds, [], [], timeout)[0]
+        if not ready:
+            return False
+        # stderr goes first; hive writes FAILED before the marker
+        if self._err_fd in ready:
+            self._read_stderr()
+        if self._out_fd in ready:
+            chunk = os.read(self._out_fd, 65536)
+            if not chunk:
+                self.dead = True
+            self._out += chunk
+        return True
+
+    def readline(self, timeout=None, sync_stderr=False):
+        """Return the next stdout line, '' once the process is gone,
+        or None if timeout expires first."""
+        deadline = timeout is not None and time.time() + timeout
+        while '\n' not in self._out:
+            if self.dead:
+                line, self._out = self._out, ''
+                return line
+            wait = None
+            if deadline:
+                wait = max(deadline - time.time(), 0)
+            if not self._pump(wait) and deadline:
+                return None
+        if sync_stderr:
+            self.sync_stderr()
+        line, self._out = self._out.split('\n', 1)
+        return line + '\n'
+
+    def execute(self, statement, info=None):
+        """Send statement and return a SessionResult over its output."""
+        token = uuid.uuid4().hex
+        self.info_cb = info
+        self.failed = None
+        self.uses += 1
+        self.last_used = time.time()
+        self._send('%s;\n%s\n' % (statement.rstrip().rstrip(';'),
+                                  marker_statements(token)))
+        return SessionResult(self, token)
+
+    def ping(self, timeout=30):
+        """Round-trip a marker through hive; False if it did not come
+        back in time."""
+        token = uuid.uuid4().hex
+        try:
+            self._send(marker_statements(token) + '\n')
+        except OperationalError:
+            return False
+        expect = marker_line(token)
+        while True:
+            line = self.readline(timeout)
+            if not line:
+                self.dead = True
+                return False
+            if line.rstrip('\n') == expect:
+                self.last_used = time.time()
+                return True
+
+    def kill(self, grace=5):
+        """Stop hive now, whatever it is running."""
+        self.dead = True
+        terminate(self.process, grace)
+
+    def close(self):
+        self.dead = True
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        if self.process.poll() is None:
+            try:
+                self.process.terminate()
+            except OSError:
+                pass
+        self.process.wait()
+        self.process.stdout.close()
+        self.process.stderr.close()
+
+
+class SessionResult(object):
+
+    """File-like view of one statement's stdout.  readline() returns
+    '' at the marker, at which point the session goes back to its
+    pool.  Sessions ignore errors, so the rest of a script runs after
+    a statement failed; readline() raises ProgrammingError at the
+    marker if one did.  Only the marker ends a statement: if hive
+    dies before it, readline() raises OperationalError, with the
+    reason the query was cancelled if it was.  complete is set at the
+    marker of a statement that did not fail."""
+
+    def __init__(self, session, token, pool=None):
+        self.session = session
+        self.pool = pool
+        self._marker = marker_line(token)
+        self._pending = None
+        self.closed = False
+        self.complete = False
+        self.failed = None
+        # why the output ended before the marker, if it did
+        self.error = None
+        self.stats = None
+        self.on_release = None
+
+    def peek(self):
+        """Read ahead to the first line so errors on stderr are known
+        before any output is handed out."""
+        if self._pending is None:
+            self._pending = self._readline(sync_stderr=True)
+        return self._pending
+
+    def _readline(self, sync_stderr=False):
+        line = self.session.readline(sync_stderr=sync_stderr)
+        if line.rstrip('\n') == self._marker:
+            self._release()
+            self.complete = not self.failed
+            return ''
+        if not line.endswith('\n'):
+            # the session is gone; what it wrote so far is not all.
+            # error is set already if the query killed it
+            self.error = self.error or 'hive session died'
+            self._release()
+            raise OperationalError(self.error)
+        if self.stats is not None:
+            self.stats.mark('first_row')
+            self.stats.bytes_read += len(line)
+        return line
+
+    def failure(self):
+        """The FAILED line hive wrote for the statements run so far,
+        or None."""
+        if not self.closed:
+            self.session.sync_stderr()
+            self.failed = self.session.failed
+        return self.failed
+
+    def readline(self):
+        if self._pending is not None:
+            line, self._pending = self._pending, None
+            return line
+        if self.closed:
+            if self.error:
+                raise OperationalError(self.error)
+            return ''
+        line = self._readline()
+        if not line and self.failed:
+            raise ProgrammingError(self.failed)
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def _release(self):
+        if self.closed:
+            return
+        # before the session can run anyone else's statements
+        self.failure()
+        self.closed = True
+        self.session.info_cb = None
+        if self.pool is not None:
+            self.pool.checkin(self.session)
+        if self.on_release is not None:
+            self.on_release()
+
+    def close(self):
+        """Discard the rest of the output and release the session."""
+        self._pending = None
+        try:
+            while not self.closed:
+                self._readline()
+        except OperationalError:
+            pass
+
+
+class SessionPool(object):
+
+    """A bounded set of warm hive Sessions.
+
+    size
+        maximum number of hive processes kept open
+
+    recycle
+        a session is restarted after this many statements
+
+    ping_after
+        sessions idle for longer than this many seconds are pinged
+        before being handed out; dead ones are replaced
+    """
+
+    def __init__(self, command, size=2, recycle=500, ping_after=300):
+        self.command = command
+        self.size = size
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._idle = []
+        self._count = 0
+        self._lock = Condition()
+        self.closed = False
+
+    def warm(self):
+        """Start all sessions now so the first queries find them
+        booted."""
+        self._lock.acquire()
+        try:
+            while self._count < self.size:
+                self._idle.append(Session(self.command))
+                self._count += 1
+        finally:
+            self._lock.release()
+
+    def _healthy(self, session):
+        if not session.alive() or session.uses >= self.recycle:
+            return False
+        if time.time() - session.last_used > self.ping_after:
+            return session.ping()
+        return True
+
+    def _take(self, timeout):
+        """Pop an idle session, or return None once the pool has room
+        to start one (counted already).  Blocks while all sessions
+        are busy."""
+        deadline = timeout is not None and time.time() + timeout
+        self._lock.acquire()
+        try:
+            while True:
+                if self.closed:
+                    raise OperationalError('session pool is closed')
+                if self._idle:
+                    return self._idle.pop()
+                if self._count < self.size:
+                    self._count += 1
+                    return None
+                if deadline:
+                    left = deadline - time.time()
+                    if left <= 0:
+                        raise OperationalError(
+                            'no hive session available after %ss' % timeout)
+                    self._lock.wait(left)
+                else:
+                    self._lock.wait()
+        finally:
+            self._lock.release()
+
+    def checkout(self, timeout=None):
+        """Take a healthy session, starting one if the pool has room.
+        Blocks while all sessions are busy."""
+        while True:
+            session = self._take(timeout)
+            if session is None:
+                break
+            # pinged and closed outside the lock, so a slow session
+            # does not hold up checkin() and other checkouts
+            if self._healthy(session):
+                return session
+            logger.info('Recycling hive session pid=%s', session.process.pid)
+            session.close()
+            self._discard()
+        try:
+            return Session(self.command)
+        except:
+            self._discard()
+            raise
+
+    def _discard(self):
+        self._lock.acquire()
+        try:
+            self._count -= 1
+            self._lock.notify()
+        finally:
+            self._lock.release()
+
+    def checkin(self, session):
+        if self.closed or not session.alive() \
+                or session.uses >= self.recycle:
+            session.close()
+            self._discard()
+            return
+        self._lock.acquire()
+        try:
+            self._idle.append(session)
+            self._lock.notify()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self.closed = True
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+        for session in idle:
+            session.close()
+
+
+class SessionQuery(Query):
+
+    """Query that runs on a pooled Session instead of its own
+    `hive -e` process."""
+
+    def __init__(self, id, pool, statement, info=None, error=None,
+                 output=None):
+        Query.__init__(self, id, statement, info, error, output)
+        self.pool = pool
+        self.session = None
+        # the statement's output, from before it is handed out
+        self._output = None
+
+    def execute(self):
+        logger.info('Run pooled query id=%s', self.id)
+        self._check_cancelled()
+        self._start_timer()
+        # the slot is held until the last statement reports OK, as
+        # for Query
+        self._admit()
+        try:
+            session = self.pool.checkout()
+        except:
+            self._release_slot()
+            raise
+        self._lock.acquire()
+        try:
+            self.session = session
+            self.process = session.process
+        finally:
+            self._lock.release()
+        if self.cancelled:
+            self.pool.checkin(session)
+            self._release_slot()
+            self._check_cancelled()
+        stats = self.stats
+        if stats is not None:
+            stats.source = 'pool'
+            stats.mark('spawn')
+        def info(message):
+            if stats is not None:
+                stats.mark('first_stderr')
+            if 'Job = job_' in message:
+                self._note_job(message)
+            if self.progress is not None:
+                self._progress(message)
+            if message.strip() == 'OK':
+                self._ok_line()
+            if self.info_cb:
+                self.info_cb(self.id, message)
+        try:
+            result = session.execute(self.command, info=info)
+        except:
+            self.pool.checkin(session)
+            self._release_slot()
+            raise
+        self._lock.acquire()
+        try:
+            self._output = result
+        finally:
+            self._lock.release()
+        if self.cancelled:
+            self._kill()
+        result.pool = self.pool
+        result.stats = stats
+        result.on_release = self._stderr_done
+        result.peek()
+        if stats is not None:
+            stats.mark('job')
+        if result.closed:
+            self._stop_timer()
+        self._check_cancelled()
+        failed = result.failure()
+        if failed:
+            result.close()
+            if self.error_cb:
+                self.error_cb(self.id, failed)
+        self.result = result
+        self.output_cb(self.id, self.result)
+
+    def _running(self):
+        # the statement is over once its output has been read to the
+        # marker and the session released
+        if self.result is None:
+            return not self.ready
+        return not self.result.closed
+
+    def discard(self):
+        # killing the statement kills the session, so once output
+        # flows it is drained instead; only a running job is killed
+        if self.result is None:
+            self.cancel()
+        else:
+            self.result.close()
+
+    def _kill(self):
+        # the session is killed, not just the statement; the pool
+        # replaces it on checkin
+        self._stop_timer()
+        if self._output is not None and not self._output.closed:
+            # what the reader of the output sees instead of its end
+            self._output.error = 'query %s %s' % (self.id, self.cancelled)
+        if self.session is not None:
+            self.session.kill(self.grace)
+        jobs, self.jobs = self.jobs, []
+        if jobs and self.kill_command:
+            kill_jobs(self.kill_command, jobs)
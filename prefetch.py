@@ -0,0 +1,134 @@
+"""
+Hive db row prefetching
+This module reads and decodes the rows of a result set on a
+background thread while the caller works on the rows it already has.
+Rows are handed over in batches through a bounded buffer.  The batch
+size follows the caller: it aims at a batch for about `interval`
+seconds of the caller's time, so a fast consumer gets few large
+hand-offs and a slow one gets its first rows early.
+
+Used by streaming cursors with prefetch set.
+"""
+
+import sys
+import logging
+from Queue import Queue, Full
+from threading import Thread
+from time import time
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_END = object()
+
+
+class Prefetcher(object):
+
+    """Calls fetch() (a row, None at the end) on a thread until the
+    end of the rows, keeping up to batches batches ready.
+
+    batch
+        integer, rows in the first batch; later ones are sized
+        between min_batch and max_batch.
+
+    index
+        result set the rows belong to, for the caller's bookkeeping.
+    """
+
+    interval = 0.05
+    min_batch = 16
+    max_batch = 10000
+
+    def __init__(self, fetch, batch=100, batches=2, index=None):
+        self.fetch = fetch
+        self.batch = max(1, min(batch, self.max_batch))
+        self.index = index
+        self.stopped = False
+        self.done = False
+        self._queue = Queue(max(1, batches))
+        self._rows = []
+        self._pos = 0
+        self._received = None
+        self._thread = Thread(target=self._produce)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        while not self.stopped:
+            try:
+                self._queue.put(item, True, 0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _produce(self):
+        fetch = self.fetch
+        try:
+            while not self.stopped:
+                size = self.batch
+                rows = []
+                while len(rows) < size and not self.stopped:
+                    row = fetch()
+                    if row is None:
+                        break
+                    rows.append(row)
+                if rows and not self._put(rows):
+                    return
+                if len(rows) < size and not self.stopped:
+                    self._put(_END)
+                    return
+        except:
+            if self.stopped:
+                logger.info('Prefetch stopped: %s', sys.exc_info()[1])
+                return
+            self._put(sys.exc_info())
+
+    def _adapt(self, consumed, elapsed):
+        """Size later batches for interval seconds of the consumer."""
+        if elapsed <= 0:
+            batch = self.max_batch
+        else:
+            batch = int(consumed / elapsed * self.interval)
+        self.batch = max(self.min_batch, min(batch, self.max_batch))
+
+    def _next_batch(self):
+        if self.done:
+            return False
+        if self._received is not None:
+            self._adapt(len(self._rows), time() - self._received)
+        item = self._queue.get()
+        self._received = time()
+        if item is _END:
+            self.done = True
+            self._rows = []
+            return False
+        if isinstance(item, tuple):
+            self.done = True
+            self._rows = []
+            exc, value, tb = item
+            raise exc, value, tb
+        self._rows = item
+        self._pos = 0
+        return True
+
+    def take(self, size):
+        """Up to size rows, fewer only at the end."""
+        rows = []
+        while len(rows) < size:
+            if self._pos >= len(self._rows) and not self._next_batch():
+                break
+            end = self._pos + size - len(rows)
+            rows.extend(self._rows[self._pos:end])
+            self._pos = min(end, len(self._rows))
+        return rows
+
+    def stop(self):
+        """Stop producing; the thread ends with its current fetch."""
+        self.stopped = True
+        self.done = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    def join(self):
+        self._thread.join()
@@ -0,0 +1,299 @@
+"""
+Hive db query progress
+This module turns what hive prints on stderr into typed events: jobs
+and stages starting and ending, map and reduce percentages, CPU time
+and HDFS bytes per stage.  Events go to a callback as they happen;
+once hive is done the query's timeline can be written as a trace
+file for the Chrome trace viewer (chrome://tracing, or Perfetto).
+
+    def show(event):
+        if event.kind == 'progress':
+            print event.stage, event.map, event.reduce
+
+    connection = Connection(progress=show, trace_directory='/tmp/traces')
+
+Event kinds and the fields they set:
+
+    job_start       job
+    stage_start     stage, job, mappers, reducers
+    progress        stage, map, reduce, cpu_ms
+    counters        stage, cpu_ms, hdfs_read, hdfs_write, message
+                    (hive's end of query summary; message is the
+                    stage's status)
+    stage_end       stage, job, cpu_ms
+    job_end         job
+    failed          message
+    done            cpu_ms (total), message (failure, if any)
+"""
+
+import os
+import re
+import time
+import uuid
+import logging
+import simplejson as json
+from query import JOB_START_RE, JOB_END_RE
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+PROGRESS_RE = re.compile(r'(Stage-\d+) map = (\d+)%,\s*reduce = (\d+)%'
+                         r'(?:, Cumulative CPU ([\d.]+) sec)?')
+STAGE_INFO_RE = re.compile(r'Hadoop job information for (Stage-\d+): '
+                           r'number of mappers: (\d+); '
+                           r'number of reducers: (\d+)')
+COUNTERS_RE = re.compile(r'^(?:Job (\d+)|Stage-(Stage-\d+)):\s+Map: (\d+)'
+                         r'(?:\s+Reduce: (\d+))?'
+                         r'(?:\s+Cumulative CPU: ([\d.]+) sec)?'
+                         r'\s+HDFS Read: (\d+)\s+HDFS Write: (\d+)\s+(\w+)')
+TOTAL_CPU_RE = re.compile(r'Total MapReduce CPU Time Spent: (.*)')
+DURATION_RE = re.compile(r'(\d+) (day|hour|minute|second|msec)')
+
+_units = {'day': 86400000, 'hour': 3600000, 'minute': 60000,
+          'second': 1000, 'msec': 1}
+
+def _cpu_ms(seconds):
+    if seconds is None:
+        return None
+    return int(round(float(seconds) * 1000))
+
+def _duration_ms(text):
+    """Milliseconds of a duration like '1 minutes 2 seconds 30 msec'."""
+    return sum([int(value) * _units[unit]
+                for value, unit in DURATION_RE.findall(text)])
+
+
+class ProgressEvent(object):
+
+    """One thing hive reported about a query."""
+
+    __slots__ = ('kind', 'time', 'query', 'stage', 'job', 'map', 'reduce',
+                 'cpu_ms', 'hdfs_read', 'hdfs_write', 'mappers', 'reducers',
+                 'message')
+
+    def __init__(self, kind, query, **fields):
+        self.kind = kind
+        self.query = query
+        self.time = fields.pop('time', None) or time.time()
+        for name in self.__slots__[3:]:
+            setattr(self, name, fields.pop(name, None))
+        if fields:
+            raise TypeError('unknown event fields %s' % ', '.join(fields))
+
+    def as_dict(self):
+        return dict([(name, getattr(self, name)) for name in self.__slots__
+                     if getattr(self, name) is not None])
+
+    def __repr__(self):
+        return 'ProgressEvent(%s)' % ', '.join(
+            ['%s=%r' % item for item in sorted(self.as_dict().items())])
+
+
+class ProgressParser(object):
+
+    """Parses the stderr lines of one query.
+
+    query, statement
+        id and text of the query, for events and traces
+
+    callback
+        callable, default None.  called with every ProgressEvent, on
+        the thread reading hive's stderr.
+
+    trace_directory
+        string, default None.  where finish() writes the query's
+        Chrome trace, as hivedb-<time>-<query>-<random>.json.
+    """
+
+    def __init__(self, query, statement=None, callback=None,
+                 trace_directory=None):
+        self.query = query
+        self.statement = statement
+        self.callback = callback
+        self.trace_directory = trace_directory
+        self.trace_path = None
+        self.started = time.time()
+        self.finished = None
+        self.events = []
+        self.stages = []
+        self._stage_job = {}
+        self._job_stage = {}
+        self._pending_job = None
+        self._open = {}
+        self._cpu = {}
+
+    def _emit(self, kind, **fields):
+        event = ProgressEvent(kind, self.query, **fields)
+        self.events.append(event)
+        if self.callback is not None:
+            try:
+                self.callback(event)
+            except:
+                logger.exception('Query id=%s progress callback failed',
+                                 self.query)
+        return event
+
+    def _stage(self, stage, mappers=None, reducers=None):
+        """Start stage the first time it is seen."""
+        if stage in self.stages:
+            return
+        job = self._pending_job
+        self._pending_job = None
+        if job is not None:
+            self._stage_job[stage] = job
+            self._job_stage[job] = stage
+        self.stages.append(stage)
+        self._open[stage] = True
+        self._emit('stage_start', stage=stage, job=job, mappers=mappers,
+                   reducers=reducers)
+
+    def _end_stage(self, stage):
+        if self._open.pop(stage, None):
+            self._emit('stage_end', stage=stage,
+                       job=self._stage_job.get(stage),
+                       cpu_ms=self._cpu.get(stage))
+
+    def feed(self, line):
+        """Parse one line of stderr; returns the events it caused."""
+        count = len(self.events)
+        line = line.strip()
+        match = PROGRESS_RE.search(line)
+        if match:
+            stage, map, reduce, cpu = match.groups()
+            self._stage(stage)
+            if cpu is not None:
+                self._cpu[stage] = _cpu_ms(cpu)
+            self._emit('progress', stage=stage, map=int(map),
+                       reduce=int(reduce), cpu_ms=_cpu_ms(cpu))
+            return self.events[count:]
+        match = STAGE_INFO_RE.search(line)
+        if match:
+            stage, mappers, reducers = match.groups()
+            self._stage(stage, int(mappers), int(reducers))
+            return self.events[count:]
+        match = JOB_START_RE.search(line)
+        if match:
+            self._pending_job = match.group(1)
+            self._emit('job_start', job=match.group(1))
+            return self.events[count:]
+        match = JOB_END_RE.search(line)
+        if match:
+            job = match.group(1)
+            stage = self._job_stage.get(job)
+            if stage is not None:
+                self._end_stage(stage)
+            self._emit('job_end', job=job)
+            return self.events[count:]
+        match = COUNTERS_RE.search(line)
+        if match:
+            index, stage, map, reduce, cpu, read, write, status = \
+                match.groups()
+            if stage is None and int(index) < len(self.stages):
+                stage = self.stages[int(index)]
+            if cpu is not None and stage is not None:
+                self._cpu[stage] = _cpu_ms(cpu)
+            self._emit('counters', stage=stage, cpu_ms=_cpu_ms(cpu),
+                       hdfs_read=int(read), hdfs_write=int(write),
+                       message=status)
+            return self.events[count:]
+        match = TOTAL_CPU_RE.search(line)
+        if match:
+            self._cpu[None] = _duration_ms(match.group(1))
+            return self.events[count:]
+        if line.startswith('FAILED'):
+            self._emit('failed', message=line)
+        return self.events[count:]
+
+    def finish(self, failed=None):
+        """hive is done: end the stages still open and write the
+        trace, if a trace_directory is set."""
+        if self.finished is not None:
+            return
+        for stage in list(self.stages):
+            self._end_stage(stage)
+        cpu = self._cpu.get(None)
+        if cpu is None and self._cpu:
+            cpu = sum(self._cpu.values())
+        self._emit('done', cpu_ms=cpu, message=failed)
+        self.finished = time.time()
+        if self.trace_directory is not None:
+            path = os.path.join(self.trace_directory,
+                                'hivedb-%s-%s-%s.json' % (
+                                    time.strftime('%Y%m%d-%H%M%S'),
+                                    self.query, uuid.uuid4().hex[:8]))
+            try:
+                write_trace(path, [self])
+                self.trace_path = path
+                logger.info('Query id=%s trace written to %s', self.query,
+                            path)
+            except (IOError, OSError), e:
+                logger.warning('Query id=%s trace not written: %s',
+                               self.query, e)
+
+    def trace_events(self, pid=1, origin=None):
+        """The timeline as Chrome trace events.  One row for the
+        query, one per stage with its duration and counters, and a
+        counter track of each stage's map and reduce percentages."""
+        if origin is None:
+            origin = self.started
+        us = lambda t: int(round((t - origin) * 1000000))
+        end = self.finished or time.time()
+        name = 'query %s' % self.query
+        events = [
+            {'name': 'process_name', 'ph': 'M', 'pid': pid,
+             'args': {'name': name}},
+            {'name': name, 'cat': 'query', 'ph': 'X', 'pid': pid, 'tid': 0,
+             'ts': us(self.started), 'dur': us(end) - us(self.started),
+             'args': {'statement': self.statement}},
+        ]
+        starts = {}
+        info = {}
+        for event in self.events:
+            stage = event.stage
+            if event.kind == 'stage_start':
+                starts[stage] = event.time
+                info[stage] = {'job': event.job, 'mappers': event.mappers,
+                               'reducers': event.reducers}
+            elif event.kind == 'progress':
+                events.append({'name': '%s progress' % stage, 'ph': 'C',
+                               'pid': pid, 'ts': us(event.time),
+                               'args': {'map': event.map,
+                                        'reduce': event.reduce}})
+            elif event.kind == 'counters' and stage in info:
+                info[stage].update({'hdfs_read': event.hdfs_read,
+                                    'hdfs_write': event.hdfs_write,
+                                    'status': event.message})
+            elif event.kind == 'stage_end' and stage in starts:
+                info[stage]['cpu_ms'] = event.cpu_ms
+                tid = self.stages.index(stage) + 1
+                events.append({'name': 'thread_name', 'ph': 'M',
+                               'pid': pid, 'tid': tid,
+                               'args': {'name': stage}})
+                events.append({'name': stage, 'cat': 'stage', 'ph': 'X',
+                               'pid': pid, 'tid': tid,
+                               'ts': us(starts[stage]),
+                               'dur': us(event.time) - us(starts[stage]),
+                               'args': info[stage]})
+            elif event.kind == 'failed':
+                events.append({'name': 'failed', 'ph': 'i', 's': 'p',
+                               'pid': pid, 'tid': 0, 'ts': us(event.time),
+                               'args': {'message': event.message}})
+        return events
+
+def write_trace(target, parsers):
+    """Write the timelines of parsers (one process each, on a shared
+    clock) to target, a path or file object, as Chrome trace JSON."""
+    parsers = list(parsers)
+    origin = parsers and min([parser.started for parser in parsers]) or 0
+    events = []
+    for pid, parser in enumerate(parsers):
+        events.extend(parser.trace_events(pid + 1, origin))
+    trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+    if isinstance(target, basestring):
+        fileobj = open(target, 'w')
+        try:
+            json.dump(trace, fileobj)
+        finally:
+            fileobj.close()
+    else:
+        json.dump(trace, target)
@@ -6,39 +6,590 @@ Cursor objects handle this query object.
 @ TODO Im sure theres a better way to refactor this.
 """
 
+import os
+import re
+import sys
+import time
+import signal
 import logging
-from threading import Thread
+import subprocess
+from Queue import Queue, Full
+from threading import Thread, Event, Lock, Timer, current_thread
 from subprocess import PIPE, Popen
+from errors import OperationalError
+from scheduler import admission
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+KILL_COMMAND = ['hadoop', 'job', '-kill']
+JOB_START_RE = re.compile(r'Starting Job = (job_\w+)')
+JOB_END_RE = re.compile(r'Ended Job = (job_\w+)')
+# commands hive runs without writing OK
+QUIET_RE = re.compile(r'(set|add|list|delete|reset|dfs)\b', re.I)
+
+def terminate(process, grace=5):
+    """Stop process and the rest of its process group (hive runs
+    java under a wrapper script, sudo under write_access): SIGTERM,
+    then SIGKILL if still running after grace seconds."""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        if process.poll() is not None:
+            return
+        try:
+            os.killpg(process.pid, sig)
+        except OSError:
+            try:
+                os.kill(process.pid, sig)
+            except OSError:
+                pass
+        deadline = time.time() + grace
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+
+def note_job(jobs, message):
+    """Track in jobs the hadoop jobs a line of hive's stderr reports
+    starting and ending."""
+    match = JOB_START_RE.search(message)
+    if match:
+        jobs.append(match.group(1))
+        return
+    match = JOB_END_RE.search(message)
+    if match and match.group(1) in jobs:
+        jobs.remove(match.group(1))
+
+def kill_jobs(command, jobs):
+    """Run command + [job] for every hadoop job id in jobs."""
+    devnull = open(os.devnull, 'wb')
+    try:
+        for job in jobs:
+            logger.info('Killing hadoop job %s', job)
+            try:
+                subprocess.call(command + [job], stdout=devnull,
+                                stderr=devnull, close_fds=True)
+            except OSError, e:
+                logger.warning('Could not kill hadoop job %s: %s', job, e)
+    finally:
+        devnull.close()
+
+def split_statements(script):
+    """Split a script on the semicolons outside quotes."""
+    statements = []
+    current = []
+    quote = None
+    escaped = False
+    for char in script:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif quote:
+            if char == quote:
+                quote = None
+        elif char in '\'"`':
+            quote = char
+        elif char == ';':
+            statements.append(''.join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    statements.append(''.join(current).strip())
+    return [statement for statement in statements if statement]
+
+def ok_count(script):
+    """How many OK lines hive writes on stderr running script
+    successfully: one per statement but set, add jar and the other
+    commands it answers without one."""
+    return len([statement for statement in split_statements(script)
+                if not QUIET_RE.match(statement)])
+
+MARKER_KEY = 'hivedb.marker'
+
+def marker_statements(token):
+    """Statements that make hive echo token on stdout.  Used to find
+    where one statement's output ends in a shared stream."""
+    return 'set %s=%s;\nset %s;' % (MARKER_KEY, token, MARKER_KEY)
+
+def marker_line(token):
+    """The stdout line printed by marker_statements(token)."""
+    return '%s=%s' % (MARKER_KEY, token)
+
 class Query(Thread):
+
+    """Runs one hive command in a thread.  Completion is signalled
+    with an Event, so wait() sleeps instead of spinning.  Anything
+    raised while running (including by the callbacks) is kept in
+    exc_info for the waiting thread to re-raise.  Done callbacks run
+    before waiters are woken, so whatever they set up (a cursor's
+    description, say) is in place when wait() returns.
+
+    stdout and stderr are drained by separate threads, so neither
+    pipe can fill up and stall hive.  stdout goes through a bounded
+    read-ahead queue of readahead blocks (see PipeReader).
+    """
+
+    readahead = 16
+    blocksize = 64 * 1024
+    # seconds before cancel() escalates to SIGKILL
+    grace = 5
+
     def __init__(self, id, command, info=None, error=None, output=None):
-        threading.Thread.__init__(self)
+        Thread.__init__(self)
         self.id = id
         self.command = command
         self.info_cb, self.error_cb, self.output_cb = info, error, output
         logger.info('Init query id=%s command=%s', self.id, self.command)
         self.ready = False
         self.result = None
+        self.exc_info = None
+        self.process = None
+        self.failed = None
+        self.stats = None
+        self.timeout = None
+        self.kill_command = KILL_COMMAND
+        self.jobs = []
+        self.cancelled = None
+        # admission control: fair scheduler pool and priority the
+        # query waits for its slot with
+        self.user = None
+        self.priority = None
+        self.admission = admission
+        self._ticket = None
+        # OK lines the command writes; the slot is released at the
+        # last, when hive has no statement left to run
+        self.oks = 1
+        self._oks_seen = 0
+        # progress.ProgressParser fed hive's stderr, if any
+        self.progress = None
+        self._timer = None
+        # set when hive reports OK on stderr
+        self._ok = False
+        self._started = Event()
+        self._done = Event()
+        # the thread running the done callbacks
+        self._finisher = None
+        self._lock = Lock()
+        self._callbacks = []
 
     def run(self):
+        try:
+            self.execute()
+        except:
+            self.exc_info = sys.exc_info()
+            self._stop_timer()
+        self._finish()
+
+    def abandon(self, error):
+        """Finish without running; error is what waiters will see."""
+        self.exc_info = (type(error), error, None)
+        self._finish()
+
+    def _finish(self):
+        self._lock.acquire()
+        try:
+            self.ready = True
+            self._finisher = current_thread()
+            callbacks, self._callbacks = self._callbacks, []
+        finally:
+            self._lock.release()
+        for callback in callbacks:
+            try:
+                callback(self)
+            except:
+                logger.exception('Query id=%s done callback failed', self.id)
+        self._done.set()
+
+    def execute(self):
         logger.info('Run query id=%s command=%s', self.id, self.command)
-        process = Popen(self.command, stdout=PIPE, stderr=PIPE)
-        while process.poll() == None:
-            message = process.stderr.readline().replace('\n', '')
-            if message != '' and self.info_cb:
-                self.info_cb(self.id, message)
-            if 'OK' in message:
-                break
-            if 'FAILED' in message and self.error_cb:
-                self.error_cb(self.id, message)
-                break
-        self.result = process.stdout
+        self._check_cancelled()
+        self._start_timer()
+        self._admit()
+        # own process group, so cancel() reaches hive's children too
+        try:
+            process = Popen(self.command, stdout=PIPE, stderr=PIPE,
+                            close_fds=True, preexec_fn=os.setsid)
+        except:
+            self._release_slot()
+            raise
+        self._lock.acquire()
+        try:
+            self.process = process
+        finally:
+            self._lock.release()
+        if self.cancelled:
+            self._kill()
+        if self.stats is not None:
+            self.stats.mark('spawn')
+        self.result = PipeReader(process.stdout, self.readahead,
+                                 self.blocksize, self._started,
+                                 self._exit_status, self.stats)
+        self._stderr_thread = Thread(target=self._pump_stderr)
+        self._stderr_thread.daemon = True
+        self._stderr_thread.start()
+        # hand out the result as soon as hive has produced output or
+        # reported OK, whichever comes first.  hive writes OK before
+        # the rows, and only exits once they are read, so nothing may
+        # wait for it to exit before the result is handed out.
+        self._started.wait()
+        if not self._ok:
+            # FAILED, or stdout came first: its first block (or its
+            # end) tells whether there is output
+            self.result.first.wait()
+            if self.result.ended_empty():
+                self._stderr_thread.join()
+                process.wait()
+                self._check_cancelled()
+                if self.failed and self.error_cb:
+                    self.error_cb(self.id, self.failed)
         self.output_cb(self.id, self.result)
-        self.ready = True
 
-    def wait(self):
-        while not self.ready:
-            continue
+    def _admit(self):
+        """Wait for admission to start a hive process."""
+        if self.admission is None:
+            return
+        started = time.time()
+        self._ticket = self.admission.acquire(self.user, self.priority,
+                                              check=self._check_cancelled)
+        waited = time.time() - started
+        if waited >= 1:
+            logger.info('Query id=%s waited %.1fs for admission', self.id,
+                        waited)
+
+    def _release_slot(self):
+        self._lock.acquire()
+        try:
+            ticket, self._ticket = self._ticket, None
+        finally:
+            self._lock.release()
+        if ticket is not None:
+            self.admission.release(ticket)
+
+    def _progress(self, message):
+        try:
+            self.progress.feed(message)
+        except:
+            logger.exception('Query id=%s progress parsing failed',
+                             self.id)
+
+    def _ok_line(self):
+        """hive reported OK for a statement.  Reading the output of
+        the last one needs no slot, and the reader may be the thread
+        waiting for one."""
+        self._oks_seen += 1
+        if self._oks_seen >= self.oks:
+            self._release_slot()
+
+    def _stderr_done(self):
+        """hive is done with this query.  The slot is usually free
+        already, see _ok_line()."""
+        self._release_slot()
+        if self.progress is not None:
+            self.progress.finish(self.failed or self.cancelled)
+
+    def _check_cancelled(self):
+        if self.cancelled:
+            raise OperationalError('query %s %s' % (self.id, self.cancelled))
+
+    def _start_timer(self):
+        if self.timeout:
+            self._timer = Timer(self.timeout, self.cancel,
+                                ['timed out after %ss' % self.timeout])
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _stop_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def _note_job(self, message):
+        note_job(self.jobs, message)
+
+    def _running(self):
+        if self.process is None:
+            return not self.ready
+        return self.process.poll() is None
+
+    def _killable(self):
+        return self.process is not None
+
+    def cancel(self, reason='cancelled'):
+        """Stop the query: kill hive's process group and the hadoop
+        jobs it started.  A query that has not started yet will not
+        run.  Returns False if hive had already finished."""
+        self._lock.acquire()
+        try:
+            if self.cancelled:
+                return True
+            if not self._running():
+                return False
+            self.cancelled = reason
+            started = self._killable()
+        finally:
+            self._lock.release()
+        logger.info('Cancel query id=%s: %s', self.id, reason)
+        if started:
+            self._kill()
+        return True
+
+    def discard(self):
+        """Stop the query because nobody will read its result.  hive
+        is killed (see cancel()); transports whose results are cheap
+        to drain do that instead."""
+        self.cancel()
+
+    def _kill(self):
+        self._stop_timer()
+        terminate(self.process, self.grace)
+        jobs, self.jobs = self.jobs, []
+        if jobs and self.kill_command:
+            kill_jobs(self.kill_command, jobs)
+
+    def _pump_stderr(self):
+        stats = self.stats
+        for line in iter(self.process.stderr.readline, ''):
+            message = line.rstrip('\n')
+            if stats is not None:
+                stats.mark('first_stderr')
+            if 'Job = job_' in message:
+                self._note_job(message)
+            if self.progress is not None:
+                self._progress(message)
+            if message != '' and self.info_cb:
+                try:
+                    self.info_cb(self.id, message)
+                except:
+                    logger.exception('Query id=%s info handler failed',
+                                     self.id)
+            if message.startswith('FAILED'):
+                self.failed = message
+            elif message.strip() == 'OK':
+                self._ok = True
+                self._ok_line()
+            else:
+                continue
+            if stats is not None:
+                stats.mark('job')
+            self._started.set()
+        self.process.stderr.close()
+        # stderr closes when hive exits
+        self._stderr_done()
+
+    def _exit_status(self):
+        """Called by the result at end of output.  Raises if hive did
+        not exit cleanly."""
+        self._stderr_thread.join()
+        status = self.process.wait()
+        self._stop_timer()
+        self._check_cancelled()
+        if status != 0:
+            raise OperationalError('hive exited with status %s%s' % (
+                status, self.failed and ': %s' % self.failed or ''))
+
+    def add_done_callback(self, callback):
+        """Call callback(query) once the query has finished.  Runs
+        immediately if it already has."""
+        self._lock.acquire()
+        try:
+            if not self.ready:
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._lock.release()
+        callback(self)
+
+    def wait(self, timeout=None):
+        """Block until the query is done.  Returns False if timeout
+        (seconds) expired first."""
+        if self.ready and current_thread() is self._finisher:
+            # a done callback waiting for its own query
+            return True
+        return self._done.wait(timeout)
+
+    def raise_error(self):
+        """Re-raise whatever stopped the query, if anything."""
+        if self.exc_info:
+            exc, value, tb = self.exc_info
+            raise exc, value, tb
+
+
+class QueryFuture(object):
+
+    """Handle on a Query running in the background, in the spirit of
+    concurrent.futures.Future.
+
+    value is what result() returns once the query succeeded.  If
+    given, errorhandler(exc, value) is called before an error is
+    raised from result().
+    """
+
+    def __init__(self, query, value=None, errorhandler=None):
+        self.query = query
+        self._value = value
+        self._errorhandler = errorhandler
+
+    def done(self):
+        return self.query.ready
+
+    def running(self):
+        return not self.query.ready
+
+    def cancel(self):
+        """Kill the query and its hadoop jobs; False if hive had
+        already finished."""
+        return self.query.cancel()
+
+    def cancelled(self):
+        return bool(self.query.cancelled)
+
+    def add_done_callback(self, fn):
+        """Call fn(future) from the query thread once it is done."""
+        self.query.add_done_callback(lambda query: fn(self))
+
+    def _wait(self, timeout):
+        if not self.query.wait(timeout):
+            raise OperationalError('query %s not done after %ss'
+                                   % (self.query.id, timeout))
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        if self.query.exc_info:
+            return self.query.exc_info[1]
+
+    def result(self, timeout=None):
+        self._wait(timeout)
+        if self.query.exc_info and self._errorhandler:
+            exc, value, tb = self.query.exc_info
+            del tb
+            self._errorhandler(exc, value)
+        self.query.raise_error()
+        return self._value
+
+
+class PipeReader(object):
+
+    """File-like reader over a pipe that a background thread drains
+    into a bounded queue of blocks.  When the queue is full the
+    thread stops reading, which in turn blocks the writer; that is
+    the only backpressure hive sees.
+
+    started (shared with whoever else may start the reader's
+    consumer) and first are set once the first block (or end of
+    stream) arrives.  on_eof() is called once at end of stream and
+    may raise.  complete is set once the end of stream was read and
+    on_eof() did not raise.  stats, an instrument.QueryStats, counts
+    bytes and the first block.
+    """
+
+    def __init__(self, stream, maxsize=16, blocksize=64 * 1024,
+                 started=None, on_eof=None, stats=None):
+        self.stream = stream
+        self.stats = stats
+        self.blocksize = blocksize
+        self.started = started or Event()
+        self.first = Event()
+        self.on_eof = on_eof
+        self.closed = False
+        self.complete = False
+        self._queue = Queue(maxsize)
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._received = False
+        self._ended = False
+        self._thread = Thread(target=self._pump)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _pump(self):
+        fd = self.stream.fileno()
+        try:
+            while not self.closed:
+                try:
+                    data = os.read(fd, self.blocksize)
+                except OSError, e:
+                    data = ''
+                    logger.info('Pipe read failed: %s', e)
+                if data:
+                    self._received = True
+                    if self.stats is not None:
+                        self.stats.mark('first_row')
+                        self.stats.bytes_read += len(data)
+                self.first.set()
+                self.started.set()
+                while not self.closed:
+                    try:
+                        self._queue.put(data, timeout=0.5)
+                        break
+                    except Full:
+                        pass
+                if not data:
+                    break
+        finally:
+            self._ended = True
+            self.first.set()
+            self.started.set()
+            self.stream.close()
+
+    def empty(self):
+        """True if nothing has arrived (yet)."""
+        return not self._received
+
+    def ended_empty(self):
+        """True if the stream ended without producing anything."""
+        return self._ended and not self._received
+
+    def _next_block(self):
+        """Block until the next chunk arrives; '' at end of stream."""
+        if self._eof:
+            return ''
+        block = self._queue.get()
+        if not block:
+            self._eof = True
+            if self.on_eof is not None:
+                on_eof, self.on_eof = self.on_eof, None
+                on_eof()
+            self.complete = True
+        return block
+
+    def readline(self):
+        while True:
+            end = self._buffer.find('\n', self._pos)
+            if end >= 0:
+                line = self._buffer[self._pos:end + 1]
+                self._pos = end + 1
+                return line
+            block = self._next_block()
+            if not block:
+                line = self._buffer[self._pos:]
+                self._buffer, self._pos = '', 0
+                return line
+            self._buffer = self._buffer[self._pos:] + block
+            self._pos = 0
+
+    def read(self, size=-1):
+        """Read up to size bytes, or everything if size < 0.  With a
+        positive size, returns at most one block's worth so callers
+        can stream without buffering the whole result."""
+        if self._pos < len(self._buffer):
+            data = self._buffer[self._pos:]
+        else:
+            data = self._next_block()
+        self._buffer, self._pos = '', 0
+        if size < 0:
+            chunks = [data]
+            while data:
+                data = self._next_block()
+                chunks.append(data)
+            return ''.join(chunks)
+        if len(data) > size:
+            self._buffer, data = data[size:], data[:size]
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        """Stop reading; the pump thread closes the pipe."""
+        self.closed = True
+        self._eof = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
@@ -0,0 +1,122 @@
+"""
+Hive db records
+This module provides the rows of dictionary cursors: tuples that
+also behave as read-only mappings from column name to value.  One
+record class is made per set of column names and shared by every row
+of a result set, so a row costs about as much memory as a tuple.
+
+    row['t.name'], row.get('t.name'), row.keys(), row.items()
+    row.name          columns also by attribute, without the table
+                      prefix when that is unambiguous
+    row[0]            and by position
+
+Records can not be changed; dict(row) gives a dictionary copy.
+"""
+
+from threading import Lock
+
+_classes = {}
+_lock = Lock()
+
+def _index(names):
+    index = {}
+    short = {}
+    for position, name in enumerate(names):
+        index[name] = position
+        if '.' in name:
+            short.setdefault(name.rsplit('.', 1)[1], []).append(position)
+    for name, positions in short.items():
+        if len(positions) == 1 and not index.has_key(name):
+            index[name] = positions[0]
+    return index
+
+def record_class(names):
+    """The record class for rows with these column names."""
+    names = tuple(names)
+    cls = _classes.get(names)
+    if cls is None:
+        _lock.acquire()
+        try:
+            cls = _classes.get(names)
+            if cls is None:
+                cls = _classes[names] = type('Record', (Record,), {
+                    '__slots__': (), '_fields': names,
+                    '_index': _index(names)})
+        finally:
+            _lock.release()
+    return cls
+
+def _make(names, values):
+    return record_class(names)(values)
+
+
+class Record(tuple):
+
+    """Base of the generated record classes.  _fields holds the
+    column names, _index maps names to positions."""
+
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, long, slice)):
+            return tuple.__getitem__(self, key)
+        return tuple.__getitem__(self, self._index[key])
+
+    def __getattr__(self, name):
+        try:
+            return tuple.__getitem__(self, self._index[name])
+        except KeyError:
+            raise AttributeError(name)
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __contains__(self, key):
+        return self._index.has_key(key)
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        position = self._index.get(key)
+        if position is None:
+            return default
+        return tuple.__getitem__(self, position)
+
+    def keys(self):
+        return list(self._fields)
+
+    def values(self):
+        return list(tuple.__iter__(self))
+
+    def items(self):
+        return zip(self._fields, tuple.__iter__(self))
+
+    def iterkeys(self):
+        return iter(self._fields)
+
+    def itervalues(self):
+        return tuple.__iter__(self)
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def _asdict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            return self._asdict() == other
+        return tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = tuple.__hash__
+
+    def __repr__(self):
+        return '{%s}' % ', '.join(['%r: %r' % item for item in self.items()])
+
+    def __reduce__(self):
+        return _make, (self._fields, tuple(tuple.__iter__(self)))
@@ -0,0 +1,342 @@
+"""
+Hive db scheduler
+This module limits how many hive processes run at once.
+
+QueryScheduler
+    runs a batch of queries (executemany, execute_partitioned) on a
+    fixed number of worker threads
+
+AdmissionControl
+    process-wide limits on the hive processes of every connection
+    and cursor, shared through the module's `admission` instance.
+    Queries wait for a slot in priority order and queries beyond the
+    queue limits are rejected at once.  A query holds its slot while
+    hive starts and runs its statements, until the last of them
+    reports OK; reading that statement's output does not count,
+    since the reader may be the very thread waiting for the next
+    slot.  The output of earlier statements of a script has to be
+    read for the later ones to run, so a thread must not wait for a
+    slot while it has such output unread.  AsyncConnection's hive
+    processes are not admitted: its event loop cannot block waiting
+    for a slot.  Off until configured:
+
+    scheduler.admission.configure(max_running=8, max_per_user=4,
+                                  max_queued=50)
+"""
+
+import logging
+from time import time
+from itertools import count
+from threading import Thread, Lock, Condition
+from store import StoredResult
+from errors import OperationalError
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+class QueryScheduler(object):
+
+    """Runs Query objects on at most concurrency worker threads, in
+    the order they were given.
+
+    fail_fast
+        bool, default true.  Once a query fails, queries that have
+        not started yet are abandoned with OperationalError instead
+        of being run.  Queries already running finish normally.
+
+    spool
+        bool, default false.  A Query hands out its output as soon as
+        hive starts writing it, long before hive exits.  With spool
+        each query's output is read into a store.StoredResult before
+        its worker moves on, so at most concurrency hive processes
+        are alive at once.  Otherwise the worker is free again once
+        the output is handed out (and the caller is expected to read
+        it, as execute_partitioned() does), which leaves hive running
+        for results nobody reads yet.
+    """
+
+    # bytes of a spooled result kept in memory before it spills to disk
+    spool_max_bytes = 8 * 1024 * 1024
+
+    def __init__(self, concurrency=4, fail_fast=True, spool=False):
+        self.concurrency = max(1, int(concurrency))
+        self.fail_fast = fail_fast
+        self.spool = spool
+        self.failed = None
+        self._pending = []
+        self._lock = Lock()
+
+    def _next(self):
+        self._lock.acquire()
+        try:
+            if self._pending:
+                return self._pending.pop(0)
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        while True:
+            query = self._next()
+            if query is None:
+                return
+            if self.fail_fast and self.failed is not None:
+                query.abandon(OperationalError(
+                    'query %s not run: query %s failed'
+                    % (query.id, self.failed.id)))
+                continue
+            if self.spool:
+                self._spool(query)
+            query.run()
+            if query.exc_info and self.failed is None:
+                logger.info('Query id=%s failed', query.id)
+                self.failed = query
+
+    def _spool(self, query):
+        output = query.output_cb
+        max_bytes = self.spool_max_bytes
+        def spooled(id, stream):
+            # typed results (HiveServer2) hold no hive process
+            if getattr(stream, 'description', None) is None:
+                stream = StoredResult(stream, max_bytes)
+            output(id, stream)
+        query.output_cb = spooled
+
+    def run(self, queries):
+        """Run queries and block until every one of them is done."""
+        self._pending.extend(queries)
+        workers = []
+        for i in range(min(self.concurrency, len(self._pending))):
+            worker = Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        return queries
+
+# query priorities, most urgent first
+INTERACTIVE = 0
+BATCH = 1
+PRIORITIES = {'interactive': INTERACTIVE, 'batch': BATCH}
+
+def priority_value(priority):
+    if priority is None:
+        return INTERACTIVE
+    if isinstance(priority, basestring):
+        try:
+            return PRIORITIES[priority.lower()]
+        except KeyError:
+            raise ValueError('unknown priority %r' % priority)
+    return priority
+
+
+class Ticket(object):
+
+    """A query's place in the admission queue, then its slot."""
+
+    __slots__ = ('user', 'priority', 'seq', 'queued', 'admitted')
+
+    def __init__(self, user, priority, seq):
+        self.user = user
+        self.priority = priority
+        self.seq = seq
+        self.queued = time()
+        self.admitted = None
+
+
+class AdmissionControl(object):
+
+    """Admits hive processes of the whole Python process.
+
+    max_running
+        integer, default None (no limit).  hive processes running a
+        query (whose last statement has not reported OK) at once.
+
+    max_per_user
+        integer, default None (no limit).  the same for one user,
+        i.e. one fair scheduler pool.
+
+    max_queued
+        integer, default None (no limit).  queries waiting for a
+        slot; further ones fail at once with OperationalError.
+
+    max_queued_per_user
+        integer, default None (no limit).  the same for one user.
+
+    wait_timeout
+        seconds, default 3600.  queries waiting longer fail with
+        OperationalError.  None waits as long as it takes.
+
+    Free slots go to waiting queries by priority (INTERACTIVE before
+    BATCH), then to the user with the fewest running queries and
+    then the one served longest ago, then in arrival order.
+    """
+
+    def __init__(self, max_running=None, max_per_user=None, max_queued=None,
+                 max_queued_per_user=None, wait_timeout=3600):
+        self._cond = Condition(Lock())
+        self._seq = count()
+        self._waiting = []
+        self._running = {}
+        self._queued = {}
+        self._grants = count()
+        self._served = {}
+        self.configure(max_running, max_per_user, max_queued,
+                       max_queued_per_user, wait_timeout)
+        self.reset_stats()
+
+    def configure(self, max_running=None, max_per_user=None, max_queued=None,
+                  max_queued_per_user=None, wait_timeout=3600):
+        """Set the limits; queries already running keep their slots."""
+        self._cond.acquire()
+        try:
+            self.max_running = max_running
+            self.max_per_user = max_per_user
+            self.max_queued = max_queued
+            self.max_queued_per_user = max_queued_per_user
+            self.wait_timeout = wait_timeout
+            self._dispatch()
+        finally:
+            self._cond.release()
+
+    def reset_stats(self):
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _eligible(self, ticket):
+        if self.max_per_user is None:
+            return True
+        return self._running.get(ticket.user, 0) < self.max_per_user
+
+    def _dispatch(self):
+        # called with the lock held
+        granted = False
+        while self._waiting:
+            if self.max_running is not None and \
+                    sum(self._running.values()) >= self.max_running:
+                break
+            candidates = [ticket for ticket in self._waiting
+                          if self._eligible(ticket)]
+            if not candidates:
+                break
+            ticket = min(candidates, key=lambda ticket: (
+                ticket.priority, self._running.get(ticket.user, 0),
+                self._served.get(ticket.user, -1), ticket.seq))
+            self._served[ticket.user] = self._grants.next()
+            self._waiting.remove(ticket)
+            self._count(self._queued, ticket.user, -1)
+            self._count(self._running, ticket.user, 1)
+            ticket.admitted = time()
+            wait = ticket.admitted - ticket.queued
+            self.admitted += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            granted = True
+        if granted:
+            self._cond.notifyAll()
+
+    def _count(self, counts, user, change):
+        counts[user] = counts.get(user, 0) + change
+        if not counts[user]:
+            del counts[user]
+
+    def _reject(self, message):
+        self.rejected += 1
+        logger.info('Query rejected: %s', message)
+        raise OperationalError(message)
+
+    def acquire(self, user=None, priority=INTERACTIVE, timeout=None,
+                check=None):
+        """Block until a slot is free and return its ticket.  check(),
+        if given, is called while waiting and may raise to give up,
+        e.g. when the query is cancelled."""
+        priority = priority_value(priority)
+        if timeout is None:
+            timeout = self.wait_timeout
+        self._cond.acquire()
+        try:
+            ticket = Ticket(user, priority, self._seq.next())
+            self._waiting.append(ticket)
+            self._count(self._queued, user, 1)
+            self._dispatch()
+            if ticket.admitted is not None:
+                return ticket
+            if self.max_queued is not None and \
+                    len(self._waiting) > self.max_queued:
+                self._withdraw(ticket)
+                self._reject('admission queue full: %d queries waiting'
+                             % self.max_queued)
+            if self.max_queued_per_user is not None and \
+                    self._queued.get(user, 0) > self.max_queued_per_user:
+                self._withdraw(ticket)
+                self._reject('admission queue full for %s: %d queries '
+                             'waiting' % (user, self.max_queued_per_user))
+            deadline = timeout is not None and ticket.queued + timeout
+            while ticket.admitted is None:
+                wait = 0.5
+                if deadline:
+                    wait = min(wait, deadline - time())
+                    if wait <= 0:
+                        self._withdraw(ticket)
+                        self.timed_out += 1
+                        raise OperationalError('no hive slot free after %ss'
+                                               % timeout)
+                self._cond.wait(wait)
+                if ticket.admitted is None and check is not None:
+                    try:
+                        check()
+                    except:
+                        self._withdraw(ticket)
+                        raise
+            return ticket
+        finally:
+            self._cond.release()
+
+    def _withdraw(self, ticket):
+        self._waiting.remove(ticket)
+        self._count(self._queued, ticket.user, -1)
+        # a waiter held back by this one's priority may go now
+        self._dispatch()
+
+    def release(self, ticket):
+        """Free ticket's slot.  Safe to call more than once."""
+        self._cond.acquire()
+        try:
+            if ticket.admitted is None:
+                return
+            ticket.admitted = None
+            self._count(self._running, ticket.user, -1)
+            self._dispatch()
+        finally:
+            self._cond.release()
+
+    def stats(self):
+        """Counts for monitoring."""
+        self._cond.acquire()
+        try:
+            waiting = self._waiting
+            now = time()
+            return {
+                'running': sum(self._running.values()),
+                'queued': len(waiting),
+                'running_per_user': dict(self._running),
+                'queued_per_user': dict(self._queued),
+                'queued_interactive': len([ticket for ticket in waiting
+                                           if ticket.priority == INTERACTIVE]),
+                'oldest_wait': waiting and max([now - ticket.queued
+                                                for ticket in waiting]) or 0.0,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'wait_avg': self.admitted and
+                            self.wait_total / self.admitted or 0.0,
+                'wait_max': self.wait_max,
+            }
+        finally:
+            self._cond.release()
+
+# shared by every connection
+admission = AdmissionControl()
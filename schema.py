@@ -0,0 +1,325 @@
+"""
+Hive db schemas
+This module resolves the real hive types of result columns instead
+of guessing them from the first row.  Table schemas are read with
+DESCRIBE and kept in a per-connection SchemaCache with a TTL.
+
+Columns are traced through the select list of the query.  Only a
+bare column reference (`col`, `alias.col`, aliased or not) takes its
+table column's type; expressions, aggregates and anything else are
+left to cursors.infer_type.
+"""
+
+import re
+import sys
+import time
+import logging
+from threading import Lock
+from errors import Error
+from decoders import has_converter
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+INT_TYPES = frozenset(['tinyint', 'smallint', 'int', 'integer', 'bigint'])
+FLOAT_TYPES = frozenset(['float', 'double', 'decimal', 'numeric'])
+JSON_TYPES = frozenset(['array', 'map', 'struct', 'uniontype'])
+
+TABLE_RE = re.compile(r'\b(?:from|join)\s+([\w.]+)(?:\s+(?:as\s+)?(\w+))?',
+                      re.I)
+DDL_RE = re.compile(r'^\s*(?:alter|drop|create|truncate)\s+table\s+'
+                    r'(?:if\s+(?:not\s+)?exists\s+)?([\w.]+)', re.I)
+SELECT_RE = re.compile(r'\bselect\b', re.I)
+FROM_RE = re.compile(r'\bfrom\b', re.I)
+DISTINCT_RE = re.compile(r'^(?:distinct|all)\s+', re.I)
+COLUMN_RE = re.compile(r'^(?:([\w.]+)\.)?(\w+)$')
+STAR_RE = re.compile(r'^(?:([\w.]+)\.)?\*$')
+AS_RE = re.compile(r'^(.*?)\s+as\s+(\w+)$', re.I | re.S)
+IMPLICIT_ALIAS_RE = re.compile(r'^(.*\S)\s+(\w+)$', re.S)
+NOT_ALIAS = frozenset(['where', 'join', 'left', 'right', 'full', 'inner',
+                       'outer', 'cross', 'on', 'group', 'order', 'sort',
+                       'cluster', 'distribute', 'limit', 'union',
+                       'lateral', 'having', 'semi', 'tablesample'])
+
+def hive_type(type):
+    """Map a hive column type to the type names used by cursors.
+    Types with a registered converter are kept as they are."""
+    base = re.split(r'[(<]', type.strip().lower(), 1)[0].strip()
+    if has_converter(base):
+        return base
+    if base in INT_TYPES:
+        return 'int'
+    if base in FLOAT_TYPES:
+        return 'float'
+    if base in JSON_TYPES:
+        return 'json'
+    return 'str'
+
+def parse_describe(lines):
+    """Parse DESCRIBE output into a {column: hive type} dict."""
+    schema = {}
+    for line in lines:
+        fields = line.rstrip('\n').split('\t')
+        name = fields[0].strip()
+        if not name or name.startswith('#') or len(fields) < 2:
+            continue
+        if name == 'col_name' and fields[1].strip() == 'data_type':
+            continue
+        schema.setdefault(name.lower(), fields[1].strip())
+    return schema
+
+def tables(query):
+    """Return [(table, alias)] for the tables a query reads from."""
+    found = []
+    for table, alias in TABLE_RE.findall(query):
+        if alias.lower() in NOT_ALIAS:
+            alias = ''
+        found.append((table.lower(), (alias or table).lower()))
+    return found
+
+def normalize(query):
+    return ' '.join(query.split()).lower()
+
+def _flatten(query):
+    """query with quoted text and everything in parentheses blanked
+    out, so keywords and commas left in it are at the top level."""
+    chars = []
+    depth = 0
+    quote = None
+    escaped = False
+    for char in query:
+        blank = depth > 0 or quote is not None
+        if escaped:
+            escaped = False
+        elif quote:
+            if char == '\\':
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in '\'"`':
+            quote = char
+            blank = True
+        elif char == '(':
+            depth += 1
+            blank = True
+        elif char == ')':
+            depth = max(depth - 1, 0)
+            blank = True
+        chars.append(blank and ' ' or char)
+    return ''.join(chars)
+
+def select_items(query):
+    """The items of the outermost select list, or None if there is
+    none."""
+    flat = _flatten(query)
+    select = SELECT_RE.search(flat)
+    if select is None:
+        return None
+    start = select.end()
+    end = FROM_RE.search(flat, start)
+    stop = end and end.start() or len(flat)
+    items = []
+    for index in range(start, stop + 1):
+        if index == stop or flat[index] == ',':
+            items.append(query[start:index].strip())
+            start = index + 1
+    items[0] = DISTINCT_RE.sub('', items[0])
+    return items
+
+def _reference(expression):
+    """(table or alias, column) for a bare column reference, the
+    table part '' when there is none; None for anything else."""
+    match = COLUMN_RE.match(expression.replace('`', '').strip())
+    if match is None:
+        return None
+    return ((match.group(1) or '').lower(), match.group(2).lower())
+
+def select_column(item):
+    """(output name, source) of one select item.  source is a
+    _reference() for a bare column, ('*', table or '') for a star and
+    None for an expression; the name is None where hive makes one
+    up (_c0, ...)."""
+    star = STAR_RE.match(item.replace('`', ''))
+    if star:
+        return None, ('*', (star.group(1) or '').lower())
+    reference = _reference(item)
+    if reference is not None:
+        return reference[1], reference
+    match = AS_RE.match(item)
+    if match is None:
+        # an alias without AS: after a column or a call, e.g.
+        # `name id` or `count(*) n`, but not `a + b` or `case ... end`
+        match = IMPLICIT_ALIAS_RE.match(item)
+        if match and _reference(match.group(1)) is None and \
+                not match.group(1).endswith(')'):
+            match = None
+    if match is None:
+        return None, None
+    expression, name = match.groups()
+    return name.lower(), _reference(expression)
+
+
+class SchemaCache(object):
+
+    """Thread-safe mapping with per-entry expiry.
+
+    ttl
+        seconds an entry is valid for; None keeps entries until
+        they are invalidated
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                return None
+            return value
+        finally:
+            self._lock.release()
+
+    def put(self, key, value, ttl=None):
+        ttl = ttl or self.ttl
+        expires = ttl is not None and time.time() + ttl or None
+        self._lock.acquire()
+        try:
+            self._entries[key] = (expires, value)
+        finally:
+            self._lock.release()
+
+    def invalidate(self, table=None):
+        """Forget a table and every query result that used it, or
+        everything if table is None."""
+        self._lock.acquire()
+        try:
+            if table is None:
+                self._entries.clear()
+                return
+            table = table.lower()
+            for key, (expires, value) in self._entries.items():
+                if key == ('table', table) or \
+                        (key[0] == 'query' and table in value[1]):
+                    del self._entries[key]
+        finally:
+            self._lock.release()
+
+    clear = invalidate
+
+
+class SchemaResolver(object):
+
+    """Finds hive types for result columns of a connection's queries.
+
+    prepare() is called before a query runs, so DESCRIBE never has
+    to wait for a hive session held by the query itself.  resolve()
+    then maps the result header through the select list onto the
+    cached table schemas.
+    """
+
+    def __init__(self, connection, cache):
+        self.connection = connection
+        self.cache = cache
+
+    def describe(self, table):
+        schema = self.cache.get(('table', table))
+        if schema is not None:
+            return schema
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute('DESCRIBE %s' % table)
+            lines = cursor._fetch_raw(sys.maxint)
+            if cursor.description:
+                header = '\t'.join([c[0] for c in cursor.description])
+                lines.insert(0, header)
+            schema = parse_describe(lines)
+        except Error, e:
+            logger.info('DESCRIBE %s failed: %s', table, e)
+            schema = {}
+        finally:
+            cursor.close()
+        self.cache.put(('table', table), schema)
+        return schema
+
+    def prepare(self, query):
+        """Load schemas of the tables query reads from; drop cached
+        schemas of a table the query alters."""
+        ddl = DDL_RE.match(query)
+        if ddl:
+            self.cache.invalidate(ddl.group(1))
+            return
+        for table, alias in tables(query):
+            self.describe(table)
+
+    def resolve(self, query, columns):
+        """Return a hive type per column name, None where unknown."""
+        sources = tables(query)
+        if not sources:
+            return [None] * len(columns)
+        key = ('query', normalize(query), tuple(columns))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached[0]
+        schemas = {}
+        for table, alias in sources:
+            schema = self.cache.get(('table', table)) or {}
+            schemas[alias] = schemas[table] = schema
+        types = [self._type(schemas, source)
+                 for source in self._sources(query, columns)]
+        used = frozenset([table for table, alias in sources])
+        self.cache.put(key, (types, used))
+        return types
+
+    def _sources(self, query, columns):
+        """The select list source (see select_column()) of each result
+        column, None where it is not a bare column."""
+        items = select_items(query)
+        if items is None:
+            return [None] * len(columns)
+        selected = [select_column(item) for item in items]
+        stars = [source for name, source in selected
+                 if source and source[0] == '*']
+        if not stars and len(selected) == len(columns):
+            # one column per item, in order
+            return [source for name, source in selected]
+        sources = []
+        for column in columns:
+            column = column.lower()
+            prefix = ''
+            name = column
+            if '.' in column:
+                prefix, name = column.rsplit('.', 1)
+            matches = [source for item_name, source in selected
+                       if item_name == name]
+            if prefix and [star for star in stars if star[1] in ('', prefix)]:
+                # hive names the columns of a star table.column
+                sources.append((prefix, name))
+            elif len(matches) == 1:
+                sources.append(matches[0])
+            elif not matches and stars:
+                sources.append((prefix, name))
+            else:
+                sources.append(None)
+        return sources
+
+    def _type(self, schemas, source):
+        if source is None:
+            return None
+        prefix, name = source
+        if prefix:
+            found = schemas.get(prefix, {}).get(name)
+        else:
+            found = None
+            matches = [schema[name] for schema in schemas.values()
+                       if schema.has_key(name)]
+            if matches and matches.count(matches[0]) == len(matches):
+                found = matches[0]
+        return found and hive_type(found)
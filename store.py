@@ -0,0 +1,129 @@
+"""
+Hive db result store
+This module keeps a copy of a result set for the store cursors.
+Rows stay in memory until a byte budget is used up, after which
+everything is spilled to a temporary file that is read back through
+mmap.  Either way rows are found through an offset index, so any row
+can be reached in O(1).
+"""
+
+import mmap
+import tempfile
+from array import array
+
+class ResultStore(object):
+
+    """Append-only sequence of raw result lines.
+
+    max_bytes
+        integer, bytes kept in memory before spilling to disk
+
+    directory
+        where the spill file is created, default tempfile's choice
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._rows = []
+        self._size = 0
+        self._file = None
+        self._map = None
+        self._offsets = None
+
+    def __len__(self):
+        if self._offsets is not None:
+            return len(self._offsets) - 1
+        return len(self._rows)
+
+    def append(self, line):
+        if line.endswith('\n'):
+            line = line[:-1]
+        if self._offsets is not None:
+            self._file.write(line + '\n')
+            self._size += len(line) + 1
+            self._offsets.append(self._size)
+            return
+        self._rows.append(line)
+        self._size += len(line) + 1
+        if self._size > self.max_bytes:
+            self._spill()
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+    def _spill(self):
+        self._file = tempfile.TemporaryFile(prefix='hivedb-',
+                                            dir=self.directory)
+        self._offsets = array('L', [0])
+        size = 0
+        for line in self._rows:
+            self._file.write(line + '\n')
+            size += len(line) + 1
+            self._offsets.append(size)
+        self._rows = None
+
+    def finish(self):
+        """Done appending; spilled rows become readable."""
+        if self._file is not None and self._map is None:
+            self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+    def __getitem__(self, index):
+        if self._map is None:
+            return self._rows[index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._map[self._offsets[index]:self._offsets[index + 1] - 1]
+
+    def slice(self, start, stop):
+        if self._map is None:
+            return self._rows[start:stop]
+        stop = min(stop, len(self))
+        return [self[i] for i in xrange(start, stop)]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._rows = []
+        self._offsets = None
+
+
+class StoredResult(object):
+
+    """File-like copy of a result stream.  The stream is read to its
+    end up front, so whatever produced it (a hive process, a pooled
+    session) is done with before any row is handed out.  complete is
+    the stream's, once read (see cache.TeeReader)."""
+
+    def __init__(self, stream, max_bytes=64 * 1024 * 1024, directory=None):
+        self.store = ResultStore(max_bytes, directory)
+        try:
+            self.store.extend(iter(stream.readline, ''))
+        except:
+            self.store.close()
+            raise
+        self.store.finish()
+        self.complete = getattr(stream, 'complete', False)
+        self._next = 0
+
+    def readline(self):
+        if self._next >= len(self.store):
+            return ''
+        line = self.store[self._next]
+        self._next += 1
+        return line + '\n'
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,70 @@
+"""hivedb tests
+
+Run from the top of the source tree, with python 2:
+
+    python -m unittest discover -s tests -t .
+
+The CLI tests run hive as benchmarks/bin/hive, the stand-in for the
+HIVE CLI the benchmarks use, which is put first on PATH here.  It
+runs under whatever `python` is on PATH, which must be python 2.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_HIVE = os.path.join(ROOT, 'benchmarks', 'bin')
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+if not os.environ['PATH'].startswith(FAKE_HIVE + os.pathsep):
+    os.environ['PATH'] = FAKE_HIVE + os.pathsep + os.environ['PATH']
+
+import logging
+import unittest
+from threading import Thread
+
+logging.getLogger().addHandler(logging.NullHandler())
+
+class HiveTestCase(unittest.TestCase):
+
+    """Runs against the fake hive.  env is merged into the
+    FAKEHIVE_* settings of every test, which the fake hive reads from
+    its environment."""
+
+    env = {}
+    # seconds before a test that is still blocked counts as hung
+    deadline = 60
+
+    def setUp(self):
+        settings = {'FAKEHIVE_ROWS': '100', 'FAKEHIVE_NULLS': '0.05'}
+        settings.update(self.env)
+        self._saved = dict([(key, os.environ.get(key)) for key in settings])
+        os.environ.update(settings)
+
+    def tearDown(self):
+        for key, value in self._saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    def within(self, function, *args):
+        """Call function in a thread and fail instead of hanging if it
+        does not return before the deadline.  Returns its result."""
+        outcome = {}
+        def call():
+            try:
+                outcome['value'] = function(*args)
+            except Exception, e:
+                outcome['error'] = e
+        thread = Thread(target=call)
+        thread.daemon = True
+        thread.start()
+        thread.join(self.deadline)
+        if thread.isAlive():
+            self.fail('%s still blocked after %ss'
+                      % (function.__name__, self.deadline))
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome.get('value')
@@ -0,0 +1,150 @@
+"""Admission control across cursors, executemany() and scripts."""
+
+import unittest
+from threading import Lock, Thread
+
+import tests  # puts the source tree on sys.path
+from connections import Connection
+from cursors import Cursor
+from scheduler import admission, AdmissionControl
+from errors import OperationalError
+
+class JobCountingCursor(Cursor):
+
+    """Counts the hadoop jobs hive reports running, across cursors."""
+
+    lock = Lock()
+    running = 0
+    peak = 0
+
+    def _command_info_handler(self, id, info):
+        cls = JobCountingCursor
+        cls.lock.acquire()
+        try:
+            if info.startswith('Starting Job'):
+                cls.running += 1
+                cls.peak = max(cls.peak, cls.running)
+            elif info.startswith('Ended Job'):
+                cls.running -= 1
+        finally:
+            cls.lock.release()
+        Cursor._command_info_handler(self, id, info)
+
+
+class AdmissionTest(tests.HiveTestCase):
+
+    env = {'FAKEHIVE_ROWS': '50000'}
+    pool_size = 0
+
+    def setUp(self):
+        tests.HiveTestCase.setUp(self)
+        admission.reset_stats()
+        self.connection = Connection(kill_command=None, verbose=False,
+                                     pool_size=self.pool_size)
+
+    def tearDown(self):
+        self.connection.close()
+        admission.configure()
+        admission.reset_stats()
+        tests.HiveTestCase.tearDown(self)
+
+    def test_two_cursors_in_one_thread(self):
+        # the first cursor's rows are not read yet when the second
+        # query asks for the only slot
+        admission.configure(max_running=1, wait_timeout=30)
+        def run():
+            first = self.connection.cursor()
+            second = self.connection.cursor()
+            first.execute('select 1 from t')
+            second.execute('select 2 from t')
+            return len(first.fetchall()), len(second.fetchall())
+        self.assertEqual(self.within(run), (50000, 50000))
+        self.assertEqual(admission.stats()['running'], 0)
+
+    def test_executemany_beyond_max_running(self):
+        admission.configure(max_running=2, wait_timeout=30)
+        cursor = self.connection.cursor()
+        self.within(cursor.executemany, 'select %s from t',
+                    [(1,), (2,), (3,)], 3)
+        total = len(cursor.fetchall())
+        while cursor.nextset():
+            total += len(cursor.fetchall())
+        self.assertEqual(total, 150000)
+        self.assertEqual(admission.stats()['running'], 0)
+        self.assertEqual(admission.stats()['admitted'], 3)
+
+
+class PooledAdmissionTest(AdmissionTest):
+
+    pool_size = 2
+
+
+class ScriptAdmissionTest(tests.HiveTestCase):
+
+    env = {'FAKEHIVE_ROWS': '100', 'FAKEHIVE_JOB': '0.4'}
+    pool_size = 0
+
+    def setUp(self):
+        tests.HiveTestCase.setUp(self)
+        admission.reset_stats()
+        admission.configure(max_running=1, wait_timeout=30)
+        JobCountingCursor.peak = 0
+        self.connection = Connection(kill_command=None, verbose=False,
+                                     pool_size=self.pool_size)
+
+    def tearDown(self):
+        self.connection.close()
+        admission.configure()
+        admission.reset_stats()
+        tests.HiveTestCase.tearDown(self)
+
+    def batch(self):
+        cursor = self.connection.cursor(JobCountingCursor)
+        cursor.execute_batch(['create table x (a int)', 'select * from t'])
+        while cursor.nextset():
+            cursor.fetchall()
+
+    def test_script_holds_its_slot(self):
+        # the select's job runs after the create reported OK; it must
+        # not run outside the only slot
+        def run():
+            threads = [Thread(target=self.batch) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.within(run)
+        self.assertEqual(JobCountingCursor.peak, 1)
+        self.assertEqual(admission.stats()['admitted'], 4)
+        self.assertEqual(admission.stats()['running'], 0)
+
+
+class PooledScriptAdmissionTest(ScriptAdmissionTest):
+
+    pool_size = 4
+
+
+class AdmissionControlTest(unittest.TestCase):
+
+    def test_wait_timeout(self):
+        control = AdmissionControl(max_running=1, wait_timeout=0.2)
+        ticket = control.acquire('alice')
+        self.assertRaises(OperationalError, control.acquire, 'bob')
+        self.assertEqual(control.stats()['timed_out'], 1)
+        control.release(ticket)
+        control.release(control.acquire('bob'))
+        self.assertEqual(control.stats()['running'], 0)
+
+    def test_queue_limit(self):
+        control = AdmissionControl(max_running=1, max_queued=0)
+        ticket = control.acquire('alice')
+        self.assertRaises(OperationalError, control.acquire, 'bob')
+        self.assertEqual(control.stats()['rejected'], 1)
+        control.release(ticket)
+
+    def test_default_wait_is_finite(self):
+        self.assertEqual(AdmissionControl().wait_timeout, 3600)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""execute_batch(): several statements in one hive invocation."""
+
+import unittest
+
+import tests  # puts the source tree on sys.path
+from connections import Connection
+from errors import DatabaseError
+
+class BatchTest(tests.HiveTestCase):
+
+    env = {'FAKEHIVE_ROWS': '20000'}
+    pool_size = 0
+
+    def setUp(self):
+        tests.HiveTestCase.setUp(self)
+        self.connection = Connection(kill_command=None, verbose=False,
+                                     pool_size=self.pool_size)
+        self.cursor = self.connection.cursor()
+
+    def tearDown(self):
+        self.connection.close()
+        tests.HiveTestCase.tearDown(self)
+
+    def sets(self):
+        counts = [len(self.cursor.fetchall())]
+        while self.cursor.nextset():
+            counts.append(len(self.cursor.fetchall()))
+        return counts
+
+    def test_batch(self):
+        self.within(self.cursor.execute_batch,
+                    ['select 1 from t', 'create table u (c int)',
+                     'select 2 from t'])
+        self.assertEqual(self.within(self.sets), [20000, 0, 20000])
+
+    def test_failure_in_the_middle(self):
+        # hive -e stops at the failure and exits with an error; a
+        # session runs the rest and reports it at the section's end
+        def run():
+            self.cursor.execute_batch(['select 1 from t', 'select fail',
+                                       'select 2 from t'])
+            self.sets()
+        self.assertRaises(DatabaseError, self.within, run)
+
+    def test_next_batch_after_failure(self):
+        def run():
+            self.cursor.execute_batch(['select fail', 'select 2 from t'])
+            self.sets()
+        self.assertRaises(DatabaseError, self.within, run)
+        self.within(self.cursor.execute_batch, ['select 1 from t'])
+        self.assertEqual(self.within(self.sets), [20000])
+
+
+class PooledBatchTest(BatchTest):
+
+    pool_size = 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""Results served from cache.ResultCache."""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import tests  # puts the source tree on sys.path
+from connections import Connection
+from cache import ResultCache, TeeReader
+from errors import OperationalError, ProgrammingError
+
+class CacheTest(tests.HiveTestCase):
+
+    env = {'FAKEHIVE_ROWS': '20000'}
+
+    pool_size = 0
+
+    def setUp(self):
+        tests.HiveTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.cache = ResultCache(self.directory)
+        self.connection = Connection(kill_command=None, verbose=False,
+                                     result_cache=self.cache,
+                                     pool_size=self.pool_size)
+        self.cursor = self.connection.cursor()
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.directory)
+        tests.HiveTestCase.tearDown(self)
+
+    def fetch(self, query):
+        self.cursor.execute(query)
+        return self.cursor.fetchall()
+
+    def leftovers(self):
+        return [name for name in os.listdir(self.directory)
+                if name.startswith('.tmp-')]
+
+    def test_full_read_commits(self):
+        rows = self.within(self.fetch, 'select * from t')
+        self.assertEqual(self.cache.stats()['entries'], 1)
+        self.assertEqual(self.within(self.fetch, 'select  *  from t;'), rows)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cursor._queries[0].__class__.__name__,
+                         'CachedQuery')
+
+    def test_partial_read_aborts_on_reexecute(self):
+        self.cursor.execute('select * from t')
+        self.cursor.fetchmany(10)
+        self.within(self.fetch, 'select 1 from t')
+        self.assertEqual(self.cache.stats()['entries'], 1)
+        self.within(self.fetch, 'select * from t')
+        self.assertEqual(self.cache.hits, 0)
+        self.assertEqual(self.leftovers(), [])
+
+    def test_partial_read_aborts_on_close(self):
+        self.cursor.execute('select * from t')
+        self.cursor.fetchone()
+        self.cursor.close()
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.assertEqual(self.leftovers(), [])
+
+    def test_failure_is_not_cached(self):
+        self.assertRaises(ProgrammingError, self.within, self.fetch,
+                          'select fail from t')
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.assertEqual(self.leftovers(), [])
+
+    def test_bypass(self):
+        self.cursor.cache_ttl = 0
+        self.within(self.fetch, 'select * from t')
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_killed_read_is_not_cached(self):
+        # the first rows are in, the rest is cut off by the timeout
+        tests.os.environ['FAKEHIVE_ROWS'] = '200000'
+        try:
+            self.cursor.execute('select * from t', timeout=1)
+            time.sleep(1.5)
+            self.assertRaises(OperationalError, self.within,
+                              self.cursor.fetchall)
+            self.assertEqual(self.cache.stats()['entries'], 0)
+            self.assertEqual(self.leftovers(), [])
+            self.assertEqual(len(self.within(self.fetch, 'select * from t')),
+                             200000)
+        finally:
+            tests.os.environ['FAKEHIVE_ROWS'] = self.env['FAKEHIVE_ROWS']
+        self.assertEqual(self.cache.hits, 0)
+        self.assertEqual(self.cache.stats()['entries'], 1)
+
+
+class PooledCacheTest(CacheTest):
+
+    pool_size = 1
+
+
+class TeeReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ResultCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def tee(self, complete):
+        stream = StringIO('a\tb\n1\t2\n')
+        stream.complete = complete
+        reader = TeeReader(stream, self.cache.writer('key'))
+        self.assertEqual(list(reader), ['a\tb\n', '1\t2\n'])
+        return self.cache.get('key')
+
+    def test_complete_stream_commits(self):
+        self.assertEqual(self.tee(True).read(), 'a\tb\n1\t2\n')
+
+    def test_stream_cut_short_aborts(self):
+        self.assertEqual(self.tee(False), None)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
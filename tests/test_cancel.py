@@ -0,0 +1,120 @@
+"""Timeouts and cancelled queries on each transport."""
+
+import time
+import unittest
+
+import tests  # puts the source tree on sys.path
+from connections import Connection
+from transports import HiveServer2Transport
+from errors import OperationalError
+from tests.test_transports import FakeServer, SCHEMA
+
+def read_past_timeout(test, timeout):
+    """Start a large select on test.cursor and read on after it timed
+    out: the rows stop short, and reading them must say so."""
+    test.cursor.execute('select * from t', None, timeout)
+    test.cursor.fetchone()
+    time.sleep(timeout + 0.5)
+    try:
+        test.cursor.fetchall()
+    except OperationalError, e:
+        test.assertTrue('timed out' in str(e), e)
+    else:
+        test.fail('the timed out rows ended without an error')
+
+
+class CancelTest(tests.HiveTestCase):
+
+    env = {'FAKEHIVE_ROWS': '200000'}
+
+    def setUp(self):
+        tests.HiveTestCase.setUp(self)
+        self.connection = Connection(kill_command=None, verbose=False)
+        self.cursor = self.connection.cursor()
+
+    def tearDown(self):
+        self.connection.close()
+        tests.HiveTestCase.tearDown(self)
+
+    def fetch(self, query):
+        self.cursor.execute(query)
+        return self.cursor.fetchall()
+
+    def test_timeout_kills_hive(self):
+        tests.os.environ['FAKEHIVE_JOB'] = '30'
+        try:
+            started = time.time()
+            self.assertRaises(OperationalError, self.within,
+                              self.cursor.execute, 'select * from t', None,
+                              0.5)
+        finally:
+            del tests.os.environ['FAKEHIVE_JOB']
+        self.assertTrue(time.time() - started < 10)
+        for query in self.cursor._queries.values():
+            self.assertNotEqual(query.process.poll(), None)
+
+    def test_timeout_while_reading(self):
+        self.within(read_past_timeout, self, 1)
+
+    def test_reexecute_stops_unread_hive(self):
+        self.cursor.execute('select * from t')
+        self.cursor.fetchone()
+        query = self.cursor._queries[0]
+        self.within(self.fetch, 'create table u (c int)')
+        self.assertNotEqual(query.process.poll(), None)
+
+
+class PooledCancelTest(tests.HiveTestCase):
+
+    env = {'FAKEHIVE_ROWS': '200000'}
+
+    def setUp(self):
+        tests.HiveTestCase.setUp(self)
+        self.connection = Connection(kill_command=None, verbose=False,
+                                     pool_size=1)
+        self.cursor = self.connection.cursor()
+
+    def tearDown(self):
+        self.connection.close()
+        tests.HiveTestCase.tearDown(self)
+
+    def fetch(self, query):
+        self.cursor.execute(query)
+        return self.cursor.fetchall()
+
+    def test_timeout_while_reading(self):
+        self.within(read_past_timeout, self, 1)
+        # the killed session is replaced, not reused
+        self.assertEqual(len(self.within(self.fetch, 'select * from t')),
+                         200000)
+
+    def test_abandoned_result_keeps_session(self):
+        self.cursor.execute('select * from t')
+        self.cursor.fetchone()
+        pid = self.cursor._queries[0].process.pid
+        # re-executing drains the unread rows instead of killing hive
+        self.within(self.cursor.execute, 'select * from t')
+        self.assertEqual(self.cursor._queries[0].process.pid, pid)
+        self.assertEqual(len(self.cursor.fetchall()), 200000)
+
+
+class HiveServer2CancelTest(unittest.TestCase):
+
+    def setUp(self):
+        rows = [(i, 0.5, 'a', '[]') for i in xrange(30000)]
+        self.server = FakeServer({'t': (SCHEMA, rows)})
+        self.connection = Connection(
+            verbose=False, user='etl',
+            transport=HiveServer2Transport(connect=self.server.connect))
+        self.cursor = self.connection.cursor()
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_timeout_while_reading(self):
+        read_past_timeout(self, 0.5)
+        self.assertTrue(self.server.clients[0].closed.isSet())
+
+
+if __name__ == '__main__':
+    unittest.main()
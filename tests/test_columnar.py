@@ -0,0 +1,96 @@
+"""Columnar fetches against row fetches."""
+
+import math
+import unittest
+
+import tests  # puts the source tree on sys.path
+from connections import Connection
+from cursors import StoreCursor
+from decoders import null_value
+from columnar import to_columns, numpy
+
+class ColumnarTest(tests.HiveTestCase):
+
+    env = {'FAKEHIVE_ROWS': '2000', 'FAKEHIVE_NULLS': '0.2',
+           'FAKEHIVE_COLUMNS': 'int,float,str,json'}
+
+    def setUp(self):
+        tests.HiveTestCase.setUp(self)
+        self.connection = Connection(kill_command=None, verbose=False)
+
+    def tearDown(self):
+        self.connection.close()
+        tests.HiveTestCase.tearDown(self)
+
+    def rows(self, cursorclass=None):
+        cursor = self.connection.cursor(cursorclass)
+        cursor.execute('select * from t')
+        return cursor.fetchall()
+
+    def columns(self, cursorclass=None, use_numpy=False):
+        cursor = self.connection.cursor(cursorclass)
+        cursor.execute('select * from t')
+        return cursor.fetchall_columnar(use_numpy)
+
+    def check_columns(self, cursorclass=None, use_numpy=False):
+        rows = self.within(self.rows, cursorclass)
+        columns = self.within(self.columns, cursorclass, use_numpy)
+        self.assertEqual(len(columns), 5)
+        for index, column in enumerate(columns):
+            values = [row[index] for row in rows]
+            self.assertEqual(len(column.values), len(values))
+            nulls = column.nulls
+            if nulls is None:
+                nulls = [False] * len(values)
+            elif index:
+                self.assertTrue(any(nulls))
+            null = null_value(column.type)
+            for value, row_value, is_null in zip(column.values, values,
+                                                 nulls):
+                if is_null:
+                    self.assertEqual(row_value, null)
+                else:
+                    self.assertEqual(value, row_value)
+
+    def test_columns_match_rows(self):
+        self.check_columns()
+
+    def test_stored_columns_match_rows(self):
+        self.check_columns(StoreCursor)
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_numpy_columns_match_rows(self):
+        self.check_columns(use_numpy=True)
+
+
+class NumericTest(unittest.TestCase):
+
+    description = (('i', 'int'), ('f', 'float'))
+
+    def convert(self, lines, use_numpy=False):
+        lines = [line + '\n' for line in lines]
+        return [list(column.values)
+                for column in to_columns(lines, self.description, use_numpy)]
+
+    def check(self, use_numpy):
+        self.assertEqual(self.convert(['1\t1.5', 'NULL\t-2E3', '3\tNULL'],
+                                      use_numpy),
+                         [[1, 0, 3], [1.5, -2000.0, 0.0]])
+        # cells the C parsers do not read are converted one by one
+        self.assertEqual(self.convert(['1.0\t.5', '007\t1e-05'], use_numpy),
+                         [[1, 7], [0.5, 1e-05]])
+        ints, floats = self.convert(['1\tNaN', '2\tInfinity'], use_numpy)
+        self.assertTrue(math.isnan(floats[0]))
+        self.assertEqual(floats[1], float('inf'))
+        self.assertRaises(ValueError, self.convert, ['1\ttrue'], use_numpy)
+
+    def test_numbers(self):
+        self.check(False)
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_numpy_numbers(self):
+        self.check(True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""Exporting results with copy_to()."""
+
+import unittest
+from StringIO import StringIO
+
+import tests  # puts the source tree on sys.path
+from connections import Connection
+import export
+
+class ExportTest(tests.HiveTestCase):
+
+    env = {'FAKEHIVE_ROWS': '2000', 'FAKEHIVE_NULLS': '0.2',
+           'FAKEHIVE_COLUMNS': 'str'}
+
+    def setUp(self):
+        tests.HiveTestCase.setUp(self)
+        self.connection = Connection(kill_command=None, verbose=False)
+
+    def tearDown(self):
+        self.connection.close()
+        tests.HiveTestCase.tearDown(self)
+
+    def test_csv_null(self):
+        cursor = self.connection.cursor()
+        cursor.execute('select * from t')
+        out = StringIO()
+        self.assertEqual(cursor.copy_to(out, format='csv', null='\\N'), 2000)
+        cells = [line.split(',')[1] for line in out.getvalue().splitlines()]
+        self.assertTrue('\\N' in cells)
+        self.assertFalse('NULL' in cells)
+
+    def test_csv_null_keeps_empty_cells(self):
+        out = StringIO()
+        rows = export.copy(['a\t\tNULL\n', 'NULL\tb\t\n'], out, 'csv',
+                           (('x', 'str'), ('y', 'str'), ('z', 'str')), None,
+                           null='\\N')
+        self.assertEqual(rows, 2)
+        self.assertEqual(out.getvalue(), 'a,,\\N\n\\N,b,\n')
+
+    def test_tsv_is_hive_output(self):
+        cursor = self.connection.cursor()
+        cursor.execute('select * from t')
+        out = StringIO()
+        self.assertEqual(cursor.copy_to(out, header=True), 2000)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 't.c0\tt.c1')
+        self.assertEqual(len(lines), 2001)
+        self.assertTrue('NULL' in [line.split('\t')[1] for line in lines])
+
+
+if __name__ == '__main__':
+    unittest.main()
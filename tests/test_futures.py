@@ -0,0 +1,68 @@
+"""execute_async() and Connection.submit() on the CLI."""
+
+import unittest
+from threading import Event
+
+import tests  # puts the source tree on sys.path
+from connections import Connection
+from errors import OperationalError, ProgrammingError
+
+class FutureTest(tests.HiveTestCase):
+
+    env = {'FAKEHIVE_ROWS': '20'}
+
+    def setUp(self):
+        tests.HiveTestCase.setUp(self)
+        self.connection = Connection(kill_command=None, verbose=False)
+
+    def tearDown(self):
+        self.connection.close()
+        tests.HiveTestCase.tearDown(self)
+
+    def test_result_is_ready_to_fetch(self):
+        # the cursor's description must be set by the time result()
+        # returns, however the threads are scheduled
+        def run():
+            for i in range(30):
+                cursor = self.connection.submit('select * from t').result()
+                self.assertEqual(cursor.description[0][0], 't.c0')
+                self.assertEqual(len(cursor.fetchall()), 20)
+        self.within(run)
+
+    def test_many_in_flight(self):
+        futures = [self.connection.submit('select %d from t' % i)
+                   for i in range(8)]
+        counts = [len(self.within(future.result).fetchall())
+                  for future in futures]
+        self.assertEqual(counts, [20] * 8)
+
+    def test_callback_may_wait_for_result(self):
+        cursor = self.connection.cursor()
+        future = cursor.execute_async('select * from t')
+        seen = []
+        called = Event()
+        def done(future):
+            seen.append(future.result() is cursor)
+            called.set()
+        future.add_done_callback(done)
+        self.within(future.result)
+        self.assertTrue(called.wait(10))
+        self.assertEqual(seen, [True])
+
+    def test_failure(self):
+        future = self.connection.submit('select fail from t')
+        self.assertRaises(ProgrammingError, self.within, future.result)
+
+    def test_cancel(self):
+        tests.os.environ['FAKEHIVE_JOB'] = '30'
+        try:
+            future = self.connection.submit('select * from t')
+        finally:
+            del tests.os.environ['FAKEHIVE_JOB']
+        self.assertTrue(future.cancel())
+        self.assertRaises(OperationalError, self.within, future.result)
+        self.assertTrue(future.cancelled())
+
+
+if __name__ == '__main__':
+    unittest.main()
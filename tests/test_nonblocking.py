@@ -0,0 +1,82 @@
+"""Queries run from the event loop of AsyncConnection."""
+
+import time
+import unittest
+
+import tests  # puts the source tree on sys.path
+from nonblocking import AsyncConnection, EventLoop
+from errors import NotSupportedError, OperationalError, ProgrammingError
+
+class AsyncTest(tests.HiveTestCase):
+
+    env = {'FAKEHIVE_ROWS': '50000'}
+
+    def setUp(self):
+        tests.HiveTestCase.setUp(self)
+        self.connection = AsyncConnection(loop=EventLoop(), kill_command=None,
+                                          verbose=False)
+        self.cursor = self.connection.cursor()
+
+    def tearDown(self):
+        self.cursor.close()
+        tests.HiveTestCase.tearDown(self)
+
+    def test_fetchall_beyond_readahead(self):
+        def run():
+            self.cursor.execute('select * from t').result()
+            return self.cursor.fetchall().result()
+        rows = self.within(run)
+        self.assertEqual(len(rows), 50000)
+        self.assertEqual(rows[-1][0], 49999)
+
+    def test_fetchall_before_execute_is_done(self):
+        def run():
+            execute = self.cursor.execute('select * from t')
+            rows = self.cursor.fetchall()
+            execute.result()
+            return rows.result()
+        self.assertEqual(len(self.within(run)), 50000)
+
+    def test_fetchmany(self):
+        def run():
+            self.cursor.execute('select * from t').result()
+            sizes = []
+            while True:
+                rows = self.cursor.fetchmany(20000).result()
+                if not rows:
+                    return sizes
+                sizes.append(len(rows))
+        self.assertEqual(self.within(run), [20000, 20000, 10000])
+
+    def test_failure(self):
+        future = self.cursor.execute('select fail')
+        self.assertRaises(ProgrammingError, self.within, future.result)
+
+    def test_cancel_kills_hive(self):
+        tests.os.environ['FAKEHIVE_JOB'] = '30'
+        try:
+            future = self.cursor.execute('select * from t')
+        finally:
+            del tests.os.environ['FAKEHIVE_JOB']
+        process = self.cursor._query.process
+        self.connection.loop.run_once(0.1)
+        started = time.time()
+        future.cancel()
+        self.assertTrue(time.time() - started < 10)
+        self.assertNotEqual(process.poll(), None)
+        self.assertRaises(OperationalError, future.result)
+
+    def test_submit(self):
+        future = self.connection.submit('select * from t')
+        cursor = self.within(future.result)
+        self.assertEqual(len(self.within(cursor.fetchall().result)), 50000)
+
+    def test_unsupported_options(self):
+        for option in ['pool_size', 'timeout', 'result_cache', 'instrument',
+                       'resolve_types', 'priority', 'progress']:
+            self.assertRaises(NotSupportedError, AsyncConnection,
+                              loop=EventLoop(), **{option: 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
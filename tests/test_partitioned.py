@@ -0,0 +1,61 @@
+"""Merging the output of partition queries."""
+
+import unittest
+from StringIO import StringIO
+
+import tests  # puts the source tree on sys.path
+from partitioned import PartitionedResult, restrict
+
+class Done(object):
+
+    """What PartitionedResult.finish() reads of a Query."""
+
+    exc_info = None
+
+    def __init__(self, id):
+        self.id = id
+
+
+class MergeTest(unittest.TestCase):
+
+    def merge(self, partitions, types=None):
+        result = PartitionedResult(len(partitions), ['k'], types=types)
+        for index, keys in enumerate(partitions):
+            lines = ['%s\t%d\n' % (key, index) for key in keys]
+            result.feed(index, StringIO('t.k\tt.v\n' + ''.join(lines)))
+            result.finish(Done(index))
+        self.assertEqual(result.readline(), 't.k\tt.v\n')
+        return [line.split('\t')[0] for line in iter(result.readline, '')]
+
+    def test_strings_merge_as_text(self):
+        # hive sorted a string column lexicographically
+        self.assertEqual(self.merge([['10', '9'], ['100', '95']],
+                                    lambda columns: ['str']),
+                         ['10', '100', '9', '95'])
+
+    def test_unknown_type_follows_hive_order(self):
+        self.assertEqual(self.merge([['10', '9'], ['100', '95']]),
+                         ['10', '100', '9', '95'])
+        self.assertEqual(self.merge([['9', '10'], ['95', '100']]),
+                         ['9', '10', '95', '100'])
+
+    def test_numbers_merge_by_value(self):
+        self.assertEqual(self.merge([['9', '10'], ['95', '100']],
+                                    lambda columns: ['int']),
+                         ['9', '10', '95', '100'])
+        self.assertEqual(self.merge([['NULL', '1.5', '9'], ['2', '10']],
+                                    lambda columns: ['float']),
+                         ['NULL', '1.5', '2', '9', '10'])
+
+
+class RestrictTest(unittest.TestCase):
+
+    def test_where_and_order(self):
+        self.assertEqual(restrict('select * from t where a = 1 limit 5',
+                                  'ds = 1', ['k']),
+                         'select * from t where (a = 1) AND (ds = 1) '
+                         'ORDER BY k limit 5')
+
+
+if __name__ == '__main__':
+    unittest.main()
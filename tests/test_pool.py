@@ -0,0 +1,97 @@
+"""Pooled hive sessions."""
+
+import os
+import time
+import signal
+import unittest
+from threading import Event, Thread
+
+import tests  # puts the source tree on sys.path
+from connections import Connection
+from pool import SessionPool
+from errors import OperationalError, ProgrammingError
+
+class PooledTest(tests.HiveTestCase):
+
+    env = {'FAKEHIVE_ROWS': '20000'}
+
+    def setUp(self):
+        tests.HiveTestCase.setUp(self)
+        self.connection = Connection(kill_command=None, verbose=False,
+                                     pool_size=1)
+        self.cursor = self.connection.cursor()
+
+    def tearDown(self):
+        self.connection.close()
+        tests.HiveTestCase.tearDown(self)
+
+    def test_large_result(self):
+        self.within(self.cursor.execute, 'select * from t')
+        self.assertEqual(len(self.within(self.cursor.fetchall)), 20000)
+
+    def test_failure_does_not_leak_into_next_query(self):
+        self.assertRaises(ProgrammingError, self.within,
+                          self.cursor.execute, 'select fail')
+        self.within(self.cursor.execute, 'select * from t')
+        self.assertEqual(len(self.cursor.fetchall()), 20000)
+
+    def test_session_death_is_an_error(self):
+        self.cursor.execute('select * from t')
+        self.cursor.fetchone()
+        process = self.cursor._queries[0].process
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+        self.assertRaises(OperationalError, self.within,
+                          self.cursor.fetchall)
+        # the pool starts a new session for the next query
+        self.within(self.cursor.execute, 'select * from t')
+        self.assertNotEqual(self.cursor._queries[0].process.pid,
+                            process.pid)
+        self.assertEqual(len(self.cursor.fetchall()), 20000)
+
+
+class SlowSession(object):
+
+    """A Session whose health check blocks until released."""
+
+    uses = 0
+    last_used = 0
+
+    def __init__(self):
+        self.pinging = Event()
+        self.answer = Event()
+
+    def alive(self):
+        return True
+
+    def ping(self):
+        self.pinging.set()
+        self.answer.wait(30)
+        return True
+
+
+class SessionPoolTest(unittest.TestCase):
+
+    def test_ping_does_not_block_checkin(self):
+        pool = SessionPool(['hive'], size=2, ping_after=0)
+        slow = SlowSession()
+        pool._idle.append(slow)
+        pool._count = 1
+        taken = []
+        checkout = Thread(target=lambda: taken.append(pool.checkout()))
+        checkout.daemon = True
+        checkout.start()
+        self.assertTrue(slow.pinging.wait(30))
+        started = time.time()
+        other = SlowSession()
+        other.answer.set()
+        pool.checkin(other)
+        self.assertTrue(time.time() - started < 1)
+        self.assertEqual(pool.checkout(timeout=1), other)
+        slow.answer.set()
+        checkout.join(30)
+        self.assertEqual(taken, [slow])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""Queries run by `hive -e`, one process each."""
+
+import unittest
+
+import tests  # puts the source tree on sys.path
+from connections import Connection
+from errors import ProgrammingError
+
+class QueryTest(tests.HiveTestCase):
+
+    env = {'FAKEHIVE_ROWS': '50000'}
+
+    def setUp(self):
+        tests.HiveTestCase.setUp(self)
+        self.connection = Connection(kill_command=None, verbose=False)
+        self.cursor = self.connection.cursor()
+
+    def tearDown(self):
+        self.connection.close()
+        tests.HiveTestCase.tearDown(self)
+
+    def fetch(self, query):
+        self.cursor.execute(query)
+        return self.cursor.fetchall()
+
+    def test_ok_before_rows(self):
+        # hive writes OK on stderr before the rows; execute() must not
+        # wait for hive to exit while nobody reads the rows
+        rows = self.within(self.fetch, 'select * from t')
+        self.assertEqual(len(rows), 50000)
+        self.assertEqual(rows[0][0], 0)
+        self.assertEqual(rows[-1][0], 49999)
+
+    def test_ok_after_rows(self):
+        tests.os.environ['FAKEHIVE_OK_AFTER'] = '1'
+        try:
+            rows = self.within(self.fetch, 'select * from t')
+        finally:
+            del tests.os.environ['FAKEHIVE_OK_AFTER']
+        self.assertEqual(len(rows), 50000)
+
+    def test_statement_without_rows(self):
+        self.assertEqual(self.within(self.fetch, 'create table t (c int)'),
+                         [])
+
+    def test_failure(self):
+        self.assertRaises(ProgrammingError, self.within, self.fetch,
+                          'select fail from t')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""executemany() on the QueryScheduler."""
+
+import unittest
+
+import tests  # puts the source tree on sys.path
+from connections import Connection
+from errors import ProgrammingError
+
+class ExecuteManyTest(tests.HiveTestCase):
+
+    env = {'FAKEHIVE_ROWS': '50000'}
+
+    def setUp(self):
+        tests.HiveTestCase.setUp(self)
+        self.connection = Connection(kill_command=None, verbose=False)
+        self.cursor = self.connection.cursor()
+
+    def tearDown(self):
+        self.connection.close()
+        tests.HiveTestCase.tearDown(self)
+
+    def sets(self):
+        counts = [len(self.cursor.fetchall())]
+        while self.cursor.nextset():
+            counts.append(len(self.cursor.fetchall()))
+        return counts
+
+    def test_leaves_no_hive_running(self):
+        # each worker reads its query's output before taking the next,
+        # so no more than concurrency hive processes are ever alive
+        self.within(self.cursor.executemany, 'select %s from t',
+                    [(1,), (2,), (3,)], 2)
+        for query in self.cursor._queries.values():
+            self.assertNotEqual(query.process.poll(), None)
+        self.assertEqual(self.sets(), [50000] * 3)
+
+    def test_fail_fast(self):
+        self.assertRaises(ProgrammingError, self.within,
+                          self.cursor.executemany, 'select %s from t',
+                          [('1',), ('fail',), ('3',)], 1)
+
+    def test_collect_errors(self):
+        self.within(self.cursor.executemany, 'select %s from t',
+                    [('1',), ('fail',), ('3',)], 2, False)
+        self.assertEqual([error[0] for error in self.cursor.errors], [1])
+        self.assertEqual(self.sets(), [50000, 0, 50000])
+
+
+if __name__ == '__main__':
+    unittest.main()
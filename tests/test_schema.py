@@ -0,0 +1,74 @@
+"""Resolving result column types from table schemas."""
+
+import unittest
+
+import tests  # puts the source tree on sys.path
+from schema import SchemaCache, SchemaResolver, select_items
+
+class ResolveTest(unittest.TestCase):
+
+    def setUp(self):
+        cache = SchemaCache()
+        cache.put(('table', 'users'), {'id': 'bigint', 'name': 'string',
+                                       'score': 'double'})
+        cache.put(('table', 'orders'), {'id': 'bigint', 'total': 'double'})
+        self.resolver = SchemaResolver(None, cache)
+
+    def resolve(self, query, columns):
+        return self.resolver.resolve(query, columns)
+
+    def test_bare_columns(self):
+        self.assertEqual(self.resolve('SELECT id, name FROM users',
+                                      ['id', 'name']), ['int', 'str'])
+        self.assertEqual(self.resolve('select u.id, `name` from users u',
+                                      ['u.id', 'name']), ['int', 'str'])
+
+    def test_alias_takes_the_source_column(self):
+        # the header names the alias, not a column of users
+        self.assertEqual(self.resolve('SELECT name AS id FROM users',
+                                      ['id']), ['str'])
+        self.assertEqual(self.resolve('SELECT u.name id FROM users u',
+                                      ['id']), ['str'])
+        self.assertEqual(self.resolve('SELECT DISTINCT score AS name '
+                                      'FROM users', ['name']), ['float'])
+
+    def test_expressions_are_unknown(self):
+        for query in ['SELECT id + 1 AS id FROM users',
+                      "SELECT concat(name, 'x') id FROM users",
+                      'SELECT count(*) AS id FROM users',
+                      'SELECT CASE WHEN id > 0 THEN name END AS id '
+                      'FROM users',
+                      'SELECT cast(name AS bigint) FROM users']:
+            self.assertEqual(self.resolve(query, ['id']), [None], query)
+        # unnamed expressions come back as _c0, ...
+        self.assertEqual(self.resolve('SELECT id, upper(name) FROM users',
+                                      ['id', '_c1']), ['int', None])
+
+    def test_stars(self):
+        self.assertEqual(self.resolve('SELECT * FROM users',
+                                      ['users.id', 'users.name']),
+                         ['int', 'str'])
+        self.assertEqual(self.resolve('SELECT u.*, length(name) AS id '
+                                      'FROM users u',
+                                      ['u.id', 'u.name', 'id']),
+                         ['int', 'str', None])
+
+    def test_ambiguous_column(self):
+        self.assertEqual(self.resolve('SELECT id, total FROM users u '
+                                      'JOIN orders o ON u.id = o.id',
+                                      ['id', 'total']), ['int', 'float'])
+        self.assertEqual(self.resolve('SELECT score AS total, o.total '
+                                      'FROM users u JOIN orders o '
+                                      'ON u.id = o.id',
+                                      ['total', 'total']),
+                         ['float', 'float'])
+
+    def test_select_items(self):
+        self.assertEqual(select_items("select a, f(b, c) x, 'd,e' "
+                                      "from t where g(h) > 1"),
+                         ['a', 'f(b, c) x', "'d,e'"])
+        self.assertEqual(select_items('show tables'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+"""HiveServer2Transport against a stand-in for a pyhs2 server."""
+
+import unittest
+from threading import Event
+from StringIO import StringIO
+
+import tests  # puts the source tree on sys.path
+import cursors
+from connections import Connection
+from transports import HiveServer2Transport, split_statements
+from errors import Error, OperationalError
+
+class ServerError(Exception):
+
+    """Raised like pyhs2's Pyhs2Exception, with errorMessage."""
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+        self.errorMessage = message
+
+
+class FakeServer(object):
+
+    """Tables of typed rows, served through connect() with pyhs2's
+    signature.  Statements containing `fail` fail and those
+    containing `slow` block until their connection is closed."""
+
+    def __init__(self, tables=None):
+        self.tables = tables or {}
+        self.clients = []
+        self.statements = []
+
+    def connect(self, host, port, authMechanism, user, password, database):
+        client = FakeClient(self)
+        self.clients.append(client)
+        return client
+
+
+class FakeClient(object):
+
+    def __init__(self, server):
+        self.server = server
+        self.closed = Event()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed.set()
+
+
+class FakeCursor(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.schema = None
+        self.rows = []
+
+    def execute(self, statement):
+        server = self.client.server
+        server.statements.append(statement)
+        if 'slow' in statement:
+            self.client.closed.wait(10)
+        if self.client.closed.isSet():
+            raise ServerError('connection closed')
+        if 'fail' in statement:
+            raise ServerError('Error while compiling statement: %s'
+                              % statement)
+        for table, (schema, rows) in server.tables.items():
+            if statement.lower().startswith('select') and table in statement:
+                self.schema = [{'columnName': name, 'type': type}
+                               for name, type in schema]
+                self.rows = list(rows)
+
+    def getSchema(self):
+        if self.schema is None:
+            raise ServerError('no result set')
+        return self.schema
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+SCHEMA = [('t.id', 'BIGINT_TYPE'), ('t.score', 'DOUBLE_TYPE'),
+          ('t.name', 'STRING_TYPE'), ('t.tags', 'ARRAY_TYPE')]
+ROWS = [(1, 0.5, 'a', '["x", "y"]'),
+        (2, None, None, None),
+        (3, 1.5, u'\xe9', '[]')]
+
+
+class HiveServer2TransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer({'t': (SCHEMA, ROWS)})
+        self.transport = HiveServer2Transport(connect=self.server.connect)
+        self.connection = Connection(verbose=False, user='etl',
+                                     transport=self.transport)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_typed_rows(self):
+        cursor = self.connection.cursor()
+        cursor.execute('select * from t')
+        self.assertEqual(cursor.description,
+                         (('t.id', 'int'), ('t.score', 'float'),
+                          ('t.name', 'str'), ('t.tags', 'json')))
+        self.assertEqual(cursor.fetchall(),
+                         [(1, 0.5, 'a', ['x', 'y']),
+                          (2, 0.0, '', None),
+                          (3, 1.5, u'\xe9', [])])
+
+    def test_text_output(self):
+        cursor = self.connection.cursor()
+        cursor.execute('select * from t')
+        out = StringIO()
+        self.assertEqual(cursor.copy_to(out, header=True), 3)
+        self.assertEqual(out.getvalue().splitlines(),
+                         ['t.id\tt.score\tt.name\tt.tags',
+                          '1\t0.5\ta\t["x", "y"]',
+                          '2\tNULL\tNULL\tNULL',
+                          '3\t1.5\t\xc3\xa9\t[]'])
+
+    def test_triggered_cursor_reads_text(self):
+        cursor = self.connection.cursor(cursors.TriggeredCursor)
+        cursor.settriggers(('t.id',))
+        cursor.execute('select * from t')
+        sets = [cursor.fetchall()]
+        while cursor.nextset():
+            sets.append(cursor.fetchall())
+        self.assertEqual([len(rows) for rows in sets], [1, 1, 1])
+
+    def test_statement_without_result(self):
+        cursor = self.connection.cursor()
+        cursor.execute('create table u (a int)')
+        self.assertEqual(cursor.description, None)
+        self.assertEqual(cursor.fetchall(), [])
+
+    def test_connections_are_reused(self):
+        cursor = self.connection.cursor()
+        for i in range(3):
+            cursor.execute('select * from t')
+            cursor.fetchall()
+        self.assertEqual(len(self.server.clients), 1)
+        self.assertEqual(self.server.statements[0],
+                         'SET mapred.fairscheduler.pool=etl')
+
+    def test_failure(self):
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute('select fail from t')
+        except Error, e:
+            self.assertTrue('FAILED: Error while compiling' in str(e))
+        else:
+            self.fail('no error raised')
+        # a failed connection is not reused
+        self.assertTrue(self.server.clients[0].closed.isSet())
+        cursor.execute('select * from t')
+        self.assertEqual(len(cursor.fetchall()), 3)
+
+    def test_cancel(self):
+        cursor = self.connection.cursor()
+        future = cursor.execute_async('select slow from t')
+        while not self.server.clients:
+            self.assertFalse(future.done())
+            future.query.wait(0.01)
+        self.assertTrue(future.cancel())
+        self.assertRaises(OperationalError, future.result, 5)
+        self.assertTrue(future.cancelled())
+        self.assertTrue(self.server.clients[0].closed.isSet())
+
+    def test_split_statements(self):
+        self.assertEqual(split_statements("set a=1; select ';' from t;"),
+                         ['set a=1', "select ';' from t"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,419 @@
+"""
+Hive db transports
+This module separates how statements reach hive from the cursors.
+A transport turns a statement into a Query: a thread that runs it,
+hands its output to the cursor and can be cancelled or timed out.
+
+CLITransport
+    the HIVE CLI, one `hive -e` process per query or a pooled
+    session (the default)
+
+HiveServer2Transport
+    a HiveServer2 server over its thrift socket protocol, through
+    the pyhs2 package.  Connections to the server are kept open and
+    reused, so there is no process to start, and rows arrive typed
+    instead of as text.
+
+    connection = Connection(transport=HiveServer2Transport(
+        host='hive.example.com', port=10000))
+"""
+
+import logging
+from collections import deque
+from threading import Lock
+import simplejson as json
+from query import Query, split_statements, ok_count
+from pool import SessionQuery
+from schema import hive_type
+from decoders import convert, null_value
+from errors import NotSupportedError, OperationalError
+
+try:
+    import pyhs2
+except ImportError:
+    pyhs2 = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+class Transport(object):
+
+    """Interface of transports.
+
+    scripts is true if one query may run several statements with
+    their output concatenated, as batch.py relies on.
+    """
+
+    scripts = True
+
+    def open(self, connection):
+        """Called once by the Connection the transport serves."""
+        self.connection = connection
+
+    def query(self, id, statement, info=None, error=None, output=None):
+        """A Query (not started yet) running statement as result set
+        id.  Its thread calls output(id, stream) with a file-like
+        stream whose first line is the header, info(id, message) for
+        progress and error(id, message) if the statement failed."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class CLITransport(Transport):
+
+    """Statements run by the HIVE CLI, or by the connection's pool of
+    hive sessions when it has one."""
+
+    def query(self, id, statement, info=None, error=None, output=None):
+        connection = self.connection
+        statement = connection._hive_statement(statement)
+        if connection.pool is not None:
+            query = SessionQuery(id, connection.pool, statement, info=info,
+                                 error=error, output=output)
+        else:
+            command = connection._hive_command() + ['-e', '"%s"' % statement]
+            query = Query(id, command, info=info, error=error, output=output)
+        query.oks = ok_count(statement)
+        return query
+
+    def close(self):
+        if self.connection.pool is not None:
+            self.connection.pool.close()
+
+
+class HiveServer2Transport(Transport):
+
+    """Statements run on a HiveServer2 server.
+
+    host, port, user, password, database, auth
+        where and how to connect; auth is the SASL mechanism, e.g.
+        'PLAIN', 'NOSASL' or 'KERBEROS'.  user defaults to the
+        connection's.
+
+    size
+        integer, default 2.  idle server connections kept for reuse.
+        more are opened while all of them are busy.
+
+    settings
+        dict of hive settings made once on every server connection.
+        the fair scheduler pool is set from the user like the CLI
+        transport does.
+
+    connect
+        callable opening a server connection, default pyhs2.connect.
+        anything with pyhs2's connect() signature and cursor API
+        (execute, getSchema, fetchmany, close) works.
+
+    The server reads LOAD DATA LOCAL paths from its own file system,
+    so load_rows() only works when the server shares it.
+    """
+
+    scripts = False
+
+    def __init__(self, host='localhost', port=10000, user=None,
+                 password=None, database='default', auth='PLAIN', size=2,
+                 settings=None, connect=None):
+        if connect is None:
+            if pyhs2 is None:
+                raise NotSupportedError('HiveServer2Transport needs the '
+                                        'pyhs2 package')
+            connect = pyhs2.connect
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.database = database
+        self.auth = auth
+        self.size = size
+        self.settings = dict(settings or {})
+        self._connect = connect
+        self._idle = []
+        self._lock = Lock()
+        self.closed = False
+
+    def open(self, connection):
+        Transport.open(self, connection)
+        if self.user is None:
+            self.user = connection.user
+        if connection.user:
+            self.settings.setdefault('mapred.fairscheduler.pool',
+                                     connection.user)
+
+    def query(self, id, statement, info=None, error=None, output=None):
+        return HiveServer2Query(id, self, statement, info=info, error=error,
+                                output=output)
+
+    def checkout(self):
+        """An open server connection, reused when one is idle."""
+        self._lock.acquire()
+        try:
+            if self.closed:
+                raise OperationalError('transport is closed')
+            if self._idle:
+                return self._idle.pop()
+        finally:
+            self._lock.release()
+        client = self._connect(host=self.host, port=self.port,
+                               authMechanism=self.auth, user=self.user,
+                               password=self.password,
+                               database=self.database)
+        for key, value in sorted(self.settings.items()):
+            cursor = client.cursor()
+            try:
+                cursor.execute('SET %s=%s' % (key, value))
+            finally:
+                cursor.close()
+        return client
+
+    def checkin(self, client):
+        self._lock.acquire()
+        try:
+            if not self.closed and len(self._idle) < self.size:
+                self._idle.append(client)
+                return
+        finally:
+            self._lock.release()
+        self.discard(client)
+
+    def discard(self, client):
+        try:
+            client.close()
+        except Exception, e:
+            logger.info('Closing server connection failed: %s', e)
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self.closed = True
+            idle, self._idle = self._idle, []
+        finally:
+            self._lock.release()
+        for client in idle:
+            self.discard(client)
+
+
+class HiveServer2Query(Query):
+
+    """Query run on a HiveServer2 connection.  Statements of a
+    script run in order on the same server connection; the result is
+    the last one's."""
+
+    def __init__(self, id, transport, statement, info=None, error=None,
+                 output=None):
+        Query.__init__(self, id, statement, info, error, output)
+        self.transport = transport
+        self.client = None
+
+    def execute(self):
+        logger.info('Run server query id=%s', self.id)
+        self._check_cancelled()
+        self._start_timer()
+        client = self.transport.checkout()
+        self._lock.acquire()
+        try:
+            self.client = client
+        finally:
+            self._lock.release()
+        if self.cancelled:
+            self._kill()
+        stats = self.stats
+        if stats is not None:
+            stats.source = 'hs2'
+            stats.mark('spawn')
+        cursor = None
+        try:
+            for statement in split_statements(self.command):
+                self._check_cancelled()
+                if cursor is not None:
+                    cursor.close()
+                cursor = client.cursor()
+                cursor.execute(statement)
+        except Exception, e:
+            self._stop_timer()
+            self.transport.discard(client)
+            self._check_cancelled()
+            message = 'FAILED: %s' % getattr(e, 'errorMessage', e)
+            self.failed = message
+            if self.info_cb:
+                self.info_cb(self.id, message)
+            if self.error_cb:
+                self.error_cb(self.id, message)
+            raise OperationalError(message)
+        if stats is not None:
+            stats.mark('job')
+        self.result = HiveServer2Result(self.transport, client, cursor,
+                                        stats, self._stop_timer)
+        self.output_cb(self.id, self.result)
+
+    def _running(self):
+        if self.result is None:
+            return not self.ready
+        return not self.result.closed
+
+    def _killable(self):
+        return self.client is not None
+
+    def discard(self):
+        # a result can be closed without giving up its server
+        # connection; only a running statement is cancelled
+        if self.result is None:
+            self.cancel()
+        else:
+            self.result.close()
+
+    def _kill(self):
+        # closing the server connection ends its session, and the
+        # operations running in it
+        self._stop_timer()
+        if self.result is not None and not self.result.closed:
+            # what the reader of the rows sees instead of their end
+            self.result.error = 'query %s %s' % (self.id, self.cancelled)
+            self.result.closed = True
+        if self.client is not None:
+            self.transport.discard(self.client)
+
+def _server_type(type):
+    """cursors type name of a pyhs2 schema type such as BIGINT_TYPE."""
+    type = type.lower()
+    if type.endswith('_type'):
+        type = type[:-5]
+    return hive_type(type)
+
+def _text(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return value and 'true' or 'false'
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+class HiveServer2Result(object):
+
+    """Rows of one statement run on HiveServer2.  next_row() returns
+    them typed, decoded as the CLI cursors would (NULL included);
+    readline() gives the CLI's text output, header first, for
+    everything that reads text.  complete is set once the server has
+    no more rows; if the query is cancelled first, both raise
+    OperationalError with the reason once the rows fetched are
+    read."""
+
+    fetch_size = 10000
+
+    def __init__(self, transport, client, cursor, stats=None, on_done=None):
+        self.transport = transport
+        self.client = client
+        self.cursor = cursor
+        self.stats = stats
+        self.on_done = on_done
+        self.closed = False
+        self.complete = False
+        # why the rows ended early, set when the query is cancelled
+        self.error = None
+        self.description = None
+        self._rows = deque()
+        try:
+            schema = cursor.getSchema()
+        except Exception:
+            # statements without a result set
+            schema = None
+        if schema:
+            self.description = tuple([(column['columnName'],
+                                       _server_type(column['type']))
+                                      for column in schema])
+            self._header = '\t'.join([column[0]
+                                      for column in self.description]) + '\n'
+            self._prepare()
+        else:
+            self._header = ''
+            self.complete = True
+            self._release()
+
+    def _prepare(self):
+        types = [column[1] for column in self.description]
+        self._nulls = [null_value(type) for type in types]
+        # server values that still need converting: complex types
+        # arrive as json text, registered types as strings
+        self._converted = [(index, type) for index, type in enumerate(types)
+                           if type not in ('int', 'float', 'str')]
+
+    def _fill(self):
+        if self.error:
+            raise OperationalError(self.error)
+        if self.closed:
+            return False
+        try:
+            rows = self.cursor.fetchmany(self.fetch_size)
+        except Exception, e:
+            self._release()
+            if self.error:
+                raise OperationalError(self.error)
+            raise OperationalError('fetching from the server failed: %s' % e)
+        if not rows:
+            self.complete = True
+            self._release()
+            return False
+        if self.stats is not None:
+            self.stats.mark('first_row')
+        self._rows.extend(rows)
+        return True
+
+    def _next(self):
+        if not self._rows and not self._fill():
+            return None
+        return self._rows.popleft()
+
+    def next_row(self):
+        """The next row as a tuple of decoded values, None at the
+        end."""
+        row = self._next()
+        if row is None:
+            return None
+        row = list(row)
+        for index, type in self._converted:
+            value = row[index]
+            if isinstance(value, basestring):
+                row[index] = convert(type, value)
+        if None in row:
+            nulls = self._nulls
+            row = [nulls[index] if value is None else value
+                   for index, value in enumerate(row)]
+        return tuple(row)
+
+    def readline(self):
+        if self._header:
+            header, self._header = self._header, ''
+            return header
+        row = self._next()
+        if row is None:
+            return ''
+        line = '\t'.join([_text(value) for value in row]) + '\n'
+        if self.stats is not None:
+            self.stats.bytes_read += len(line)
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def _release(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.cursor.close()
+        except Exception, e:
+            logger.info('Closing server cursor failed: %s', e)
+        self.transport.checkin(self.client)
+        if self.on_done is not None:
+            self.on_done()
+
+    def close(self):
+        self._rows.clear()
+        self._release()